@@ -0,0 +1,127 @@
+"""
+JSON microbenchmark: Flask's default jsonify/get_json path vs utils.serialization.
+Times a typical /search response and a typical /vision request (a 1.5 MB image
+as base64), and the peak memory of parsing the /vision body.
+
+Usage:
+    python3 benchmarks/serialization.py --image-kb 1500
+"""
+
+import os
+import sys
+import json
+import base64
+import timeit
+import argparse
+import binascii
+import tempfile
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+
+def search_response() -> Dict[str, Any]:
+    """Shape of a /search result with citations, images and rendered chunks."""
+    text = ("A fotossíntese é o processo pelo qual plantas, algas e algumas bactérias "
+            "convertem energia luminosa em energia química. ") * 30
+    return {
+        "text": text,
+        "citations": [
+            {"title": f"Fonte {i} — Biologia", "url": f"https://example.com/artigo/{i}", "snippet": text[:200]}
+            for i in range(8)
+        ],
+        "images": [f"https://images.example.com/{i}.jpg" for i in range(4)],
+        "model_used": "sonar-pro",
+        "focus_mode": "web",
+        "response_time_ms": 2345,
+        "cached": False,
+        "timestamp": "2026-10-19T12:00:00",
+        "chunks": [text]
+    }
+
+
+def vision_request(image_kb: int) -> bytes:
+    image = os.urandom(image_kb * 1024)
+    return json.dumps({
+        "query": "O que aparece nesta imagem?",
+        "image_base64": base64.b64encode(image).decode('ascii'),
+        "model": "sonar-pro",
+        "user_id": 123456789,
+        "platform": "telegram",
+        "image_id": "telegram:AQADk7kxG7"
+    }).encode('utf-8')
+
+
+def best_of(func: Callable[[], Any], number: int, repeat: int = 5) -> float:
+    """Best time per call in microseconds."""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1e6
+
+
+def peak_kb(func: Callable[[], Any]) -> float:
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark JSON serialization of MCP payloads")
+    parser.add_argument('--image-kb', type=int, default=1500, help="Raw image size in the /vision body")
+    args = parser.parse_args(argv)
+    
+    os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(), 'bench.db'))
+    from flask.json.provider import DefaultJSONProvider
+    from utils import serialization
+    import mcp_server
+    
+    app = mcp_server.app
+    default_provider = DefaultJSONProvider(app)
+    fast_provider = mcp_server.FastJSONProvider(app)
+    payload = search_response()
+    body = vision_request(args.image_kb)
+    
+    def respond(provider) -> Callable[[], bytes]:
+        def run():
+            with app.app_context():
+                return provider.response(payload).get_data()
+        return run
+    
+    def parse_current():
+        # get_json(): body decoded to str, parsed by json, then b64decode copies to bytes
+        data = json.loads(body)
+        return base64.b64decode(data.pop('image_base64'))
+    
+    def parse_with(loads: Callable[[Any], Any]) -> Callable[[], bytes]:
+        def run():
+            data = loads(body)
+            return binascii.a2b_base64(data.pop('image_base64'))
+        return run
+    
+    rows: List[Tuple[str, str, float, str]] = []
+    response_size = len(respond(default_provider)())
+    rows.append(("/search response", "flask jsonify", best_of(respond(default_provider), 2000), f"{response_size} B"))
+    rows.append(("/search response", f"serialization ({serialization.BACKEND})",
+                 best_of(respond(fast_provider), 2000), f"{len(respond(fast_provider)())} B"))
+    rows.append(("/search response", "serialization (stdlib)",
+                 best_of(lambda: serialization._stdlib_dumps(payload), 2000), ""))
+    
+    rows.append(("/vision request", "get_json + b64decode", best_of(parse_current, 20),
+                 f"peak {peak_kb(parse_current):.0f} KB"))
+    rows.append(("/vision request", f"loads ({serialization.BACKEND}) + a2b_base64",
+                 best_of(parse_with(serialization.loads), 20),
+                 f"peak {peak_kb(parse_with(serialization.loads)):.0f} KB"))
+    rows.append(("/vision request", "loads (stdlib) + a2b_base64",
+                 best_of(parse_with(serialization._stdlib_loads), 20),
+                 f"peak {peak_kb(parse_with(serialization._stdlib_loads)):.0f} KB"))
+    
+    print(f"body: {len(body) // 1024} KB /vision request")
+    print(f"{'payload':<18} {'path':<34} {'µs/op':>10}  notes")
+    for name, path, micros, notes in rows:
+        print(f"{name:<18} {path:<34} {micros:>10.1f}  {notes}")
+
+
+if __name__ == '__main__':
+    main()
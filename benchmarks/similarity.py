@@ -0,0 +1,115 @@
+"""
+Near-duplicate lookup benchmark for utils.similarity.
+Fills a SimilarityIndex with synthetic Portuguese questions and times lookups
+of paraphrases (found) and unrelated questions (not found), with NumPy and
+with the pure Python fallback (on fewer entries: building it is slow).
+
+Usage:
+    python3 benchmarks/similarity.py --entries 100000 --python-entries 10000
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+SUBJECTS = [
+    "preço do bitcoin", "cotação do dólar", "previsão do tempo", "resultado do jogo",
+    "capital da austrália", "receita de bolo", "horário do metrô", "taxa selic",
+    "população do brasil", "elenco do filme", "história da guerra", "sintomas da gripe"
+]
+PREFIXES = ["qual o", "qual é o", "me diga o", "sabe o", "", "quero saber o"]
+SUFFIXES = ["hoje", "agora", "em são paulo", "no rio", "", "atualizado", "em 2026"]
+
+
+def synthetic_queries(count: int, seed: int = 0) -> List[str]:
+    """Distinct questions: templates plus a random word, like real long-tail traffic."""
+    rng = random.Random(seed)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    words = [''.join(rng.choice(letters) for _ in range(rng.randint(4, 9))) for _ in range(5000)]
+    return [
+        f"{rng.choice(PREFIXES)} {rng.choice(SUBJECTS)} {rng.choice(words)} "
+        f"{rng.choice(words)} {rng.choice(SUFFIXES)}?"
+        for _ in range(count)
+    ]
+
+
+def paraphrase(query: str) -> str:
+    """Same question, worded like another user would: no prefix, accents off, other punctuation."""
+    for prefix in sorted(PREFIXES, key=len, reverse=True):
+        if prefix and query.startswith(prefix):
+            query = query[len(prefix):]
+            break
+    return query.replace('ç', 'c').replace('ã', 'a').replace('é', 'e').rstrip('?').upper() + '!'
+
+
+def run(entries: int, lookups: int) -> Dict[str, float]:
+    from utils.similarity import SimilarityIndex
+    
+    queries = synthetic_queries(entries)
+    tracemalloc.start()
+    index = SimilarityIndex(maxsize=entries)
+    started = time.perf_counter()
+    for query in queries:
+        index.add(f"sonar:web:0:{query}", "sonar:web:0", query)
+    build_s = time.perf_counter() - started
+    memory_mb = tracemalloc.get_traced_memory()[0] / (1024 * 1024)
+    tracemalloc.stop()
+    
+    rng = random.Random(1)
+    hits = [paraphrase(rng.choice(queries)) for _ in range(lookups)]
+    misses = synthetic_queries(lookups, seed=2)
+    
+    def time_lookups(texts: List[str]) -> float:
+        started = time.perf_counter()
+        for text in texts:
+            index.query("sonar:web:0", text)
+        return (time.perf_counter() - started) / len(texts) * 1e6
+    
+    found = sum(
+        1 for text in hits
+        if (match := index.query("sonar:web:0", text)) is not None and match[1] >= 0.9
+    )
+    return {
+        'build_s': build_s,
+        'memory_mb': memory_mb,
+        'paraphrase_us': time_lookups(hits),
+        'unrelated_us': time_lookups(misses),
+        'recall_at_0.9': found / len(hits)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark near-duplicate query lookups")
+    parser.add_argument('--entries', type=int, default=100000, help="Indexed questions")
+    parser.add_argument('--python-entries', type=int, default=10000,
+                        help="Indexed questions for the pure Python run (0 skips it)")
+    parser.add_argument('--lookups', type=int, default=2000, help="Timed lookups of each kind")
+    args = parser.parse_args(argv)
+    
+    from utils import similarity
+    numpy = similarity.np
+    backends = [('numpy', numpy, args.entries)] if numpy is not None else []
+    if args.python_entries:
+        backends.append(('python', None, args.python_entries))
+    
+    print(f"{'backend':<8} {'entries':>8} {'build s':>8} {'MB':>7} "
+          f"{'paraphrase µs':>14} {'unrelated µs':>13} {'recall@0.9':>11}")
+    for name, module, entries in backends:
+        similarity.np = module
+        row = run(entries, args.lookups)
+        print(
+            f"{name:<8} {entries:>8} {row['build_s']:>8.1f} {row['memory_mb']:>7.0f} "
+            f"{row['paraphrase_us']:>14.1f} {row['unrelated_us']:>13.1f} {row['recall_at_0.9']:>11.1%}"
+        )
+    similarity.np = numpy
+
+
+if __name__ == '__main__':
+    main()
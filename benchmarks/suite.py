@@ -0,0 +1,493 @@
+"""
+Benchmark suite for the server, scraper and database hot paths.
+Microbenchmarks of the Database calls every request makes (on databases of
+10k and 1M query_logs rows) and of the scraper's response parsing, plus
+end-to-end /search and /vision throughput and latency against a mocked
+scraper at several concurrency levels. Results are written as JSON; compare
+flags regressions against a stored baseline (and exits 1 when there are any).
+
+Usage:
+    python3 benchmarks/suite.py run --output benchmarks/results/baseline.json
+    python3 benchmarks/suite.py run --output benchmarks/results/latest.json \\
+        --baseline benchmarks/results/baseline.json
+    python3 benchmarks/suite.py compare benchmarks/results/baseline.json \\
+        benchmarks/results/latest.json --threshold 0.2
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import base64
+import random
+import asyncio
+import sqlite3
+import timeit
+import argparse
+import platform
+import tempfile
+import subprocess
+import statistics
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+GROUPS = ('db', 'scraper', 'http')
+
+# query_logs rows per seeded user
+ROWS_PER_USER = 10
+
+QUERIES = [
+    "qual o preço do bitcoin hoje", "previsão do tempo em são paulo", "capital da austrália",
+    "como funciona a fotossíntese", "resultado do jogo do flamengo", "taxa selic atual",
+    "receita de bolo de cenoura", "quem ganhou o oscar de melhor filme", "cotação do dólar",
+    "sintomas da gripe", "história da segunda guerra", "horário do metrô de são paulo"
+]
+
+# Shape of an answer from Perplexity's ask endpoint (sources instead of citations)
+SAMPLE_ANSWER = {
+    "answer": ("A fotossíntese é o processo pelo qual plantas, algas e algumas bactérias "
+               "convertem energia luminosa em energia química. ") * 20,
+    "sources": [
+        {"title": f"Fonte {i} — Biologia", "url": f"https://example.com/artigo/{i}",
+         "snippet": "Trecho da fonte citada na resposta."}
+        for i in range(10)
+    ],
+    "images": [f"https://images.example.com/{i}.jpg" for i in range(4)]
+}
+
+# Metric suffix -> whether a larger value is better
+DIRECTIONS = {'_us': False, '_ms': False, '_per_s': True}
+
+# Failure counts: any increase, or any failure at all, is a regression
+FAILURE_METRICS = ('errors',)
+
+# Share of failed requests that aborts an endpoint measurement
+MAX_ERROR_RATE = 0.01
+
+
+# ==================== Measurement ====================
+
+def measure_op(func: Callable[[], Any], repeat: int = 5) -> Dict[str, float]:
+    """Time per call (µs): median and best of `repeat` runs of about 0.2 s each."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    runs = [total / number * 1e6 for total in timer.repeat(repeat=repeat, number=number)]
+    return {'median_us': statistics.median(runs), 'best_us': min(runs), 'calls': number * repeat}
+
+
+# ==================== Database ====================
+
+def seed_database(path: str, rows: int):
+    """
+    Database with `rows` query_logs rows over the last 30 days, and a
+    preferences and rate limit row per user (one user per ROWS_PER_USER rows).
+    """
+    from database import Database
+    from database.texts import text_hash, encode_text
+    
+    db = Database(path)
+    users = max(rows // ROWS_PER_USER, 1)
+    rng = random.Random(0)
+    now = datetime.utcnow()
+    models = ['sonar', 'sonar-pro', 'gpt-5.2', 'reasoning-pro']
+    hashes = [text_hash(query) for query in QUERIES]
+    
+    def log_rows():
+        for i in range(rows):
+            created_at = now - timedelta(seconds=rng.randrange(30 * 86400))
+            yield (
+                i % users + 1, 'telegram', rng.choice(hashes), rng.choice(models), 'web',
+                rng.randint(300, 8000), 1, created_at.strftime('%Y-%m-%d %H:%M:%S')
+            )
+    
+    with db._get_connection() as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO query_texts (hash, compressed, body) VALUES (?, ?, ?)",
+            [(text_hash(query), *encode_text(query)) for query in QUERIES]
+        )
+        conn.executemany(
+            """
+            INSERT INTO query_logs
+            (user_id, platform, query_hash, model, focus, response_time_ms, success, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            log_rows()
+        )
+        conn.executemany(
+            "INSERT INTO user_preferences (user_id, platform, model) VALUES (?, 'telegram', ?)",
+            ((user_id, rng.choice(models)) for user_id in range(1, users + 1))
+        )
+        window_start = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        conn.executemany(
+            "INSERT INTO rate_limits (user_id, platform, request_count, window_start) "
+            "VALUES (?, 'telegram', 1, ?)",
+            ((user_id, window_start) for user_id in range(1, users + 1))
+        )
+    return db
+
+
+def bench_database(rows: int, scratch: str) -> Dict[str, Dict[str, float]]:
+    started = time.perf_counter()
+    db = seed_database(os.path.join(scratch, f'bench-{rows}.db'), rows)
+    print(f"  seeded {rows} rows in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    
+    users = max(rows // ROWS_PER_USER, 1)
+    rng = random.Random(1)
+    cases = {
+        'get_user_config': lambda: db.get_user_config(rng.randint(1, users), 'telegram'),
+        # Limit never reached: every call takes the counting UPDATE path
+        'check_rate_limit': lambda: db.check_rate_limit(
+            rng.randint(1, users), 'telegram', max_requests=10 ** 9
+        ),
+        'log_query': lambda: db.log_query(
+            rng.randint(1, users), 'telegram', rng.choice(QUERIES), 'sonar', 'web',
+            response_time_ms=rng.randint(300, 8000)
+        ),
+        'get_global_stats': db.get_global_stats
+    }
+    return {f"db.{name}[rows={rows}]": measure_op(func) for name, func in cases.items()}
+
+
+# ==================== Scraper ====================
+
+def bench_scraper() -> Dict[str, Dict[str, float]]:
+    from scraper.standalone import PerplexoScraper
+    
+    scraper = PerplexoScraper()
+    return {
+        'scraper._parse_response': measure_op(
+            lambda: scraper._parse_response(SAMPLE_ANSWER, 'sonar-pro', 'web')
+        )
+    }
+
+
+# ==================== HTTP (mocked scraper) ====================
+
+def mock_scraper(latency: float):
+    """PerplexoScraper answering SAMPLE_ANSWER after `latency` seconds, without network."""
+    from scraper.standalone import PerplexoScraper, parse_image_response
+    
+    class MockScraper(PerplexoScraper):
+        def is_available(self) -> bool:
+            return True
+        
+        def ask(self, query: str, model: str = "sonar", focus: str = "web",
+                enable_reasoning: bool = False, **kwargs) -> Dict[str, Any]:
+            time.sleep(latency)
+            return self._parse_response(SAMPLE_ANSWER, model, focus)
+        
+        def ask_with_image(self, query: str, image_path: str, model: str = "sonar-pro",
+                           image_hash: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+            time.sleep(latency)
+            if image_hash:
+                self.upload_cache.set(image_hash, f"https://uploads.example.com/{image_hash}.jpg")
+            return parse_image_response(SAMPLE_ANSWER, model)
+        
+        def ask_with_image_url(self, query: str, image_url: str, model: str = "sonar-pro",
+                               **kwargs) -> Dict[str, Any]:
+            time.sleep(latency)
+            return parse_image_response(SAMPLE_ANSWER, model)
+    
+    return MockScraper()
+
+
+def serve(args):
+    """Run mcp_server.py as in production, with the scraper mocked (started by bench_http)."""
+    import mcp_server
+    
+    scraper = mock_scraper(args.scraper_latency_ms / 1000)
+    mcp_server.service.scraper = scraper
+    mcp_server.scraper = scraper
+    mcp_server.main()
+
+
+def start_server(port: int, db_path: str, latency_ms: float) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        MCP_PORT=str(port),
+        MCP_HOST='127.0.0.1',
+        MCP_UNIX_SOCKET='',
+        DATABASE_PATH=db_path,
+        RETENTION_DAYS='',
+        WARMER_TOP_N='0',
+        RATE_LIMIT_MESSAGES=str(10 ** 9)
+    )
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), 'serve', '--scraper-latency-ms', str(latency_ms)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    
+    import httpx
+    
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f'http://127.0.0.1:{port}/health', timeout=1)
+            return process
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("mcp_server.py did not start")
+
+
+def sample_image() -> str:
+    """A 1600x1200 JPEG as base64 (random bytes without Pillow: the server passes them through)."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return base64.b64encode(os.urandom(200 * 1024)).decode('ascii')
+    
+    import io
+    
+    image = Image.linear_gradient('L').resize((1600, 1200)).convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=90)
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+async def measure_endpoint(client, path: str, body: Callable[[int], Dict[str, Any]],
+                           requests: int, concurrency: int) -> Dict[str, float]:
+    latencies: List[float] = []
+    errors = 0
+    remaining = iter(range(requests))
+    
+    async def worker():
+        nonlocal errors
+        for i in remaining:
+            started = time.perf_counter()
+            response = await client.post(path, json=body(i))
+            latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                errors += 1
+    
+    # Warm up the pool so connection setup is not timed
+    await asyncio.gather(*(client.post(path, json=body(requests + i)) for i in range(concurrency)))
+    
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    
+    if errors > max(1, requests * MAX_ERROR_RATE):
+        raise RuntimeError(f"{path}: {errors} of {requests} requests failed")
+    
+    percentiles = statistics.quantiles(latencies, n=100)
+    return {
+        'p50_ms': statistics.median(latencies),
+        'p99_ms': percentiles[98],
+        'req_per_s': requests / elapsed,
+        'errors': errors
+    }
+
+
+async def run_http(port: int, requests: int, concurrency: List[int]) -> Dict[str, Dict[str, float]]:
+    import httpx
+    
+    image = sample_image()
+    
+    # Every request is a distinct question (the numbers also keep the
+    # near-duplicate matching apart), so all of them reach the scraper
+    def search_body(level: int) -> Callable[[int], Dict[str, Any]]:
+        return lambda i: {
+            "query": f"{QUERIES[i % len(QUERIES)]} {level} {i}",
+            "user_id": i % 1000 + 1, "platform": "telegram"
+        }
+    
+    def vision_body(level: int) -> Callable[[int], Dict[str, Any]]:
+        return lambda i: {
+            "query": f"o que aparece nesta imagem {level} {i}", "image_base64": image,
+            "model": "sonar-pro", "user_id": i % 1000 + 1, "platform": "telegram"
+        }
+    
+    results = {}
+    limits = httpx.Limits(max_connections=max(concurrency), max_keepalive_connections=max(concurrency))
+    async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}', limits=limits,
+                                 timeout=120) as client:
+        for level in concurrency:
+            for path, body in (('/search', search_body), ('/vision', vision_body)):
+                results[f"http.{path.strip('/')}[concurrency={level}]"] = await measure_endpoint(
+                    client, path, body(level), requests, level
+                )
+    return results
+
+
+def bench_http(args, scratch: str) -> Dict[str, Dict[str, float]]:
+    server = start_server(args.port, os.path.join(scratch, 'http.db'), args.scraper_latency_ms)
+    try:
+        return asyncio.run(run_http(args.port, args.requests, args.concurrency))
+    finally:
+        server.terminate()
+        server.wait(10)
+
+
+# ==================== Results ====================
+
+def environment() -> Dict[str, Any]:
+    """Where the results were measured, to tell apart runs that are not comparable."""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count()
+    }
+
+
+def direction(metric: str) -> Optional[bool]:
+    """True if larger is better, False if smaller is, None for counts."""
+    for suffix, higher_is_better in DIRECTIONS.items():
+        if metric.endswith(suffix):
+            return higher_is_better
+    return None
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any],
+            threshold: float) -> List[Tuple[str, str, float, float, float, str]]:
+    """
+    (benchmark, metric, baseline, current, change, verdict) for every metric
+    in both runs. A change worse than `threshold` (0.2 = 20%) is a
+    "REGRESSION", one better than it "improved". Failure counts (see
+    FAILURE_METRICS) regress on any increase or any nonzero value.
+    """
+    rows = []
+    for name, metrics in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        for metric, value in metrics.items():
+            old = before.get(metric)
+            if metric in FAILURE_METRICS:
+                old = old or 0
+                change = (value - old) / old if old else math.inf if value else 0.0
+                verdict = "REGRESSION" if value else "improved" if old else ""
+                rows.append((name, metric, old, value, change, verdict))
+                continue
+            higher_is_better = direction(metric)
+            if higher_is_better is None or not old:
+                continue
+            change = (value - old) / old
+            worse = -change if higher_is_better else change
+            verdict = "REGRESSION" if worse > threshold else "improved" if worse < -threshold else ""
+            rows.append((name, metric, old, value, change, verdict))
+    return rows
+
+
+def print_results(results: Dict[str, Dict[str, float]]):
+    for name, metrics in results.items():
+        values = '  '.join(
+            f"{metric}={value:.2f}" if isinstance(value, float) else f"{metric}={value}"
+            for metric, value in metrics.items()
+        )
+        print(f"{name:<45} {values}")
+
+
+def print_comparison(rows: List[Tuple[str, str, float, float, float, str]]) -> int:
+    """Print a comparison table; returns the number of regressions."""
+    print(f"{'benchmark':<45} {'metric':<10} {'baseline':>11} {'current':>11} {'change':>8}")
+    for name, metric, old, value, change, verdict in rows:
+        print(f"{name:<45} {metric:<10} {old:>11.2f} {value:>11.2f} {change:>+8.1%}  {verdict}")
+    regressions = sum(1 for row in rows if row[5] == "REGRESSION")
+    print(f"\n{regressions} regression(s) in {len(rows)} metric(s)")
+    return regressions
+
+
+def load(path: str) -> Dict[str, Any]:
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+# ==================== CLI ====================
+
+def run(args) -> int:
+    results: Dict[str, Dict[str, float]] = {}
+    with tempfile.TemporaryDirectory() as scratch:
+        if 'db' in args.only:
+            for rows in args.rows:
+                print(f"db: {rows} rows", file=sys.stderr)
+                results.update(bench_database(rows, scratch))
+        if 'scraper' in args.only:
+            results.update(bench_scraper())
+        if 'http' in args.only:
+            print(f"http: concurrency {args.concurrency}", file=sys.stderr)
+            results.update(bench_http(args, scratch))
+    
+    print_results(results)
+    report = {
+        'environment': environment(),
+        'config': {key: getattr(args, key) for key in ('only', 'rows', 'requests', 'concurrency',
+                                                       'scraper_latency_ms')},
+        'results': results
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+    
+    if args.baseline:
+        print()
+        return 1 if print_comparison(compare(load(args.baseline), report, args.threshold)) else 0
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark suite for the MCP server hot paths")
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    run_parser = commands.add_parser('run', help="Run the benchmarks and write JSON results")
+    run_parser.add_argument('--only', default=','.join(GROUPS),
+                            help=f"Comma-separated groups to run ({', '.join(GROUPS)})")
+    run_parser.add_argument('--rows', default='10000,1000000',
+                            help="Comma-separated query_logs sizes for the database benchmarks")
+    run_parser.add_argument('--requests', type=int, default=500,
+                            help="Requests per endpoint and concurrency level")
+    run_parser.add_argument('--concurrency', default='1,8,32',
+                            help="Comma-separated numbers of concurrent requests")
+    run_parser.add_argument('--scraper-latency-ms', type=float, default=20,
+                            help="Latency of the mocked scraper")
+    run_parser.add_argument('--port', type=int, default=5098)
+    run_parser.add_argument('--output', default=os.path.join(RESULTS_DIR, 'latest.json'))
+    run_parser.add_argument('--baseline', help="Results to compare against after the run")
+    run_parser.add_argument('--threshold', type=float, default=0.2,
+                            help="Relative change flagged as a regression")
+    
+    compare_parser = commands.add_parser('compare', help="Flag regressions between two result files")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.2,
+                                help="Relative change flagged as a regression")
+    
+    serve_parser = commands.add_parser('serve', help=argparse.SUPPRESS)
+    serve_parser.add_argument('--scraper-latency-ms', type=float, default=20)
+    
+    args = parser.parse_args(argv)
+    if args.command == 'serve':
+        serve(args)
+        return 0
+    if args.command == 'compare':
+        return 1 if print_comparison(compare(load(args.baseline), load(args.current), args.threshold)) else 0
+    
+    args.only = [group.strip() for group in args.only.split(',') if group.strip()]
+    unknown = set(args.only) - set(GROUPS)
+    if unknown:
+        parser.error(f"unknown groups: {', '.join(sorted(unknown))}")
+    args.rows = [int(rows) for rows in args.rows.split(',')]
+    args.concurrency = [int(level) for level in args.concurrency.split(',')]
+    return run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""
+TCP vs Unix domain socket latency between a bot and mcp_server.py.
+Starts the MCP server with both listeners on a scratch database and times the
+same keep-alive httpx requests over each transport.
+
+Usage:
+    python3 benchmarks/transport.py --requests 2000 --concurrency 1,16
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import statistics
+from typing import Dict, List
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Existing read-only endpoints: no I/O, one SQLite read, a few SQLite reads
+ENDPOINTS = ['/models', '/config/1?platform=telegram', '/stats/1?platform=telegram']
+
+
+def start_server(port: int, unix_socket: str, db_path: str) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        MCP_PORT=str(port),
+        MCP_HOST='127.0.0.1',
+        MCP_UNIX_SOCKET=unix_socket,
+        DATABASE_PATH=db_path,
+        RETENTION_DAYS=''
+    )
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'src', 'mcp_server.py')],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f'http://127.0.0.1:{port}/models', timeout=1)
+            if os.path.exists(unix_socket):
+                return process
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("mcp_server.py did not start")
+
+
+def create_client(transport: str, port: int, unix_socket: str) -> httpx.AsyncClient:
+    """Same client setup as telegram_bot.create_http_client()."""
+    limits = httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60.0)
+    if transport == 'unix':
+        return httpx.AsyncClient(
+            base_url='http://mcp-server',
+            transport=httpx.AsyncHTTPTransport(uds=unix_socket, limits=limits)
+        )
+    return httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}', limits=limits)
+
+
+async def measure(client: httpx.AsyncClient, path: str, requests: int,
+                  concurrency: int) -> Dict[str, float]:
+    latencies: List[float] = []
+    remaining = iter(range(requests))
+    
+    async def worker():
+        for _ in remaining:
+            started = time.perf_counter()
+            response = await client.get(path)
+            latencies.append((time.perf_counter() - started) * 1000)
+            response.raise_for_status()
+    
+    # Warm up the pool so connection setup is not timed
+    await asyncio.gather(*(client.get(path) for _ in range(concurrency)))
+    
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    
+    percentiles = statistics.quantiles(latencies, n=100)
+    return {
+        'p50_ms': statistics.median(latencies),
+        'p99_ms': percentiles[98],
+        'req_per_s': requests / elapsed
+    }
+
+
+async def run(args) -> List[Dict]:
+    results = []
+    for concurrency in args.concurrency:
+        for path in ENDPOINTS:
+            for transport in ('tcp', 'unix'):
+                async with create_client(transport, args.port, args.unix_socket) as client:
+                    stats = await measure(client, path, args.requests, concurrency)
+                results.append(dict(stats, path=path, transport=transport, concurrency=concurrency))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark TCP vs Unix socket to mcp_server.py")
+    parser.add_argument('--requests', type=int, default=2000, help="Requests per endpoint and transport")
+    parser.add_argument('--concurrency', default='1,16',
+                        help="Comma-separated numbers of concurrent requests")
+    parser.add_argument('--port', type=int, default=5099)
+    args = parser.parse_args(argv)
+    args.concurrency = [int(c) for c in args.concurrency.split(',')]
+    
+    with tempfile.TemporaryDirectory() as scratch:
+        args.unix_socket = os.path.join(scratch, 'mcp.sock')
+        server = start_server(args.port, args.unix_socket, os.path.join(scratch, 'bench.db'))
+        try:
+            results = asyncio.run(run(args))
+        finally:
+            server.terminate()
+            server.wait(10)
+    
+    print(f"{'endpoint':<30} {'conc':>4} {'transport':>9} {'p50 ms':>8} {'p99 ms':>8} {'req/s':>8}")
+    for row in results:
+        print(
+            f"{row['path']:<30} {row['concurrency']:>4} {row['transport']:>9} "
+            f"{row['p50_ms']:>8.2f} {row['p99_ms']:>8.2f} {row['req_per_s']:>8.0f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
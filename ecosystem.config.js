@@ -2,14 +2,18 @@ module.exports = {
   apps: [
     {
       name: 'perplexo-mcp',
-      script: 'src/mcp_server.py',
+      // Prefork parent: one process for PM2, PREFORK_WORKERS workers on one port.
+      // Workers are recycled by the parent at WORKER_MAX_RSS_MB
+      script: 'src/prefork.py',
       interpreter: 'python3',
       instances: 1,
       autorestart: true,
       watch: false,
       max_memory_restart: '500M',
+      kill_timeout: 35000,
       env: {
-        NODE_ENV: 'production'
+        NODE_ENV: 'production',
+        WORKER_MAX_RSS_MB: '450'
       },
       log_file: 'logs/mcp.log',
       out_file: 'logs/mcp.out.log',
@@ -1,3 +1,11 @@
 from .sqlite import Database
+from .retention import RetentionWorker, parse_retention
+from .cache import PersistentCache
+from .idempotency import (
+    IdempotencyStore, IdempotencyConflict, IdempotencyInProgress, StoredResponse
+)
 
-__all__ = ['Database']
\ No newline at end of file
+__all__ = [
+    'Database', 'RetentionWorker', 'parse_retention', 'PersistentCache',
+    'IdempotencyStore', 'IdempotencyConflict', 'IdempotencyInProgress', 'StoredResponse'
+]
\ No newline at end of file
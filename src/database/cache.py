@@ -0,0 +1,63 @@
+"""
+Two-tier cache for Perplexo Bot.
+An in-memory TTLCache in front of the SQLite cache_entries table.
+"""
+
+import time
+from typing import Any, Optional
+
+from utils.cache import TTLCache
+
+from .sqlite import Database
+
+_MISSING = object()
+
+
+class PersistentCache:
+    """
+    TTLCache backed by SQLite, so entries survive restarts and are shared
+    between processes using the same database. Values must be JSON-serializable.
+    
+    Args:
+        db: Database instance
+        namespace: Key namespace inside cache_entries
+        maxsize: Entries kept in memory
+        ttl: Default time-to-live in seconds
+    """
+    
+    def __init__(self, db: Database, namespace: str,
+                 maxsize: int = 1024, ttl: float = 3600.0):
+        self.db = db
+        self.namespace = namespace
+        self.ttl = ttl
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+    
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self.memory.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        
+        entry = self.db.cache_get(self.namespace, key)
+        if entry is None:
+            return default
+        
+        value, expires_at = entry
+        self.memory.set(key, value, ttl=expires_at - time.time())
+        return value
+    
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        self.memory.set(key, value, ttl=ttl)
+        self.db.cache_set(self.namespace, key, value, ttl)
+    
+    def ttl_remaining(self, key: str) -> Optional[float]:
+        """Seconds until the shared entry expires (as stored in SQLite), or None if absent."""
+        entry = self.db.cache_get(self.namespace, key)
+        return None if entry is None else entry[1] - time.time()
+    
+    def delete(self, key: str):
+        self.memory.delete(key)
+        self.db.cache_delete(self.namespace, key)
+    
+    def __contains__(self, key: str) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
@@ -0,0 +1,158 @@
+"""
+Query log export for Perplexo Bot.
+Streams query_logs into gzip-compressed JSONL or CSV with constant memory.
+"""
+
+import csv
+import io
+import json
+import os
+import zlib
+import argparse
+from typing import Dict, Any, Iterator, List, Optional
+
+from .sqlite import Database
+
+
+EXPORT_COLUMNS = [
+    'id', 'user_id', 'platform', 'query', 'model', 'focus',
+    'response_time_ms', 'success', 'error_message', 'created_at'
+]
+
+EXPORT_FORMATS = ('jsonl', 'csv')
+
+
+def encode_rows(rows: List[Dict[str, Any]], fmt: str, header: bool = False) -> bytes:
+    """Serialize a chunk of rows as UTF-8 JSONL or CSV."""
+    if fmt == 'jsonl':
+        return ''.join(
+            json.dumps(row, ensure_ascii=False) + '\n' for row in rows
+        ).encode('utf-8')
+    
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS, extrasaction='ignore')
+        if header:
+            writer.writeheader()
+        writer.writerows(rows)
+        return buffer.getvalue().encode('utf-8')
+    
+    raise ValueError(f"Invalid export format: {fmt}")
+
+
+def stream_export(db: Database, fmt: str = 'jsonl', after_id: int = 0,
+                  since: Optional[str] = None, until: Optional[str] = None,
+                  chunk_size: int = 1000) -> Iterator[bytes]:
+    """
+    Yield a single gzip stream with every matching row.
+    Suitable for a streaming HTTP response.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Invalid export format: {fmt}")
+    
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    header = fmt == 'csv'
+    for rows in db.iter_query_logs(after_id, chunk_size, since, until):
+        data = compressor.compress(encode_rows(rows, fmt, header))
+        header = False
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class QueryLogExporter:
+    """
+    Export query logs to day-partitioned gzip files, resumable from a checkpoint.
+    
+    Files are named query_logs-YYYY-MM-DD.<fmt>.gz inside out_dir. Every chunk
+    is appended as its own gzip member and the checkpoint is written after
+    the member is closed, so an interrupted export resumes cleanly (at worst
+    one chunk is written twice).
+    
+    Args:
+        db: Database instance
+        out_dir: Output directory
+        fmt: 'jsonl' or 'csv'
+        checkpoint_path: Checkpoint file (default: out_dir/.checkpoint-<fmt>.json)
+        chunk_size: Rows fetched per query
+    """
+    
+    def __init__(self, db: Database, out_dir: str, fmt: str = 'jsonl',
+                 checkpoint_path: Optional[str] = None, chunk_size: int = 5000):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Invalid export format: {fmt}")
+        self.db = db
+        self.out_dir = out_dir
+        self.fmt = fmt
+        self.chunk_size = chunk_size
+        self.checkpoint_path = checkpoint_path or os.path.join(
+            out_dir, f".checkpoint-{fmt}.json"
+        )
+        os.makedirs(out_dir, exist_ok=True)
+    
+    def load_checkpoint(self) -> int:
+        """Last exported log id (0 if starting fresh)."""
+        try:
+            with open(self.checkpoint_path) as f:
+                return int(json.load(f).get('last_id', 0))
+        except (FileNotFoundError, ValueError):
+            return 0
+    
+    def save_checkpoint(self, last_id: int):
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'last_id': last_id}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+    
+    def partition_path(self, day: str) -> str:
+        return os.path.join(self.out_dir, f"query_logs-{day}.{self.fmt}.gz")
+    
+    def run(self, since: Optional[str] = None, until: Optional[str] = None) -> Dict[str, int]:
+        """
+        Export everything after the checkpoint.
+        Returns the number of rows written per day partition.
+        """
+        written: Dict[str, int] = {}
+        for rows in self.db.iter_query_logs(self.load_checkpoint(), self.chunk_size, since, until):
+            by_day: Dict[str, List[Dict[str, Any]]] = {}
+            for row in rows:
+                by_day.setdefault(str(row['created_at'])[:10], []).append(row)
+            
+            for day, day_rows in by_day.items():
+                path = self.partition_path(day)
+                header = self.fmt == 'csv' and not os.path.exists(path)
+                compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+                with open(path, 'ab') as f:
+                    f.write(compressor.compress(encode_rows(day_rows, self.fmt, header)))
+                    f.write(compressor.flush())
+                written[day] = written.get(day, 0) + len(day_rows)
+            
+            self.save_checkpoint(rows[-1]['id'])
+        
+        return written
+
+
+def main(argv: Optional[List[str]] = None):
+    """Command-line entry point."""
+    parser = argparse.ArgumentParser(description="Export Perplexo query logs")
+    parser.add_argument('--db', default=os.getenv("DATABASE_PATH", "data/perplexo.db"),
+                        help="SQLite database path")
+    parser.add_argument('--out', default='exports', help="Output directory")
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='jsonl')
+    parser.add_argument('--since', help="created_at lower bound (UTC, inclusive)")
+    parser.add_argument('--until', help="created_at upper bound (UTC, exclusive)")
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--checkpoint', help="Checkpoint file path")
+    parser.add_argument('--reset', action='store_true', help="Start over from the first log")
+    args = parser.parse_args(argv)
+    
+    exporter = QueryLogExporter(
+        Database(args.db), args.out, args.format, args.checkpoint, args.chunk_size
+    )
+    if args.reset:
+        exporter.save_checkpoint(0)
+    
+    written = exporter.run(args.since, args.until)
+    for day in sorted(written):
+        print(f"📦 {exporter.partition_path(day)}: {written[day]} rows")
+    print(f"✅ Exported {sum(written.values())} rows (checkpoint: {exporter.load_checkpoint()})")
@@ -0,0 +1,118 @@
+"""
+Log-scaled latency histograms for Perplexo Bot.
+Fixed-bucket (HDR-style) histograms that can be merged and queried for percentiles.
+"""
+
+import struct
+from typing import Dict, Iterable, List, Optional
+
+
+# Linear sub-buckets per power of two. 16 sub-buckets keep the relative
+# error of any reported value under 1/16 (~6%).
+SUB_BUCKET_BITS = 4
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+
+# Highest trackable value: 2^22 ms (~70 minutes). Larger values are clamped.
+MAX_VALUE_BITS = 22
+MAX_VALUE_MS = (1 << MAX_VALUE_BITS) - 1
+BUCKET_COUNT = (MAX_VALUE_BITS - SUB_BUCKET_BITS + 1) * SUB_BUCKET_COUNT
+
+
+def bucket_index(value_ms: int) -> int:
+    """Map a latency in milliseconds to its bucket index."""
+    value = min(max(int(value_ms), 0), MAX_VALUE_MS)
+    shift = max(value.bit_length() - SUB_BUCKET_BITS - 1, 0)
+    return shift * SUB_BUCKET_COUNT + (value >> shift)
+
+
+def bucket_bounds(index: int) -> tuple:
+    """Return the (lowest, highest) millisecond value stored in a bucket."""
+    shift = max(index // SUB_BUCKET_COUNT - 1, 0)
+    mantissa = index - shift * SUB_BUCKET_COUNT
+    return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    """
+    Fixed-bucket latency histogram.
+    Only non-empty buckets are kept, so a typical hour of traffic costs a few
+    dozen bytes once encoded.
+    """
+    
+    def __init__(self, counts: Optional[Dict[int, int]] = None,
+                 total_ms: int = 0, max_ms: int = 0):
+        self.counts: Dict[int, int] = dict(counts or {})
+        self.total_ms = total_ms
+        self.max_ms = max_ms
+    
+    @property
+    def count(self) -> int:
+        return sum(self.counts.values())
+    
+    def record(self, value_ms: int, count: int = 1):
+        """Record one or more observations of the same value."""
+        index = bucket_index(value_ms)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.total_ms += int(value_ms) * count
+        self.max_ms = max(self.max_ms, int(value_ms))
+    
+    def merge(self, other: 'LatencyHistogram') -> 'LatencyHistogram':
+        """Merge another histogram into this one (in place)."""
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total_ms += other.total_ms
+        self.max_ms = max(self.max_ms, other.max_ms)
+        return self
+    
+    def percentile(self, pct: float) -> int:
+        """
+        Value at the given percentile (0-100).
+        Reports the upper bound of the matching bucket, capped at the real max.
+        """
+        total = self.count
+        if not total:
+            return 0
+        
+        rank = max(1, -(-total * pct // 100))  # ceil without floats drifting
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(bucket_bounds(index)[1], self.max_ms)
+        return self.max_ms
+    
+    def percentiles(self, pcts: Iterable[float] = (50, 90, 99)) -> Dict[str, int]:
+        """Compute several percentiles, keyed as 'p50', 'p90', ..."""
+        return {
+            f"p{pct:g}".replace('.', '_'): self.percentile(pct) for pct in pcts
+        }
+    
+    def summary(self, pcts: Iterable[float] = (50, 90, 99)) -> Dict[str, int]:
+        """Count, mean, max and percentiles in a JSON-friendly dict."""
+        total = self.count
+        result = {
+            'count': total,
+            'mean_ms': round(self.total_ms / total, 2) if total else 0,
+            'max_ms': self.max_ms
+        }
+        result.update(self.percentiles(pcts))
+        return result
+    
+    # ==================== Encoding ====================
+    
+    def to_bytes(self) -> bytes:
+        """Encode non-empty buckets as little-endian (index, count) pairs."""
+        items: List[int] = []
+        for index in sorted(self.counts):
+            items.extend((index, self.counts[index]))
+        return struct.pack(f"<{len(items)}I", *items)
+    
+    @classmethod
+    def from_bytes(cls, data: Optional[bytes], total_ms: int = 0,
+                   max_ms: int = 0) -> 'LatencyHistogram':
+        """Decode a histogram produced by to_bytes()."""
+        counts: Dict[int, int] = {}
+        if data:
+            values = struct.unpack(f"<{len(data) // 4}I", data)
+            counts = dict(zip(values[0::2], values[1::2]))
+        return cls(counts, total_ms, max_ms)
@@ -0,0 +1,125 @@
+"""
+Idempotency keys for Perplexo MCP Server.
+Runs a request once per key: retries attach to the in-flight original or get
+its stored response, in this process or any other sharing the database.
+"""
+
+import os
+import time
+import threading
+from typing import Callable, Dict, NamedTuple
+
+from .sqlite import Database
+
+
+# Seconds a successful response is replayed for its key. The bots derive keys
+# from the request, so this is also how long a repeated question gets the same
+# answer: keep it to the window in which a user resends after a client timeout
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "120"))
+
+# Upper bound on the replay window, whatever IDEMPOTENCY_TTL says
+IDEMPOTENCY_TTL_MAX = 300.0
+
+# Seconds a pending claim lives without completing (a worker that died mid-request)
+IDEMPOTENCY_LEASE = float(os.getenv("IDEMPOTENCY_LEASE", "300"))
+
+# Seconds a retry waits for the in-flight original before giving up with 409
+IDEMPOTENCY_WAIT = float(os.getenv("IDEMPOTENCY_WAIT", "150"))
+
+# How often a retry checks on an original running in another process
+POLL_INTERVAL = 0.25
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used for a different request."""
+
+
+class IdempotencyInProgress(Exception):
+    """The original request is still running after the wait."""
+
+
+class StoredResponse(NamedTuple):
+    status: int
+    content_type: str
+    body: bytes
+    replayed: bool
+
+
+class IdempotencyStore:
+    """
+    Deduplicates requests carrying the same Idempotency-Key.
+    
+    The first request claims the key and runs; its response is stored if it
+    succeeded (2xx). Errors release the key, so the next retry runs again.
+    A retry with the same fingerprint waits for a pending original and
+    replays its response; a different fingerprint is a conflict.
+    
+    Args:
+        db: Database holding the claims (shared by all server processes)
+        ttl: Seconds a stored response is replayed (capped at IDEMPOTENCY_TTL_MAX)
+        lease_seconds: Seconds before a pending claim is considered abandoned
+    """
+    
+    def __init__(self, db: Database, ttl: float = IDEMPOTENCY_TTL,
+                 lease_seconds: float = IDEMPOTENCY_LEASE):
+        self.db = db
+        self.ttl = min(ttl, IDEMPOTENCY_TTL_MAX)
+        self.lease_seconds = lease_seconds
+        self._inflight: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+    
+    def execute(self, key: str, fingerprint: str,
+                handler: Callable[[], StoredResponse],
+                wait_seconds: float = IDEMPOTENCY_WAIT) -> StoredResponse:
+        """
+        Run `handler` once for `key`, or return the response of the request
+        that already ran (or is running) with it.
+        
+        Raises:
+            IdempotencyConflict: the key belongs to a different request
+            IdempotencyInProgress: the original did not finish within wait_seconds
+        """
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            row = self.db.idempotency_claim(key, fingerprint, self.lease_seconds)
+            if row is None:
+                return self._run(key, fingerprint, handler)
+            
+            if row['fingerprint'] != fingerprint:
+                raise IdempotencyConflict(key)
+            if row['state'] == 'done':
+                return StoredResponse(row['status'], row['content_type'], bytes(row['body']), True)
+            
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise IdempotencyInProgress(key)
+            
+            # Woken at once by an original in this process, polled otherwise
+            event = self._inflight.get(key)
+            if event is not None:
+                event.wait(min(remaining, self.lease_seconds))
+            else:
+                time.sleep(min(remaining, POLL_INTERVAL))
+    
+    def _run(self, key: str, fingerprint: str,
+             handler: Callable[[], StoredResponse]) -> StoredResponse:
+        event = threading.Event()
+        with self._lock:
+            self._inflight[key] = event
+        
+        stored = False
+        try:
+            response = handler()
+            if 200 <= response.status < 300:
+                self.db.idempotency_complete(
+                    key, fingerprint, response.status, response.content_type,
+                    response.body, self.ttl
+                )
+                stored = True
+            return response
+        finally:
+            if not stored:
+                self.db.idempotency_release(key, fingerprint)
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
@@ -0,0 +1,156 @@
+"""
+Background retention worker for Perplexo Bot.
+Purges expired rows in small batches and gives the freed pages back to the OS.
+"""
+
+import gzip
+import json
+import base64
+import logging
+import os
+import argparse
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+from .sqlite import Database, RETENTION_TABLES
+
+logger = logging.getLogger(__name__)
+
+# Largest database the worker converts to auto_vacuum=INCREMENTAL in place (MB)
+VACUUM_CONVERT_MAX_MB = float(os.getenv("VACUUM_CONVERT_MAX_MB", "64"))
+
+
+def parse_retention(spec: str) -> Dict[str, int]:
+    """
+    Parse a retention spec such as "query_logs=30,latency_histograms=90".
+    Unknown tables raise ValueError.
+    """
+    retention = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        table, _, days = item.partition('=')
+        table = table.strip()
+        if table not in RETENTION_TABLES:
+            raise ValueError(f"Invalid retention table: {table}")
+        retention[table] = int(days)
+    return retention
+
+
+class GzipArchiver:
+    """Append expired rows to per-table, per-day gzip JSONL files."""
+    
+    def __init__(self, archive_dir: str):
+        self.archive_dir = archive_dir
+        os.makedirs(archive_dir, exist_ok=True)
+    
+    def __call__(self, table: str, rows: List[Dict[str, Any]]):
+        path = os.path.join(
+            self.archive_dir,
+            f"{table}-{datetime.utcnow().strftime('%Y-%m-%d')}.jsonl.gz"
+        )
+        # Appending creates a new gzip member, which gunzip/zcat read transparently
+        with gzip.open(path, 'at', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(row, default=self._encode, ensure_ascii=False))
+                f.write('\n')
+    
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, bytes):
+            return base64.b64encode(value).decode()
+        return str(value)
+
+
+class RetentionWorker(threading.Thread):
+    """
+    Periodically purges expired rows and runs incremental vacuum.
+    
+    Args:
+        db: Database instance
+        retention: Mapping of table name to retention days
+        interval_seconds: Pause between runs
+        batch_size: Rowid span deleted per transaction
+        batch_pause: Seconds to yield between batches
+        vacuum_pages: Pages released per run (0 = all free pages)
+        archive_dir: Optional directory for gzip JSONL archives of purged rows
+        vacuum_convert_max_mb: Largest database converted to incremental
+            vacuum on the first pass; bigger ones need vacuum_db.py offline
+    """
+    
+    def __init__(self, db: Database, retention: Dict[str, int],
+                 interval_seconds: int = 3600, batch_size: int = 500,
+                 batch_pause: float = 0.05, vacuum_pages: int = 0,
+                 archive_dir: Optional[str] = None,
+                 vacuum_convert_max_mb: float = VACUUM_CONVERT_MAX_MB):
+        super().__init__(name="retention-worker", daemon=True)
+        self.db = db
+        self.retention = retention
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.vacuum_pages = vacuum_pages
+        self.archive = GzipArchiver(archive_dir) if archive_dir else None
+        self.vacuum_convert_max_bytes = int(vacuum_convert_max_mb * 1024 * 1024)
+        self._stop_event = threading.Event()
+        self._vacuum_ready = False
+    
+    def run_once(self) -> Dict[str, int]:
+        """Run one retention pass. Returns deleted rows per table."""
+        if not self._vacuum_ready:
+            if self.db.enable_incremental_vacuum(self.vacuum_convert_max_bytes):
+                logger.info("Database converted to auto_vacuum=INCREMENTAL")
+            elif not self.db.incremental_vacuum_enabled():
+                logger.warning(
+                    "Database is larger than VACUUM_CONVERT_MAX_MB and not in "
+                    "auto_vacuum=INCREMENTAL; purged pages stay in the file. "
+                    "Stop the server and run: python3 src/vacuum_db.py"
+                )
+            self._vacuum_ready = True
+        
+        deleted = {}
+        for table, days in self.retention.items():
+            deleted[table] = self.db.purge_expired(
+                table, days,
+                batch_size=self.batch_size,
+                pause_seconds=self.batch_pause,
+                archive=self.archive
+            )
+            if self._stop_event.is_set():
+                break
+        
+        if deleted.get('query_logs'):
+            deleted['query_texts'] = self.db.purge_orphan_query_texts(self.batch_size)
+        
+        deleted['cache_entries'] = self.db.purge_expired_cache()
+        deleted['idempotency_keys'] = self.db.purge_expired_idempotency_keys()
+        
+        freed = self.db.incremental_vacuum(self.vacuum_pages)
+        logger.info(f"Retention pass: deleted={deleted}, freed_pages={freed}")
+        return deleted
+    
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Retention pass failed: {e}")
+            self._stop_event.wait(self.interval_seconds)
+    
+    def stop(self):
+        self._stop_event.set()
+
+
+def main(argv: Optional[List[str]] = None):
+    """Command-line entry point: convert a database to incremental vacuum offline."""
+    parser = argparse.ArgumentParser(description="Enable incremental vacuum on a Perplexo database")
+    parser.add_argument('--db', default=os.getenv("DATABASE_PATH", "data/perplexo.db"),
+                        help="SQLite database path")
+    args = parser.parse_args(argv)
+    
+    db = Database(args.db)
+    if db.enable_incremental_vacuum():
+        print(f"✅ {args.db} converted to auto_vacuum=INCREMENTAL")
+    else:
+        print(f"ℹ️ {args.db} already uses auto_vacuum=INCREMENTAL")
@@ -6,16 +6,84 @@ Handles user preferences, rate limiting, and analytics.
 import sqlite3
 import json
 import os
-from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Any, List, Sequence, Callable, Iterator
 from contextlib import contextmanager
 
+from .histogram import LatencyHistogram
+from .texts import text_hash, encode_text, decode_text
+
+
+# Width of a latency histogram time bucket
+LATENCY_BUCKET_SECONDS = 3600
+
+# Seconds a connection waits for a lock held by another process/thread
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "10"))
+
+# Write-ahead log: readers don't block the writer (needed with several server processes)
+SQLITE_WAL = os.getenv("SQLITE_WAL", "true").lower() == "true"
+
+# Rehydrated query text for a query_logs row aliased `l` joined to query_texts `t`
+QUERY_TEXT_SQL = "COALESCE(l.query, query_text(t.compressed, t.body))"
+
+_EPOCH = datetime(1970, 1, 1)
+
+# PRAGMA user_version once every inline query_logs.query has moved to query_texts
+SCHEMA_QUERY_TEXTS = 1
+
+# Focus values of query_logs rows that are not searches: "[IMAGE] <caption>"
+# and "[DOCUMENT] <file>" entries logged for /vision and document summaries
+NON_SEARCH_FOCUSES = ('vision', 'document')
+
+# Tables the retention worker may purge: table -> (time column, monotonic).
+# "Monotonic" tables only ever append rows in time order, so every expired
+# row sits below the rowid of the first non-expired one.
+RETENTION_TABLES = {
+    'query_logs': ('created_at', True),
+    'latency_histograms': ('bucket_start', True),
+    'rate_limits': ('window_start', False),
+}
+
+
+def _history_scope(user_id: Optional[int], platform: Optional[str]) -> str:
+    """Single FTS token identifying a user on a platform (e.g. 'u42ptelegram')."""
+    return f"u{user_id or 0}p{re.sub(r'[^a-z0-9]', '', (platform or '').lower())}"
+
+
+def _history_match(text: str) -> Optional[str]:
+    """
+    Turn free text into a safe FTS5 expression: every word must match and the
+    last one is a prefix, so partial words still find results.
+    """
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def _naive_utc(moment: datetime) -> datetime:
+    """Timezone-aware datetimes (e.g. "...Z" from a query string) as naive UTC."""
+    if moment.tzinfo is None:
+        return moment
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _latency_bucket(moment: datetime) -> datetime:
+    """Floor a naive UTC datetime to the start of its latency bucket."""
+    seconds = int((moment - _EPOCH).total_seconds())
+    return _EPOCH + timedelta(seconds=seconds - seconds % LATENCY_BUCKET_SECONDS)
+
 
 class Database:
     """SQLite database handler for Perplexo Bot."""
     
     def __init__(self, db_path: str = "data/perplexo.db"):
         self.db_path = db_path
+        self.fts_enabled = False
         self._ensure_directory()
         self._init_tables()
     
@@ -24,10 +92,26 @@ class Database:
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
     
     @contextmanager
-    def _get_connection(self):
-        """Context manager for database connections."""
-        conn = sqlite3.connect(self.db_path)
+    def _get_connection(self, immediate: bool = False):
+        """
+        Context manager for database connections.
+        
+        With `immediate`, the whole block runs in one BEGIN IMMEDIATE
+        transaction: the write lock is taken up front, so a read-then-write
+        sequence is atomic across processes.
+        """
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=SQLITE_BUSY_TIMEOUT,
+            isolation_level=None if immediate else ''
+        )
         conn.row_factory = sqlite3.Row
+        conn.create_function("query_text", 2, decode_text, deterministic=True)
+        conn.create_function("history_scope", 2, _history_scope, deterministic=True)
+        if SQLITE_WAL:
+            conn.execute("PRAGMA synchronous = NORMAL")
+        if immediate:
+            conn.execute("BEGIN IMMEDIATE")
         try:
             yield conn
             conn.commit()
@@ -42,6 +126,12 @@ class Database:
         with self._get_connection() as conn:
             cursor = conn.cursor()
             
+            # Only takes effect on a new database; existing ones are
+            # converted by enable_incremental_vacuum()
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            if SQLITE_WAL:
+                cursor.execute("PRAGMA journal_mode = WAL")
+            
             # User preferences table
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS user_preferences (
@@ -81,10 +171,29 @@ class Database:
                     response_time_ms INTEGER,
                     success BOOLEAN,
                     error_message TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    query_hash BLOB,
+                    answer_hash BLOB
+                )
+            """)
+            
+            # Deduplicated query texts, referenced by query_logs.query_hash
+            # (and by answer_hash for answers indexed in the history search)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS query_texts (
+                    hash BLOB PRIMARY KEY,
+                    compressed BOOLEAN NOT NULL DEFAULT 0,
+                    body BLOB NOT NULL,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             """)
             
+            columns = {row['name'] for row in cursor.execute("PRAGMA table_info(query_logs)")}
+            if 'query_hash' not in columns:
+                cursor.execute("ALTER TABLE query_logs ADD COLUMN query_hash BLOB")
+            if 'answer_hash' not in columns:
+                cursor.execute("ALTER TABLE query_logs ADD COLUMN answer_hash BLOB")
+            
             # Create indexes
             cursor.execute("""
                 CREATE INDEX IF NOT EXISTS idx_query_logs_user_id 
@@ -94,6 +203,147 @@ class Database:
                 CREATE INDEX IF NOT EXISTS idx_query_logs_created_at 
                 ON query_logs(created_at)
             """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_query_logs_query_hash 
+                ON query_logs(query_hash)
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_query_logs_answer_hash 
+                ON query_logs(answer_hash) WHERE answer_hash IS NOT NULL
+            """)
+            
+            # Latency histograms, one row per time bucket and dimension tuple
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS latency_histograms (
+                    bucket_start TIMESTAMP NOT NULL,
+                    platform TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    focus TEXT NOT NULL,
+                    count INTEGER NOT NULL DEFAULT 0,
+                    total_ms INTEGER NOT NULL DEFAULT 0,
+                    max_ms INTEGER NOT NULL DEFAULT 0,
+                    counts BLOB,
+                    PRIMARY KEY (bucket_start, platform, model, focus)
+                )
+            """)
+            
+            # Persistent tier of the in-memory caches (JSON values)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                ) WITHOUT ROWID
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_cache_entries_expires_at 
+                ON cache_entries(expires_at)
+            """)
+            
+            # Idempotency-Key claims and the stored responses (see idempotency.py)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS idempotency_keys (
+                    key TEXT PRIMARY KEY,
+                    fingerprint TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    status INTEGER,
+                    content_type TEXT,
+                    body BLOB,
+                    expires_at REAL NOT NULL
+                ) WITHOUT ROWID
+            """)
+            
+            # Latest metrics snapshot of each prefork worker (see prefork.py)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS worker_metrics (
+                    pid INTEGER PRIMARY KEY,
+                    snapshot TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            
+            # Named leases: one holder at a time across processes (see claim_lease)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS leases (
+                    name TEXT PRIMARY KEY,
+                    holder TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                ) WITHOUT ROWID
+            """)
+        
+        # Once per database, not on every start of every process
+        if self._schema_version() < SCHEMA_QUERY_TEXTS:
+            self.migrate_query_texts()
+            self._set_schema_version(SCHEMA_QUERY_TEXTS)
+        self._init_history_index()
+    
+    def _schema_version(self) -> int:
+        with self._get_connection() as conn:
+            return conn.execute("PRAGMA user_version").fetchone()[0]
+    
+    def _set_schema_version(self, version: int):
+        with self._get_connection() as conn:
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+    
+    def _init_history_index(self):
+        """
+        Create the FTS5 index over query history, if FTS5 is available.
+        
+        The index is external-content: it holds only the inverted index, and
+        reads query and answer texts (for snippets and results) through the
+        query_history_content view, which rehydrates them from query_texts.
+        The `scope` column holds one token per user/platform so per-user
+        searches are an index intersection instead of a post-filter.
+        
+        Rows are added by log_query() and removed by purge_expired(). The view
+        calls the query_text() and history_scope() functions registered by
+        _get_connection(), so snippets and rebuild_history_index() need a
+        Database connection; nothing on query_logs itself does, and plain
+        sqlite3 connections (the CLI, maintenance scripts) may delete logs.
+        Index entries they leave behind are skipped by search_history(),
+        which joins query_logs, and dropped by rebuild_history_index().
+        """
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'query_history_fts'"
+            )
+            exists = cursor.fetchone() is not None
+            
+            try:
+                cursor.execute("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS query_history_fts USING fts5(
+                        scope, query, answer,
+                        content = 'query_history_content', content_rowid = 'id',
+                        tokenize = 'unicode61 remove_diacritics 2'
+                    )
+                """)
+            except sqlite3.OperationalError:
+                # SQLite built without FTS5
+                return
+            
+            cursor.execute(f"""
+                CREATE VIEW IF NOT EXISTS query_history_content AS
+                SELECT l.id,
+                       history_scope(l.user_id, l.platform) AS scope,
+                       {QUERY_TEXT_SQL} AS query,
+                       query_text(a.compressed, a.body) AS answer
+                FROM query_logs l
+                LEFT JOIN query_texts t ON t.hash = l.query_hash
+                LEFT JOIN query_texts a ON a.hash = l.answer_hash
+            """)
+        
+        self.fts_enabled = True
+        if not exists:
+            # Index rows logged before the index existed
+            self.rebuild_history_index()
+    
+    def rebuild_history_index(self):
+        """Re-read the whole history index from query_logs (drops entries of deleted rows)."""
+        with self._get_connection() as conn:
+            conn.execute("INSERT INTO query_history_fts (query_history_fts) VALUES ('rebuild')")
     
     # ==================== User Preferences ====================
     
@@ -103,7 +353,7 @@ class Database:
             cursor = conn.cursor()
             cursor.execute(
                 """
-                SELECT model, focus, mode, reasoning, return_citations, return_images
+                SELECT model, focus, mode, reasoning, return_citations, return_images, updated_at
                 FROM user_preferences
                 WHERE user_id = ? AND platform = ?
                 """,
@@ -118,7 +368,8 @@ class Database:
                     'mode': row['mode'],
                     'reasoning': bool(row['reasoning']),
                     'return_citations': bool(row['return_citations']),
-                    'return_images': bool(row['return_images'])
+                    'return_images': bool(row['return_images']),
+                    'updated_at': row['updated_at']
                 }
             
             # Return defaults
@@ -128,9 +379,21 @@ class Database:
                 'mode': 'busca',
                 'reasoning': False,
                 'return_citations': True,
-                'return_images': True
+                'return_images': True,
+                'updated_at': None
             }
     
+    def get_config_version(self, user_id: int, platform: str = 'telegram') -> Optional[str]:
+        """Last update time of a user's configuration (None if never saved)."""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT updated_at FROM user_preferences WHERE user_id = ? AND platform = ?",
+                (user_id, platform)
+            )
+            row = cursor.fetchone()
+            return row['updated_at'] if row else None
+    
     def update_user_config(self, user_id: int, platform: str, config: Dict[str, Any]):
         """Update user configuration."""
         with self._get_connection() as conn:
@@ -165,7 +428,7 @@ class Database:
         """Toggle a boolean setting for a user."""
         config = self.get_user_config(user_id, platform)
         
-        if setting not in config:
+        if not isinstance(config.get(setting), bool):
             raise ValueError(f"Invalid setting: {setting}")
         
         config[setting] = not config[setting]
@@ -180,8 +443,11 @@ class Database:
         """
         Check if user has exceeded rate limit.
         Returns (allowed: bool, remaining: int, reset_time: datetime)
+        
+        Runs as one immediate transaction, so concurrent server processes
+        can't both pass the last allowed request.
         """
-        with self._get_connection() as conn:
+        with self._get_connection(immediate=True) as conn:
             cursor = conn.cursor()
             
             # Get current rate limit record
@@ -264,18 +530,131 @@ class Database:
     
     def log_query(self, user_id: int, platform: str, query: str, 
                   model: str, focus: str, response_time_ms: int = 0,
-                  success: bool = True, error_message: Optional[str] = None):
-        """Log a query for analytics."""
+                  success: bool = True, error_message: Optional[str] = None,
+                  answer: Optional[str] = None):
+        """
+        Log a query for analytics.
+        If `answer` is given it is added to the history search index as well
+        (stored once in query_texts, like the query).
+        """
         with self._get_connection() as conn:
             cursor = conn.cursor()
+            query_hash = self._store_query_text(cursor, query)
+            answer_hash = (
+                self._store_query_text(cursor, answer)
+                if answer is not None and self.fts_enabled else None
+            )
             cursor.execute(
                 """
                 INSERT INTO query_logs 
-                (user_id, platform, query, model, focus, response_time_ms, success, error_message)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                (user_id, platform, query_hash, answer_hash, model, focus, response_time_ms,
+                 success, error_message)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """,
-                (user_id, platform, query, model, focus, response_time_ms, success, error_message)
+                (user_id, platform, query_hash, answer_hash, model, focus, response_time_ms,
+                 success, error_message)
             )
+            if self.fts_enabled:
+                cursor.execute(
+                    "INSERT INTO query_history_fts (rowid, scope, query, answer) VALUES (?, ?, ?, ?)",
+                    (cursor.lastrowid, _history_scope(user_id, platform), query, answer)
+                )
+            self._record_latency(cursor, platform, model, focus, response_time_ms)
+    
+    def _store_query_text(self, cursor, query: str) -> bytes:
+        """Store a query text once and return its content hash."""
+        query_hash = text_hash(query)
+        compressed, body = encode_text(query)
+        cursor.execute(
+            "INSERT OR IGNORE INTO query_texts (hash, compressed, body) VALUES (?, ?, ?)",
+            (query_hash, compressed, body)
+        )
+        return query_hash
+    
+    def migrate_query_texts(self, batch_size: int = 1000) -> int:
+        """
+        Move inline query_logs.query values into query_texts.
+        Runs in small batches; _init_tables() calls it until it has completed
+        once (tracked in PRAGMA user_version).
+        """
+        migrated = 0
+        last_id = 0
+        while True:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    """
+                    SELECT id, query FROM query_logs
+                    WHERE id > ? AND query IS NOT NULL
+                    ORDER BY id
+                    LIMIT ?
+                    """,
+                    (last_id, batch_size)
+                )
+                rows = cursor.fetchall()
+                for row in rows:
+                    cursor.execute(
+                        "UPDATE query_logs SET query = NULL, query_hash = ? WHERE id = ?",
+                        (self._store_query_text(cursor, row['query']), row['id'])
+                    )
+            migrated += len(rows)
+            if len(rows) < batch_size:
+                return migrated
+            last_id = rows[-1]['id']
+    
+    def purge_orphan_query_texts(self, batch_size: int = 500) -> int:
+        """Delete query (and answer) texts no longer referenced by any query log."""
+        deleted = 0
+        while True:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    """
+                    DELETE FROM query_texts WHERE rowid IN (
+                        SELECT t.rowid FROM query_texts t
+                        WHERE NOT EXISTS (
+                            SELECT 1 FROM query_logs l WHERE l.query_hash = t.hash
+                        ) AND NOT EXISTS (
+                            SELECT 1 FROM query_logs l WHERE l.answer_hash = t.hash
+                        )
+                        LIMIT ?
+                    )
+                    """,
+                    (batch_size,)
+                )
+                deleted += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                return deleted
+    
+    def _record_latency(self, cursor, platform: str, model: str, focus: str,
+                        response_time_ms: int):
+        """Add one observation to the latency histogram of the current bucket."""
+        bucket_start = _latency_bucket(datetime.utcnow()).strftime('%Y-%m-%d %H:%M:%S')
+        key = (bucket_start, platform or '', model or '', focus or '')
+        
+        cursor.execute(
+            """
+            SELECT counts, total_ms, max_ms FROM latency_histograms
+            WHERE bucket_start = ? AND platform = ? AND model = ? AND focus = ?
+            """,
+            key
+        )
+        row = cursor.fetchone()
+        
+        if row:
+            histogram = LatencyHistogram.from_bytes(row['counts'], row['total_ms'], row['max_ms'])
+        else:
+            histogram = LatencyHistogram()
+        histogram.record(response_time_ms)
+        
+        cursor.execute(
+            """
+            INSERT OR REPLACE INTO latency_histograms
+            (bucket_start, platform, model, focus, count, total_ms, max_ms, counts)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            key + (histogram.count, histogram.total_ms, histogram.max_ms, histogram.to_bytes())
+        )
     
     def get_user_stats(self, user_id: int, platform: str) -> Dict[str, Any]:
         """Get statistics for a user."""
@@ -334,14 +713,526 @@ class Database:
                 'avg_response_time_ms': round(row['avg_response_time'] or 0, 2)
             }
     
-    def cleanup_old_logs(self, days: int = 30):
-        """Clean up logs older than specified days."""
+    def get_top_queries(self, since: datetime, limit: int = 20,
+                        min_count: int = 1) -> List[Dict[str, Any]]:
+        """
+        Most asked successful (query, model, focus) searches since `since`
+        (UTC), most frequent first, each with its "hits" count.
+        """
+        placeholders = ', '.join('?' * len(NON_SEARCH_FOCUSES))
         with self._get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute(
+                f"""
+                SELECT {QUERY_TEXT_SQL} AS query, l.model, l.focus, l.hits
+                FROM (
+                    SELECT query_hash, MAX(query) AS query, model, focus, COUNT(*) AS hits
+                    FROM query_logs
+                    WHERE created_at >= ? AND success AND focus NOT IN ({placeholders})
+                    GROUP BY COALESCE(query_hash, query), model, focus
+                    HAVING hits >= ?
+                    ORDER BY hits DESC
+                    LIMIT ?
+                ) l
+                LEFT JOIN query_texts t ON t.hash = l.query_hash
+                ORDER BY l.hits DESC
+                """,
+                (since.strftime('%Y-%m-%d %H:%M:%S'), *NON_SEARCH_FOCUSES, min_count, limit)
+            )
+            return [dict(row) for row in cursor.fetchall()]
+    
+    def iter_query_logs(self, after_id: int = 0, chunk_size: int = 1000,
+                        since: Optional[str] = None,
+                        until: Optional[str] = None) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Stream query logs in id order, one chunk of rows at a time.
+        
+        Uses keyset pagination (id > last seen id) with a fresh connection per
+        chunk, so memory stays bounded and no read transaction is held open
+        between chunks.
+        
+        Args:
+            after_id: Resume after this log id
+            chunk_size: Rows per chunk
+            since/until: Optional created_at bounds ('YYYY-MM-DD[ HH:MM:SS]', UTC)
+        """
+        conditions = ["l.id > ?"]
+        filters: List[Any] = []
+        if since:
+            conditions.append("l.created_at >= ?")
+            filters.append(since)
+        if until:
+            conditions.append("l.created_at < ?")
+            filters.append(until)
+        
+        last_id = after_id
+        while True:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    f"""
+                    SELECT l.id, l.user_id, l.platform, {QUERY_TEXT_SQL} AS query,
+                           l.model, l.focus, l.response_time_ms, l.success,
+                           l.error_message, l.created_at
+                    FROM query_logs l
+                    LEFT JOIN query_texts t ON t.hash = l.query_hash
+                    WHERE {' AND '.join(conditions)}
+                    ORDER BY l.id
+                    LIMIT ?
+                    """,
+                    [last_id] + filters + [chunk_size]
+                )
+                rows = [dict(row) for row in cursor.fetchall()]
+            
+            if not rows:
+                return
+            yield rows
+            last_id = rows[-1]['id']
+            if len(rows) < chunk_size:
+                return
+    
+    # ==================== History Search ====================
+    
+    def search_history(self, text: str, user_id: Optional[int] = None,
+                       platform: Optional[str] = None, limit: int = 10,
+                       offset: int = 0, since: Optional[str] = None,
+                       order: str = 'rank') -> Dict[str, Any]:
+        """
+        Full-text search over past queries (and indexed answers).
+        
+        Args:
+            text: Free-text search terms
+            user_id/platform: Restrict to one user's history
+            limit/offset: Pagination
+            since: Optional created_at lower bound (UTC)
+            order: 'rank' (bm25, query matches weigh more) or 'recent'
+        
+        Returns:
+            Dict with 'results' and 'has_more'
+        """
+        if not self.fts_enabled:
+            raise RuntimeError("History search unavailable: SQLite built without FTS5")
+        if order not in ('rank', 'recent'):
+            raise ValueError(f"Invalid order: {order}")
+        
+        terms = _history_match(text)
+        if not terms:
+            return {'results': [], 'has_more': False}
+        
+        match = f"{{query answer}} : ({terms})"
+        if user_id is not None:
+            match = f'scope : "{_history_scope(user_id, platform)}" AND {match}'
+        
+        conditions = ["query_history_fts MATCH ?"]
+        params: List[Any] = [match]
+        if since:
+            conditions.append("l.created_at >= ?")
+            params.append(since)
+        
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT l.id, l.user_id, l.platform, l.model, l.focus, l.created_at,
+                       f.query,
+                       snippet(query_history_fts, 2, '*', '*', '…', 16) AS answer_snippet,
+                       bm25(query_history_fts, 0.0, 4.0, 1.0) AS score
+                FROM query_history_fts f
+                JOIN query_logs l ON l.id = f.rowid
+                WHERE {' AND '.join(conditions)}
+                ORDER BY {'score' if order == 'rank' else 'f.rowid DESC'}
+                LIMIT ? OFFSET ?
+                """,
+                params + [limit + 1, offset]
+            )
+            rows = [dict(row) for row in cursor.fetchall()]
+        
+        for row in rows:
+            row['score'] = round(-row['score'], 4)
+            if not row['answer_snippet']:
+                row['answer_snippet'] = None
+        
+        return {
+            'results': rows[:limit],
+            'has_more': len(rows) > limit
+        }
+    
+    # ==================== Latency Histograms ====================
+    
+    def get_latency_histograms(self, since: Optional[datetime] = None,
+                               until: Optional[datetime] = None,
+                               model: Optional[str] = None,
+                               focus: Optional[str] = None,
+                               platform: Optional[str] = None,
+                               group_by: Sequence[str] = ()) -> Dict[tuple, LatencyHistogram]:
+        """
+        Merge latency histogram buckets over a time window.
+        
+        Args:
+            since: Window start (UTC, inclusive). Defaults to the last 24 hours.
+            until: Window end (UTC, exclusive). Defaults to now.
+            model, focus, platform: Optional filters.
+            group_by: Dimensions to keep apart (subset of platform/model/focus).
+        
+        Returns:
+            Dict mapping the group_by values (as a tuple) to a merged histogram.
+        """
+        invalid = set(group_by) - {'platform', 'model', 'focus'}
+        if invalid:
+            raise ValueError(f"Invalid group_by: {', '.join(sorted(invalid))}")
+        
+        since = _naive_utc(since) if since else datetime.utcnow() - timedelta(hours=24)
+        # Include the bucket that contains `since`
+        since = _latency_bucket(since)
+        until = _naive_utc(until) if until else None
+        
+        conditions = ["bucket_start >= ?"]
+        params: List[Any] = [since.strftime('%Y-%m-%d %H:%M:%S')]
+        if until:
+            conditions.append("bucket_start < ?")
+            params.append(until.strftime('%Y-%m-%d %H:%M:%S'))
+        for column, value in (('model', model), ('focus', focus), ('platform', platform)):
+            if value:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        
+        merged: Dict[tuple, LatencyHistogram] = {}
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT platform, model, focus, counts, total_ms, max_ms
+                FROM latency_histograms
+                WHERE {' AND '.join(conditions)}
+                """,
+                params
+            )
+            for row in cursor:
+                key = tuple(row[column] for column in group_by)
+                histogram = LatencyHistogram.from_bytes(row['counts'], row['total_ms'], row['max_ms'])
+                if key in merged:
+                    merged[key].merge(histogram)
+                else:
+                    merged[key] = histogram
+        
+        return merged
+    
+    def get_latency_percentiles(self, since: Optional[datetime] = None,
+                                until: Optional[datetime] = None,
+                                model: Optional[str] = None,
+                                focus: Optional[str] = None,
+                                platform: Optional[str] = None,
+                                group_by: Sequence[str] = (),
+                                percentiles: Sequence[float] = (50, 90, 99)) -> List[Dict[str, Any]]:
+        """Latency percentiles over a time window, one entry per group."""
+        histograms = self.get_latency_histograms(
+            since, until, model, focus, platform, group_by
+        )
+        
+        results = []
+        for key in sorted(histograms):
+            entry = dict(zip(group_by, key))
+            entry.update(histograms[key].summary(percentiles))
+            results.append(entry)
+        return results
+    
+    # ==================== Cache Entries ====================
+    
+    def cache_get(self, namespace: str, key: str) -> Optional[tuple]:
+        """Return (value, expires_at) for a live entry, or None."""
+        with self._get_connection() as conn:
+            row = conn.execute(
+                """
+                SELECT value, expires_at FROM cache_entries
+                WHERE namespace = ? AND key = ? AND expires_at > ?
+                """,
+                (namespace, key, time.time())
+            ).fetchone()
+        
+        if not row:
+            return None
+        return json.loads(row['value']), row['expires_at']
+    
+    def cache_set(self, namespace: str, key: str, value: Any, ttl: float):
+        """Store a JSON-serializable value for `ttl` seconds."""
+        with self._get_connection() as conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at)
+                VALUES (?, ?, ?, ?)
+                """,
+                (namespace, key, json.dumps(value, ensure_ascii=False), time.time() + ttl)
+            )
+    
+    def cache_delete(self, namespace: str, key: str):
+        with self._get_connection() as conn:
+            conn.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+                (namespace, key)
+            )
+    
+    def purge_expired_cache(self) -> int:
+        """Delete expired cache entries."""
+        with self._get_connection() as conn:
+            return conn.execute(
+                "DELETE FROM cache_entries WHERE expires_at <= ?", (time.time(),)
+            ).rowcount
+    
+    # ==================== Idempotency Keys ====================
+    
+    def idempotency_claim(self, key: str, fingerprint: str,
+                          lease_seconds: float) -> Optional[Dict[str, Any]]:
+        """
+        Claim `key` for a new request, atomically across processes.
+        
+        Returns None when the key was free (or expired) and is now pending
+        for the caller, else the live row: {"fingerprint", "state",
+        "status", "content_type", "body"}.
+        """
+        now = time.time()
+        with self._get_connection(immediate=True) as conn:
+            row = conn.execute(
+                """
+                SELECT fingerprint, state, status, content_type, body FROM idempotency_keys
+                WHERE key = ? AND expires_at > ?
+                """,
+                (key, now)
+            ).fetchone()
+            if row:
+                return dict(row)
+            
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO idempotency_keys (key, fingerprint, state, expires_at)
+                VALUES (?, ?, 'pending', ?)
+                """,
+                (key, fingerprint, now + lease_seconds)
+            )
+        return None
+    
+    def idempotency_complete(self, key: str, fingerprint: str, status: int,
+                             content_type: str, body: bytes, ttl: float):
+        """
+        Store the response of a claimed key for `ttl` seconds. Only the
+        caller's own pending claim is updated, never a row another request
+        took over after the lease expired.
+        """
+        with self._get_connection() as conn:
+            conn.execute(
+                """
+                UPDATE idempotency_keys
+                SET state = 'done', status = ?, content_type = ?, body = ?, expires_at = ?
+                WHERE key = ? AND fingerprint = ? AND state = 'pending'
+                """,
+                (status, content_type, body, time.time() + ttl, key, fingerprint)
+            )
+    
+    def idempotency_release(self, key: str, fingerprint: str):
+        """Drop the caller's pending claim so the next request with the key runs again."""
+        with self._get_connection() as conn:
+            conn.execute(
+                """
+                DELETE FROM idempotency_keys
+                WHERE key = ? AND fingerprint = ? AND state = 'pending'
+                """,
+                (key, fingerprint)
+            )
+    
+    def purge_expired_idempotency_keys(self) -> int:
+        with self._get_connection() as conn:
+            return conn.execute(
+                "DELETE FROM idempotency_keys WHERE expires_at <= ?", (time.time(),)
+            ).rowcount
+    
+    # ==================== Worker Metrics ====================
+    
+    def save_worker_metrics(self, pid: int, snapshot: Dict[str, Any]):
+        """Store the latest metrics snapshot of a server process."""
+        with self._get_connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO worker_metrics (pid, snapshot, updated_at) VALUES (?, ?, ?)",
+                (pid, json.dumps(snapshot), time.time())
+            )
+    
+    def get_worker_metrics(self) -> Dict[int, Dict[str, Any]]:
+        """Latest snapshot per worker pid."""
+        with self._get_connection() as conn:
+            rows = conn.execute("SELECT pid, snapshot FROM worker_metrics").fetchall()
+        return {row['pid']: json.loads(row['snapshot']) for row in rows}
+    
+    def pop_worker_metrics(self, pid: int) -> Optional[Dict[str, Any]]:
+        """Remove and return the snapshot of a worker that exited."""
+        with self._get_connection(immediate=True) as conn:
+            row = conn.execute(
+                "SELECT snapshot FROM worker_metrics WHERE pid = ?", (pid,)
+            ).fetchone()
+            conn.execute("DELETE FROM worker_metrics WHERE pid = ?", (pid,))
+        return json.loads(row['snapshot']) if row else None
+    
+    # ==================== Leases ====================
+    
+    def claim_lease(self, name: str, holder: str, seconds: float) -> bool:
+        """
+        Take the lease `name` for `seconds` unless another holder has it.
+        Returns True when claimed; an expired lease can be taken by anyone.
+        """
+        now = time.time()
+        with self._get_connection() as conn:
+            return conn.execute(
                 """
-                DELETE FROM query_logs
-                WHERE created_at < datetime('now', '-{} days')
-                """.format(days)
+                INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT(name) DO UPDATE
+                SET holder = excluded.holder, expires_at = excluded.expires_at
+                WHERE leases.expires_at <= ?
+                """,
+                (name, holder, now + seconds, now)
+            ).rowcount > 0
+    
+    # ==================== Retention ====================
+    
+    def purge_expired(self, table: str, days: int, batch_size: int = 500,
+                      pause_seconds: float = 0.05,
+                      archive: Optional[Callable[[str, List[Dict[str, Any]]], None]] = None) -> int:
+        """
+        Delete rows older than `days` in small rowid-range batches.
+        
+        Each batch runs in its own short transaction and the worker sleeps
+        `pause_seconds` between batches, so request handlers never wait long
+        for the write lock.
+        
+        Args:
+            table: One of RETENTION_TABLES
+            days: Retention period
+            batch_size: Rowid span deleted per transaction
+            pause_seconds: Pause between batches
+            archive: Optional callback receiving (table, rows) before each delete
+        
+        Returns:
+            Number of deleted rows
+        """
+        if table not in RETENTION_TABLES:
+            raise ValueError(f"Invalid table: {table}")
+        column, monotonic = RETENTION_TABLES[table]
+        cutoff = (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+        
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT MIN(rowid) AS low, MAX(rowid) AS high FROM {table}")
+            row = cursor.fetchone()
+            if row['low'] is None:
+                return 0
+            low, end = row['low'], row['high'] + 1
+            
+            if monotonic:
+                # Index seek: first row that must be kept bounds the scan
+                cursor.execute(
+                    f"SELECT rowid FROM {table} WHERE {column} >= ? ORDER BY {column} LIMIT 1",
+                    (cutoff,)
+                )
+                first_kept = cursor.fetchone()
+                if first_kept:
+                    end = first_kept[0]
+        
+        deleted = 0
+        while low < end:
+            high = min(low + batch_size, end)
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                if archive:
+                    rows = self._expired_rows(cursor, table, column, low, high, cutoff)
+                    if rows:
+                        archive(table, rows)
+                if table == 'query_logs' and self.fts_enabled:
+                    # External-content deletes must repeat the indexed values,
+                    # read while the rows (and their texts) still exist
+                    cursor.execute(
+                        """
+                        INSERT INTO query_history_fts (query_history_fts, rowid, scope, query, answer)
+                        SELECT 'delete', id, scope, query, answer FROM query_history_content
+                        WHERE id IN (
+                            SELECT rowid FROM query_logs
+                            WHERE rowid >= ? AND rowid < ? AND created_at < ?
+                        )
+                        """,
+                        (low, high, cutoff)
+                    )
+                cursor.execute(
+                    f"DELETE FROM {table} WHERE rowid >= ? AND rowid < ? AND {column} < ?",
+                    (low, high, cutoff)
+                )
+                deleted += cursor.rowcount
+            low = high
+            if low < end and pause_seconds:
+                time.sleep(pause_seconds)
+        
+        return deleted
+    
+    @staticmethod
+    def _expired_rows(cursor, table: str, column: str, low: int, high: int,
+                      cutoff: str) -> List[Dict[str, Any]]:
+        """Rows of one purge batch, as archived."""
+        if table != 'query_logs':
+            cursor.execute(
+                f"SELECT * FROM {table} WHERE rowid >= ? AND rowid < ? AND {column} < ?",
+                (low, high, cutoff)
             )
-            return cursor.rowcount
\ No newline at end of file
+            return [dict(r) for r in cursor.fetchall()]
+        
+        # Archive the question (and indexed answer) text itself: its
+        # query_texts row is purged as an orphan right after the logs
+        cursor.execute(
+            f"""
+            SELECT l.*, {QUERY_TEXT_SQL} AS query_text,
+                   query_text(a.compressed, a.body) AS answer
+            FROM query_logs l
+            LEFT JOIN query_texts t ON t.hash = l.query_hash
+            LEFT JOIN query_texts a ON a.hash = l.answer_hash
+            WHERE l.rowid >= ? AND l.rowid < ? AND l.{column} < ?
+            """,
+            (low, high, cutoff)
+        )
+        rows = []
+        for r in cursor.fetchall():
+            row = dict(r)
+            row['query'] = row.pop('query_text')
+            rows.append(row)
+        return rows
+    
+    def incremental_vacuum_enabled(self) -> bool:
+        """Whether the database already runs with auto_vacuum=INCREMENTAL."""
+        with self._get_connection() as conn:
+            return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    
+    def enable_incremental_vacuum(self, max_bytes: Optional[int] = None) -> bool:
+        """
+        Switch an existing database to auto_vacuum=INCREMENTAL.
+        Requires a full VACUUM once, which rewrites the whole file under an
+        exclusive lock; with max_bytes, larger databases are left alone.
+        Returns True if a conversion happened.
+        """
+        with self._get_connection() as conn:
+            mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+            if mode == 2:
+                return False
+            if max_bytes is not None:
+                page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+                page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+                if page_count * page_size > max_bytes:
+                    return False
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            return True
+    
+    def incremental_vacuum(self, max_pages: int = 0) -> int:
+        """Return free pages to the OS. max_pages=0 releases all of them."""
+        with self._get_connection() as conn:
+            freed = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if max_pages:
+                conn.execute(f"PRAGMA incremental_vacuum({int(max_pages)})").fetchall()
+            else:
+                conn.execute("PRAGMA incremental_vacuum").fetchall()
+            return freed - conn.execute("PRAGMA freelist_count").fetchone()[0]
+    
+    def cleanup_old_logs(self, days: int = 30):
+        """Clean up logs older than specified days."""
+        return self.purge_expired('query_logs', days)
\ No newline at end of file
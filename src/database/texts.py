@@ -0,0 +1,36 @@
+"""
+Content-addressed text storage helpers for Perplexo Bot.
+Query texts are stored once per distinct value, zlib-compressed when large.
+"""
+
+import hashlib
+import zlib
+from typing import Optional, Tuple
+
+
+# Texts at or above this size (UTF-8 bytes) are stored zlib-compressed
+COMPRESS_THRESHOLD = 256
+
+
+def text_hash(text: str) -> bytes:
+    """16-byte content hash used as the query_texts key."""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+def encode_text(text: str, threshold: int = COMPRESS_THRESHOLD) -> Tuple[bool, bytes]:
+    """Return (compressed, body) for storage."""
+    raw = text.encode('utf-8')
+    if len(raw) >= threshold:
+        packed = zlib.compress(raw, 6)
+        if len(packed) < len(raw):
+            return True, packed
+    return False, raw
+
+
+def decode_text(compressed: Optional[int], body: Optional[bytes]) -> Optional[str]:
+    """Inverse of encode_text(). Registered as the query_text() SQL function."""
+    if body is None:
+        return None
+    if compressed:
+        body = zlib.decompress(body)
+    return bytes(body).decode('utf-8')
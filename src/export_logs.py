@@ -0,0 +1,13 @@
+"""
+Query log export CLI.
+Writes query_logs to day-partitioned gzip JSONL/CSV files, resuming from a checkpoint.
+
+Usage:
+    python3 src/export_logs.py --out exports --format jsonl
+"""
+
+from database.export import main
+
+
+if __name__ == '__main__':
+    main()
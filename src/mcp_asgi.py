@@ -0,0 +1,269 @@
+"""
+MCP Server (ASGI) - async variant of mcp_server.py.
+Same routes and JSON contract, served by uvicorn on one event loop so a single
+process can hold thousands of concurrent long-running requests.
+"""
+
+import hmac
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse as StarletteJSONResponse
+from starlette.routing import Route
+
+from database import RetentionWorker, parse_retention
+from service import AsyncPerplexoService, ServiceError, decode_base64
+from utils.listeners import MCP_UNIX_SOCKET, bind_sockets, describe
+from utils.serialization import dumps, loads
+
+# Initialize components (rate limit settings are read by the service)
+service = AsyncPerplexoService.from_env()
+db = service.db
+
+# Retention config (days per table; empty disables the worker)
+RETENTION_DAYS = os.getenv("RETENTION_DAYS", "query_logs=30,latency_histograms=90")
+RETENTION_INTERVAL = int(os.getenv("RETENTION_INTERVAL", "3600"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "500"))
+RETENTION_ARCHIVE_DIR = os.getenv("RETENTION_ARCHIVE_DIR", "")
+
+# Token required by admin-only queries (unset disables them)
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN", "")
+
+# Pending connections the listening socket queues before accepting
+ASGI_BACKLOG = int(os.getenv("ASGI_BACKLOG", "2048"))
+
+
+class JSONResponse(StarletteJSONResponse):
+    """JSON response encoded by utils.serialization (bytes straight from the encoder)."""
+    
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def admin_error(request: Request) -> Optional[JSONResponse]:
+    """Return an error response if the request is not from an admin, else None."""
+    if not ADMIN_API_TOKEN:
+        return JSONResponse({"error": "Admin API disabled (ADMIN_API_TOKEN not set)"}, 403)
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_API_TOKEN):
+        return JSONResponse({"error": "Unauthorized"}, 401)
+    return None
+
+
+async def json_body(request: Request) -> Optional[Dict[str, Any]]:
+    """Request JSON, or None when the body is missing or invalid (like get_json(silent=True))."""
+    try:
+        data = loads(await request.body())
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def int_arg(request: Request, name: str, default: Optional[int] = None) -> Optional[int]:
+    try:
+        return int(request.query_params[name])
+    except (KeyError, ValueError):
+        return default
+
+
+async def handle_service_error(request: Request, error: ServiceError):
+    return JSONResponse(error.payload, error.status)
+
+
+async def health_check(request: Request):
+    """Health check endpoint."""
+    return JSONResponse({
+        "status": "healthy",
+        "scraper_available": await service.scraper.is_available(),
+        "timestamp": datetime.now().isoformat()
+    })
+
+
+async def list_models(request: Request):
+    """List available models and focus modes."""
+    return JSONResponse({
+        "models": service.scraper.list_models(),
+        "focus_modes": service.scraper.list_focus_modes()
+    })
+
+
+async def search(request: Request):
+    """Search endpoint (body as in mcp_server.search)."""
+    return JSONResponse(await service.search(await json_body(request)))
+
+
+async def vision(request: Request):
+    """Vision endpoint (body as in mcp_server.vision)."""
+    data = await json_body(request)
+    if not data or 'query' not in data or ('image_base64' not in data and 'image_id' not in data):
+        return JSONResponse({"error": "Missing required fields: query, image_base64"}, 400)
+    
+    image = None
+    if 'image_base64' in data:
+        image = decode_base64(data.pop('image_base64'), "❌ Erro ao processar imagem")
+    return JSONResponse(await service.vision(data, image))
+
+
+async def transcribe(request: Request):
+    """Audio transcription endpoint (body as in mcp_server.transcribe)."""
+    data = await json_body(request)
+    if not data or 'audio_base64' not in data:
+        return JSONResponse({"error": "Missing required field: audio_base64"}, 400)
+    
+    audio = decode_base64(data.pop('audio_base64'), "❌ Erro ao transcrever áudio")
+    return JSONResponse(await service.transcribe(data, audio))
+
+
+async def get_user_stats(request: Request):
+    """Get statistics for a specific user."""
+    platform = request.query_params.get('platform', 'telegram')
+    return JSONResponse(
+        await service.run(db.get_user_stats, request.path_params['user_id'], platform)
+    )
+
+
+async def get_global_stats(request: Request):
+    """Get global statistics (admin only)."""
+    return JSONResponse(await service.run(db.get_global_stats))
+
+
+async def get_latency_stats(request: Request):
+    """Latency percentiles from the pre-aggregated histograms (params as in mcp_server)."""
+    args = request.query_params
+    try:
+        since = args.get('since')
+        until = args.get('until')
+        hours = float(args.get('hours', '24'))
+        group_by = [g for g in args.get('group_by', 'model,focus').split(',') if g]
+        
+        stats = await service.run(
+            db.get_latency_percentiles,
+            since=datetime.fromisoformat(since) if since else datetime.utcnow() - timedelta(hours=hours),
+            until=datetime.fromisoformat(until) if until else None,
+            model=args.get('model'),
+            focus=args.get('focus'),
+            platform=args.get('platform'),
+            group_by=group_by
+        )
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, 400)
+    
+    return JSONResponse({
+        "group_by": group_by,
+        "latency": stats
+    })
+
+
+async def search_history(request: Request):
+    """Full-text search over query history (params as in mcp_server)."""
+    text = request.query_params.get('q', '').strip()
+    if not text:
+        return JSONResponse({"error": "Missing required parameter: q"}, 400)
+    
+    # Per-user searches too: user_id is not a credential
+    error = admin_error(request)
+    if error:
+        return error
+    
+    user_id = int_arg(request, 'user_id')
+    
+    return JSONResponse(await service.run(
+        service.service.search_history,
+        text,
+        user_id=user_id,
+        platform=request.query_params.get('platform', 'telegram'),
+        days=int_arg(request, 'days'),
+        order=request.query_params.get('order', 'rank'),
+        limit=int_arg(request, 'limit', 10),
+        offset=int_arg(request, 'offset', 0)
+    ))
+
+
+async def user_config(request: Request):
+    """Get or update user configuration."""
+    user_id = request.path_params['user_id']
+    platform = request.query_params.get('platform', 'telegram')
+    
+    if request.method == 'GET':
+        return JSONResponse(await service.run(service.service.get_config, user_id, platform))
+    
+    data = await json_body(request)
+    return JSONResponse(
+        await service.run(service.service.update_config, user_id, platform, data)
+    )
+
+
+async def toggle_setting(request: Request):
+    """Toggle a boolean setting for a user."""
+    platform = request.query_params.get('platform', 'telegram')
+    
+    return JSONResponse(await service.run(
+        service.service.toggle_setting,
+        request.path_params['user_id'],
+        platform,
+        request.path_params['setting']
+    ))
+
+
+async def shutdown():
+    await service.aclose()
+
+
+app = Starlette(
+    routes=[
+        Route('/health', health_check, methods=['GET']),
+        Route('/models', list_models, methods=['GET']),
+        Route('/search', search, methods=['POST']),
+        Route('/vision', vision, methods=['POST']),
+        Route('/transcribe', transcribe, methods=['POST']),
+        Route('/stats/latency', get_latency_stats, methods=['GET']),
+        Route('/stats/{user_id:int}', get_user_stats, methods=['GET']),
+        Route('/stats', get_global_stats, methods=['GET']),
+        Route('/history/search', search_history, methods=['GET']),
+        Route('/config/{user_id:int}', user_config, methods=['GET', 'POST']),
+        Route('/config/{user_id:int}/toggle/{setting}', toggle_setting, methods=['POST']),
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])
+    ],
+    exception_handlers={ServiceError: handle_service_error},
+    on_shutdown=[shutdown]
+)
+
+
+def main():
+    """Run the ASGI MCP server."""
+    port = int(os.getenv("MCP_PORT", "5000"))
+    host = os.getenv("MCP_HOST", "127.0.0.1")
+    
+    sockets = bind_sockets(host, port, ASGI_BACKLOG)
+    
+    print(f"🚀 Perplexo MCP Server (ASGI) starting on {', '.join(describe(sock) for sock in sockets)}")
+    print(f"📊 Database: {os.getenv('DATABASE_PATH', 'data/perplexo.db')}")
+    
+    retention = parse_retention(RETENTION_DAYS)
+    if retention:
+        RetentionWorker(
+            db,
+            retention,
+            interval_seconds=RETENTION_INTERVAL,
+            batch_size=RETENTION_BATCH_SIZE,
+            archive_dir=RETENTION_ARCHIVE_DIR or None
+        ).start()
+        print(f"🧹 Retention: {retention}")
+    
+    config = uvicorn.Config(app, backlog=ASGI_BACKLOG, log_level="warning")
+    try:
+        uvicorn.Server(config).run(sockets=sockets)
+    finally:
+        if MCP_UNIX_SOCKET and os.path.exists(MCP_UNIX_SOCKET):
+            os.unlink(MCP_UNIX_SOCKET)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""
+MCP clients for the Telegram bot.
+HttpMcpClient talks to mcp_server.py; EmbeddedMcpClient calls the service layer in-process.
+"""
+
+import io
+import json
+import time
+import asyncio
+import base64
+import hashlib
+from typing import Dict, Any, AsyncIterator, Optional
+
+import httpx
+
+
+class McpError(Exception):
+    """Raised by McpResponse.raise_for_status() for error responses."""
+    
+    def __init__(self, status_code: int, payload: Dict[str, Any]):
+        super().__init__(f"MCP error {status_code}: {payload.get('error', '')}")
+        self.status_code = status_code
+        self.payload = payload
+
+
+class McpResponse:
+    """Response of an in-process call, shaped like the httpx.Response the handlers read."""
+    
+    def __init__(self, status_code: int, data: Dict[str, Any]):
+        self.status_code = status_code
+        self._data = data
+    
+    def json(self) -> Dict[str, Any]:
+        return self._data
+    
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise McpError(self.status_code, self._data)
+
+
+def timeout_seconds(timeout: Any) -> Optional[float]:
+    """Seconds a caller waits: a number, or the read timeout of an httpx.Timeout."""
+    if isinstance(timeout, httpx.Timeout):
+        return timeout.read
+    return timeout
+
+
+def idempotency_key(path: str, payload: Dict[str, Any]) -> str:
+    """
+    Idempotency-Key derived from the request itself, so a user resending the
+    same message after a timeout attaches to the first request instead of
+    running it again.
+    """
+    canonical = json.dumps([path, payload], sort_keys=True, ensure_ascii=False, default=str)
+    digest = hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:32]
+    return f"{payload.get('platform', 'telegram')}:{payload.get('user_id', 0)}:{digest}"
+
+
+class HttpMcpClient:
+    """
+    MCP API over HTTP, one keep-alive pool shared by every handler.
+    
+    Args:
+        client: httpx.AsyncClient with base_url pointing at the MCP server
+        admin_token: X-Admin-Token for /history/search (ADMIN_API_TOKEN)
+    """
+    
+    def __init__(self, client: httpx.AsyncClient, admin_token: Optional[str] = None):
+        self.client = client
+        self.admin_token = admin_token
+    
+    @staticmethod
+    def _timeout(timeout: Optional[float]) -> Dict[str, Any]:
+        # None would disable the timeout in httpx; omit it to keep the client default
+        return {} if timeout is None else {'timeout': timeout}
+    
+    @staticmethod
+    def _headers(path: str, payload: Dict[str, Any], timeout: Optional[float]) -> Dict[str, str]:
+        headers = {"Idempotency-Key": idempotency_key(path, payload)}
+        seconds = timeout_seconds(timeout)
+        if seconds is not None:
+            # The server stops working on the request when this client stops waiting
+            headers["X-Request-Deadline"] = f"{time.time() + seconds:.3f}"
+        return headers
+    
+    async def search(self, payload: Dict[str, Any], timeout: Optional[float] = None):
+        return await self.client.post(
+            "/search", json=payload,
+            headers=self._headers("/search", payload, timeout),
+            **self._timeout(timeout)
+        )
+    
+    async def vision(self, payload: Dict[str, Any], image: Optional[bytes],
+                     timeout: Optional[float] = None):
+        body = dict(payload)
+        if image is not None:
+            body['image_base64'] = base64.b64encode(image).decode()
+        # Same key with or without the image: the retry after a 409 is the same request
+        return await self.client.post(
+            "/vision", json=body,
+            headers=self._headers("/vision", payload, timeout),
+            **self._timeout(timeout)
+        )
+    
+    async def transcribe(self, payload: Dict[str, Any], audio: bytes,
+                         timeout: Optional[float] = None):
+        body = dict(payload, audio_base64=base64.b64encode(audio).decode())
+        return await self.client.post("/transcribe", json=body, **self._timeout(timeout))
+    
+    async def _stream_events(self, url: str, params: Dict[str, Any], content: bytes,
+                             content_type: str,
+                             timeout: Optional[float]) -> AsyncIterator[Dict[str, Any]]:
+        """POST a raw body and yield the NDJSON events of the response."""
+        async with self.client.stream(
+            "POST", url,
+            params=params,
+            content=bytes(content),
+            headers={"Content-Type": content_type},
+            **self._timeout(timeout)
+        ) as response:
+            if response.status_code >= 400:
+                await response.aread()
+                yield {"event": "error", "status": response.status_code, **response.json()}
+                return
+            
+            async for line in response.aiter_lines():
+                if line.strip():
+                    yield json.loads(line)
+    
+    def summarize_document(self, params: Dict[str, Any], document: bytes,
+                           timeout: Optional[float] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Upload a text document and yield the NDJSON progress events."""
+        return self._stream_events(
+            "/documents/summarize", params, document, "text/plain; charset=utf-8", timeout
+        )
+    
+    def voice_ask(self, params: Dict[str, Any], audio: bytes,
+                  timeout: Optional[float] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Upload a voice message and yield the transcript and answer events."""
+        return self._stream_events("/voice/ask", params, audio, "audio/ogg", timeout)
+    
+    async def get_config(self, user_id: int, platform: str = 'telegram'):
+        return await self.client.get(f"/config/{user_id}", params={"platform": platform})
+    
+    async def update_config(self, user_id: int, platform: str, config: Dict[str, Any]):
+        return await self.client.post(
+            f"/config/{user_id}", params={"platform": platform}, json=config
+        )
+    
+    async def toggle_setting(self, user_id: int, platform: str, setting: str):
+        return await self.client.post(
+            f"/config/{user_id}/toggle/{setting}", params={"platform": platform}
+        )
+    
+    async def search_history(self, params: Dict[str, Any], timeout: Optional[float] = None):
+        headers = {"X-Admin-Token": self.admin_token} if self.admin_token else {}
+        return await self.client.get(
+            "/history/search", params=params, headers=headers, **self._timeout(timeout)
+        )
+    
+    async def aclose(self):
+        await self.client.aclose()
+
+
+class EmbeddedMcpClient:
+    """
+    Same interface as HttpMcpClient, served by a PerplexoService in this process.
+    
+    Blocking scraper and SQLite work runs in worker threads; rate limiting and
+    query logging are the service's, so they match the HTTP server exactly.
+    Timeouts are not enforced here (the scraper applies its own).
+    
+    Args:
+        service: PerplexoService instance
+    """
+    
+    def __init__(self, service):
+        self.service = service
+    
+    async def _call(self, func, *args, **kwargs) -> McpResponse:
+        from service import ServiceError
+        
+        try:
+            return McpResponse(200, await asyncio.to_thread(func, *args, **kwargs))
+        except ServiceError as e:
+            return McpResponse(e.status, e.payload)
+    
+    @staticmethod
+    def _deadline(timeout: Optional[float]):
+        from utils.deadline import Deadline
+        
+        seconds = timeout_seconds(timeout)
+        return Deadline(None if seconds is None else time.time() + seconds)
+    
+    async def search(self, payload: Dict[str, Any], timeout: Optional[float] = None):
+        return await self._call(self.service.search, payload, self._deadline(timeout))
+    
+    async def vision(self, payload: Dict[str, Any], image: Optional[bytes],
+                     timeout: Optional[float] = None):
+        return await self._call(
+            self.service.vision, dict(payload), None if image is None else bytes(image),
+            self._deadline(timeout)
+        )
+    
+    async def transcribe(self, payload: Dict[str, Any], audio: bytes,
+                         timeout: Optional[float] = None):
+        return await self._call(self.service.transcribe, payload, bytes(audio))
+    
+    async def _iter_events(self, func, *args) -> AsyncIterator[Dict[str, Any]]:
+        from service import ServiceError
+        
+        try:
+            events = await asyncio.to_thread(func, *args)
+        except ServiceError as e:
+            yield {"event": "error", "status": e.status, **e.payload}
+            return
+        
+        # Each step of the blocking generator runs in a worker thread
+        done = object()
+        while True:
+            event = await asyncio.to_thread(next, events, done)
+            if event is done:
+                return
+            yield event
+    
+    def summarize_document(self, params: Dict[str, Any], document: bytes,
+                           timeout: Optional[float] = None) -> AsyncIterator[Dict[str, Any]]:
+        return self._iter_events(
+            self.service.summarize_document, params, io.BytesIO(bytes(document))
+        )
+    
+    def voice_ask(self, params: Dict[str, Any], audio: bytes,
+                  timeout: Optional[float] = None) -> AsyncIterator[Dict[str, Any]]:
+        return self._iter_events(self.service.voice_ask, params, bytes(audio))
+    
+    async def get_config(self, user_id: int, platform: str = 'telegram'):
+        return await self._call(self.service.get_config, user_id, platform)
+    
+    async def update_config(self, user_id: int, platform: str, config: Dict[str, Any]):
+        return await self._call(self.service.update_config, user_id, platform, config)
+    
+    async def toggle_setting(self, user_id: int, platform: str, setting: str):
+        return await self._call(self.service.toggle_setting, user_id, platform, setting)
+    
+    async def search_history(self, params: Dict[str, Any], timeout: Optional[float] = None):
+        return await self._call(
+            self.service.search_history,
+            params['q'],
+            user_id=params.get('user_id'),
+            platform=params.get('platform', 'telegram'),
+            days=params.get('days'),
+            order=params.get('order', 'rank'),
+            limit=params.get('limit', 10),
+            offset=params.get('offset', 0)
+        )
+    
+    async def aclose(self):
+        pass
@@ -4,32 +4,190 @@ Provides HTTP endpoints for the Telegram and WhatsApp bots.
 """
 
 import os
-import base64
-import tempfile
+import json
 import time
-from datetime import datetime
-from typing import Dict, Any, Optional
+import hashlib
+import hmac
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Any, Optional, Tuple
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
-from waitress import serve
 
-from scraper import PerplexoScraper, PerplexityModel, FocusMode
-from database import Database
+from database import (
+    RetentionWorker, parse_retention,
+    IdempotencyStore, IdempotencyConflict, IdempotencyInProgress, StoredResponse
+)
+from database.export import stream_export, EXPORT_FORMATS
+from database.idempotency import IDEMPOTENCY_WAIT
+from service import PerplexoService, ServiceError, decode_base64
+from utils.deadline import Deadline
+from utils.listeners import MCP_UNIX_SOCKET, bind_sockets, create_servers, describe
+from utils.metrics import MetricsRegistry
+from utils.serialization import dumps, dumps_line, loads
+from warmer import WARMER_BUDGET, WARMER_TOP_N, CacheWarmer
+
+
+class FastJSONProvider(JSONProvider):
+    """Flask JSON through utils.serialization; jsonify() bodies are written as bytes."""
+    
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return dumps(obj).decode('utf-8')
+    
+    def loads(self, s: Any, **kwargs: Any) -> Any:
+        return loads(s)
+    
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj), mimetype='application/json')
+
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 CORS(app)
 
-# Initialize components
-db = Database(os.getenv("DATABASE_PATH", "data/perplexo.db"))
-scraper = PerplexoScraper(
-    session_token=os.getenv("PERPLEXITY_SESSION_TOKEN"),
-    api_key=os.getenv("PERPLEXITY_API_KEY")
-)
+# Request counts and latency of this process (aggregated across workers by prefork.py)
+metrics = MetricsRegistry()
+
+# Initialize components (rate limit settings are read by the service)
+service = PerplexoService.from_env(metrics=metrics)
+db = service.db
+scraper = service.scraper
+
+# Idempotency-Key claims and stored responses (shared by prefork workers)
+idempotency = IdempotencyStore(db)
+
+# Retention config (days per table; empty disables the worker)
+RETENTION_DAYS = os.getenv("RETENTION_DAYS", "query_logs=30,latency_histograms=90")
+RETENTION_INTERVAL = int(os.getenv("RETENTION_INTERVAL", "3600"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "500"))
+RETENTION_ARCHIVE_DIR = os.getenv("RETENTION_ARCHIVE_DIR", "")
+
+# Pending connections each listening socket queues before accepting
+LISTEN_BACKLOG = int(os.getenv("LISTEN_BACKLOG", "2048"))
+
+# Token required by /admin endpoints (unset disables them)
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN", "")
+
+
+def admin_error():
+    """Return an error response if the request is not from an admin, else None."""
+    if not ADMIN_API_TOKEN:
+        return jsonify({"error": "Admin API disabled (ADMIN_API_TOKEN not set)"}), 403
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_API_TOKEN):
+        return jsonify({"error": "Unauthorized"}), 401
+    return None
+
+
+def json_body() -> Any:
+    """
+    Request JSON like get_json(silent=True), parsed straight from the body
+    bytes without keeping a cached copy of the (multi-MB, base64) body.
+    """
+    if not request.is_json:
+        return None
+    try:
+        return loads(request.get_data(cache=False))
+    except ValueError:
+        return None
+
+
+def request_fingerprint(data: Dict[str, Any], exclude: Tuple[str, ...] = ()) -> str:
+    """Hash of the route and the JSON fields that define the request."""
+    fields = {name: value for name, value in data.items() if name not in exclude}
+    canonical = json.dumps(fields, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(f"{request.path}\n{canonical}".encode('utf-8')).hexdigest()
+
+
+def request_deadline() -> Deadline:
+    """
+    Deadline of the current request: the X-Request-Deadline header (Unix time
+    in seconds by which the client stops waiting) plus waitress' check for a
+    closed client connection.
+    """
+    return Deadline.from_header(
+        request.headers.get('X-Request-Deadline'),
+        request.environ.get('waitress.client_disconnected')
+    )
+
+
+def idempotent(data: Any, handler: Callable[[], Any], exclude: Tuple[str, ...] = (),
+               deadline: Optional[Deadline] = None):
+    """
+    Run `handler` once per Idempotency-Key header.
+    
+    A retry with the same key and request attaches to the original while it
+    runs, or gets its stored response (marked Idempotent-Replayed: true)
+    afterwards, without calling the scraper or counting against the rate
+    limit again. Only 2xx responses are stored; fields in `exclude` are left
+    out of the fingerprint. A retry waits for the original no longer than
+    its own `deadline`.
+    """
+    key = request.headers.get('Idempotency-Key')
+    if not key or not isinstance(data, dict):
+        return handler()
+    if len(key) > 255:
+        return jsonify({"error": "Idempotency-Key too long (max 255 characters)"}), 400
+    
+    def run() -> StoredResponse:
+        response = app.make_response(handler())
+        return StoredResponse(response.status_code, response.content_type, response.get_data(), False)
+    
+    try:
+        wait_seconds = deadline.timeout(IDEMPOTENCY_WAIT) if deadline else IDEMPOTENCY_WAIT
+        stored = idempotency.execute(key, request_fingerprint(data, exclude), run, wait_seconds)
+    except IdempotencyConflict:
+        return jsonify({"error": "Idempotency-Key already used for a different request"}), 422
+    except IdempotencyInProgress:
+        response = jsonify({"error": "request_in_progress"})
+        response.headers['Retry-After'] = '5'
+        return response, 409
+    
+    metrics.inc("idempotency:replayed" if stored.replayed else "idempotency:executed")
+    response = app.response_class(stored.body, status=stored.status, content_type=stored.content_type)
+    if stored.replayed:
+        response.headers['Idempotent-Replayed'] = 'true'
+    return response
 
-# Rate limiting config
-RATE_LIMIT_MESSAGES = int(os.getenv("RATE_LIMIT_MESSAGES", "20"))
-RATE_LIMIT_WINDOW = int(os.getenv("RATE_LIMIT_WINDOW", "3600"))
+
+def with_timeout_hint(response: Any, endpoint: str, model: Any):
+    """
+    Add X-Timeout-Hint: the seconds the server currently waits for `model`
+    upstream on `endpoint` (see utils.timeouts), so clients can size their
+    own timeout to it instead of a fixed worst case.
+    """
+    response = app.make_response(response)
+    if isinstance(model, str):
+        response.headers['X-Timeout-Hint'] = f"{service.timeouts.timeout(endpoint, model):.1f}"
+    return response
+
+
+def arg_flag(name: str, default: bool) -> bool:
+    """Boolean query param ("true"/"1"/"yes" are true)."""
+    value = request.args.get(name)
+    if value is None:
+        return default
+    return value.lower() in ('true', '1', 'yes')
+
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_metrics(response: Response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.inc(f"requests:{route}:{response.status_code}")
+    if 'request_started' in g:
+        metrics.observe(f"latency:{route}", int((time.perf_counter() - g.request_started) * 1000))
+    return response
+
+
+@app.errorhandler(ServiceError)
+def handle_service_error(error: ServiceError):
+    return jsonify(error.payload), error.status
 
 
 @app.route('/health', methods=['GET'])
@@ -44,10 +202,11 @@ def health_check():
 
 @app.route('/models', methods=['GET'])
 def list_models():
-    """List available models and focus modes."""
+    """List available models, focus modes and current upstream timeouts (s)."""
     return jsonify({
         "models": scraper.list_models(),
-        "focus_modes": scraper.list_focus_modes()
+        "focus_modes": scraper.list_focus_modes(),
+        "timeouts": service.timeouts.snapshot()
     })
 
 
@@ -65,83 +224,27 @@ def search():
         "return_citations": bool,
         "return_images": bool,
         "user_id": int (optional),
-        "platform": "telegram|whatsapp" (optional)
+        "platform": "telegram|whatsapp" (optional),
+        "config_version": "updated_at of the client's cached config" (optional),
+        "render": "telegram|whatsapp" (optional)
     }
+    
+    When config_version is sent and no longer matches the stored config,
+    the response carries "config_stale": true so the client can refetch it.
+    With render, the response also has "chunks": the answer with citations
+    and model badge, formatted for that platform and split into messages
+    that each fit its size limit with balanced Markdown.
+    
+    Send an Idempotency-Key header to make client retries safe (see idempotent()).
+    Send X-Request-Deadline (Unix time in seconds) to have the server give up
+    with 504 once the client no longer waits for the answer. Responses carry
+    X-Timeout-Hint (see with_timeout_hint()).
     """
-    try:
-        data = request.json
-        
-        # Validate required fields
-        if not data or 'query' not in data:
-            return jsonify({"error": "Missing required field: query"}), 400
-        
-        query = data['query']
-        model = data.get('model', 'sonar')
-        focus = data.get('focus', 'web')
-        enable_reasoning = data.get('enable_reasoning', False)
-        return_citations = data.get('return_citations', True)
-        return_images = data.get('return_images', False)
-        
-        user_id = data.get('user_id')
-        platform = data.get('platform', 'telegram')
-        
-        # Check rate limit if user_id provided
-        if user_id:
-            allowed, remaining, reset_time = db.check_rate_limit(
-                user_id, platform, RATE_LIMIT_MESSAGES, RATE_LIMIT_WINDOW
-            )
-            
-            if not allowed:
-                return jsonify({
-                    "error": "Rate limit exceeded",
-                    "reset_time": reset_time.isoformat(),
-                    "limit": RATE_LIMIT_MESSAGES
-                }), 429
-        
-        # Call scraper
-        start_time = time.time()
-        
-        result = scraper.ask(
-            query=query,
-            model=model,
-            focus=focus,
-            enable_reasoning=enable_reasoning
-        )
-        
-        response_time_ms = int((time.time() - start_time) * 1000)
-        
-        # Log query
-        if user_id:
-            db.log_query(
-                user_id=user_id,
-                platform=platform,
-                query=query,
-                model=model,
-                focus=focus,
-                response_time_ms=response_time_ms,
-                success='error' not in result
-            )
-        
-        # Filter response based on preferences
-        if not return_citations:
-            result['citations'] = []
-        
-        if not return_images:
-            result['images'] = []
-        
-        # Add metadata
-        result['response_time_ms'] = response_time_ms
-        result['timestamp'] = datetime.now().isoformat()
-        
-        return jsonify(result)
-        
-    except Exception as e:
-        return jsonify({
-            "error": str(e),
-            "text": "❌ Erro interno no servidor",
-            "citations": [],
-            "images": []
-        }), 500
+    data = request.get_json(silent=True)
+    deadline = request_deadline()
+    model = data.get('model', 'sonar') if isinstance(data, dict) else 'sonar'
+    response = idempotent(data, lambda: jsonify(service.search(data, deadline)), deadline=deadline)
+    return with_timeout_hint(response, 'search', model)
 
 
 @app.route('/vision', methods=['POST'])
@@ -155,80 +258,69 @@ def vision():
         "image_base64": "base64_encoded_image",
         "model": "sonar-pro" (optional),
         "user_id": int (optional),
-        "platform": "telegram|whatsapp" (optional)
+        "platform": "telegram|whatsapp" (optional),
+        "preprocessed": bool (optional, skip server-side downscaling),
+        "image_id": "client-side image id, e.g. telegram:<file_unique_id>" (optional),
+        "render": "telegram|whatsapp" (optional)
     }
+    
+    With render, the response also has "chunks": the analysis split into
+    messages that fit the platform limit.
+    image_base64 may be omitted when image_id is sent. If the server has not
+    seen that image (or no longer caches it) it answers 409 with
+    {"error": "image_required"} and the client retries with the image.
+    Idempotency-Key, X-Request-Deadline and X-Timeout-Hint work as in /search.
     """
-    try:
-        data = request.json
-        
-        if not data or 'query' not in data or 'image_base64' not in data:
-            return jsonify({
-                "error": "Missing required fields: query, image_base64"
-            }), 400
-        
-        query = data['query']
-        image_b64 = data['image_base64']
-        model = data.get('model', 'sonar-pro')
-        
-        user_id = data.get('user_id')
-        platform = data.get('platform', 'telegram')
-        
-        # Check rate limit
-        if user_id:
-            allowed, remaining, reset_time = db.check_rate_limit(
-                user_id, platform, RATE_LIMIT_MESSAGES, RATE_LIMIT_WINDOW
-            )
-            
-            if not allowed:
-                return jsonify({
-                    "error": "Rate limit exceeded",
-                    "reset_time": reset_time.isoformat()
-                }), 429
-        
-        # Save image temporarily
-        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmp:
-            tmp.write(base64.b64decode(image_b64))
-            tmp_path = tmp.name
-        
-        try:
-            # Call scraper with image
-            start_time = time.time()
-            
-            result = scraper.ask_with_image(
-                query=query,
-                image_path=tmp_path,
-                model=model
-            )
-            
-            response_time_ms = int((time.time() - start_time) * 1000)
-            
-            # Log query
-            if user_id:
-                db.log_query(
-                    user_id=user_id,
-                    platform=platform,
-                    query=f"[IMAGE] {query}",
-                    model=model,
-                    focus="vision",
-                    response_time_ms=response_time_ms,
-                    success='error' not in result
-                )
-            
-            result['response_time_ms'] = response_time_ms
-            result['timestamp'] = datetime.now().isoformat()
-            
-            return jsonify(result)
-            
-        finally:
-            # Cleanup temp file
-            import os
-            os.unlink(tmp_path)
-            
-    except Exception as e:
+    data = json_body()
+    if not data or 'query' not in data or ('image_base64' not in data and 'image_id' not in data):
         return jsonify({
-            "error": str(e),
-            "text": "❌ Erro ao processar imagem"
-        }), 500
+            "error": "Missing required fields: query, image_base64"
+        }), 400
+    
+    deadline = request_deadline()
+    
+    def run():
+        image = None
+        if 'image_base64' in data:
+            image = decode_base64(data.pop('image_base64'), "❌ Erro ao processar imagem")
+        return jsonify(service.vision(data, image, deadline))
+    
+    # With image_id, the id names the image: a retry may come with or without it
+    response = idempotent(data, run, ('image_base64',) if 'image_id' in data else (), deadline)
+    return with_timeout_hint(response, 'vision', data.get('model', 'sonar-pro'))
+
+
+@app.route('/documents/summarize', methods=['POST'])
+def summarize_document():
+    """
+    Summarize a large text document (map-reduce over paragraph chunks).
+    
+    Request body: the raw UTF-8 text (not JSON), read as a stream.
+    
+    Query params:
+        model: model used for every chunk (default sonar)
+        file_name: shown in the result (optional)
+        user_id, platform: for rate limiting and logging (optional)
+        render: telegram|whatsapp, adds formatted "chunks" to the result (optional)
+    
+    Response: NDJSON progress events, one per line, ending with a
+    "result" or "error" event (see PerplexoService.summarize_document).
+    """
+    events = service.summarize_document(
+        {
+            "model": request.args.get('model', 'sonar'),
+            "file_name": request.args.get('file_name'),
+            "user_id": request.args.get('user_id', type=int),
+            "platform": request.args.get('platform', 'telegram'),
+            "render": request.args.get('render')
+        },
+        request.stream
+    )
+    
+    return Response(
+        stream_with_context(dumps_line(event) for event in events),
+        mimetype='application/x-ndjson'
+    )
 
 
 @app.route('/transcribe', methods=['POST'])
@@ -244,55 +336,48 @@ def transcribe():
         "platform": "telegram|whatsapp" (optional)
     }
     """
-    try:
-        data = request.json
-        
-        if not data or 'audio_base64' not in data:
-            return jsonify({"error": "Missing required field: audio_base64"}), 400
-        
-        audio_b64 = data['audio_base64']
-        language = data.get('language', 'pt')
-        
-        # Save audio temporarily
-        with tempfile.NamedTemporaryFile(suffix='.ogg', delete=False) as tmp:
-            tmp.write(base64.b64decode(audio_b64))
-            tmp_path = tmp.name
-        
-        try:
-            # Use OpenAI Whisper for transcription
-            import openai
-            
-            openai_api_key = os.getenv("OPENAI_API_KEY")
-            if not openai_api_key:
-                return jsonify({
-                    "error": "OpenAI API key not configured",
-                    "text": "⚠️ Transcrição de áudio não disponível. Configure OPENAI_API_KEY."
-                }), 503
-            
-            client = openai.OpenAI(api_key=openai_api_key)
-            
-            with open(tmp_path, 'rb') as audio_file:
-                transcript = client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_file,
-                    language=language
-                )
-            
-            return jsonify({
-                "text": transcript.text,
-                "language": language,
-                "timestamp": datetime.now().isoformat()
-            })
-            
-        finally:
-            import os
-            os.unlink(tmp_path)
-            
-    except Exception as e:
-        return jsonify({
-            "error": str(e),
-            "text": "❌ Erro ao transcrever áudio"
-        }), 500
+    data = json_body()
+    if not data or 'audio_base64' not in data:
+        return jsonify({"error": "Missing required field: audio_base64"}), 400
+    
+    audio = decode_base64(data.pop('audio_base64'), "❌ Erro ao transcrever áudio")
+    return jsonify(service.transcribe(data, audio))
+
+
+@app.route('/voice/ask', methods=['POST'])
+def voice_ask():
+    """
+    Transcribe a voice message and search with the transcript in one call.
+    
+    Request body: the raw audio bytes (e.g. OGG/Opus), not base64.
+    
+    Query params: the /search fields except query (model, focus,
+    enable_reasoning, return_citations, return_images, user_id, platform,
+    config_version, render) plus language (default pt).
+    
+    Response: NDJSON events, one per line: "transcript" as soon as Whisper
+    returns, then "answer" with the /search result, or "error".
+    """
+    data = {
+        "language": request.args.get('language', 'pt'),
+        "model": request.args.get('model', 'sonar'),
+        "focus": request.args.get('focus', 'web'),
+        "enable_reasoning": arg_flag('enable_reasoning', False),
+        "return_citations": arg_flag('return_citations', True),
+        "return_images": arg_flag('return_images', False),
+        "user_id": request.args.get('user_id', type=int),
+        "platform": request.args.get('platform', 'telegram'),
+        "render": request.args.get('render')
+    }
+    if 'config_version' in request.args:
+        data['config_version'] = request.args['config_version']
+    
+    events = service.voice_ask(data, request.get_data())
+    
+    return Response(
+        stream_with_context(dumps_line(event) for event in events),
+        mimetype='application/x-ndjson'
+    )
 
 
 @app.route('/stats/<int:user_id>', methods=['GET'])
@@ -310,22 +395,121 @@ def get_global_stats():
     return jsonify(stats)
 
 
+@app.route('/stats/latency', methods=['GET'])
+def get_latency_stats():
+    """
+    Latency percentiles from the pre-aggregated histograms.
+    
+    Query params:
+        hours: window size ending now (default 24), or
+        since/until: ISO timestamps in UTC
+        model, focus, platform: optional filters
+        group_by: comma-separated subset of "model,focus,platform" (default "model,focus")
+    """
+    try:
+        since = request.args.get('since')
+        until = request.args.get('until')
+        hours = float(request.args.get('hours', '24'))
+        group_by = [
+            g for g in request.args.get('group_by', 'model,focus').split(',') if g
+        ]
+        
+        stats = db.get_latency_percentiles(
+            since=datetime.fromisoformat(since) if since else datetime.utcnow() - timedelta(hours=hours),
+            until=datetime.fromisoformat(until) if until else None,
+            model=request.args.get('model'),
+            focus=request.args.get('focus'),
+            platform=request.args.get('platform'),
+            group_by=group_by
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    return jsonify({
+        "group_by": group_by,
+        "latency": stats
+    })
+
+
+@app.route('/history/search', methods=['GET'])
+def search_history():
+    """
+    Full-text search over query history (admin only, also for one user's history).
+    
+    Query params:
+        q: search terms (required)
+        user_id: restrict to one user (omit for a global search)
+        platform: telegram|whatsapp (default telegram)
+        days: only the last N days (optional)
+        order: rank|recent (default rank)
+        limit: page size (default 10, max 50)
+        offset: pagination offset
+    """
+    text = request.args.get('q', '').strip()
+    if not text:
+        return jsonify({"error": "Missing required parameter: q"}), 400
+    
+    # Per-user searches too: user_id is not a credential
+    error = admin_error()
+    if error:
+        return error
+    
+    user_id = request.args.get('user_id', type=int)
+    return jsonify(service.search_history(
+        text,
+        user_id=user_id,
+        platform=request.args.get('platform', 'telegram'),
+        days=request.args.get('days', type=int),
+        order=request.args.get('order', 'rank'),
+        limit=request.args.get('limit', 10, type=int),
+        offset=request.args.get('offset', 0, type=int)
+    ))
+
+
+@app.route('/admin/export/query_logs', methods=['GET'])
+def export_query_logs():
+    """
+    Stream query logs as a gzip-compressed file (admin only).
+    
+    Query params:
+        format: jsonl|csv (default jsonl)
+        after_id: resume after this log id
+        since/until: created_at bounds (UTC)
+    """
+    error = admin_error()
+    if error:
+        return error
+    
+    fmt = request.args.get('format', 'jsonl')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"Invalid format: {fmt}"}), 400
+    
+    chunks = stream_export(
+        db,
+        fmt=fmt,
+        after_id=request.args.get('after_id', 0, type=int),
+        since=request.args.get('since'),
+        until=request.args.get('until')
+    )
+    
+    return Response(
+        stream_with_context(chunks),
+        mimetype='application/gzip',
+        headers={
+            "Content-Disposition": f"attachment; filename=query_logs.{fmt}.gz"
+        }
+    )
+
+
 @app.route('/config/<int:user_id>', methods=['GET', 'POST'])
 def user_config(user_id: int):
     """Get or update user configuration."""
     platform = request.args.get('platform', 'telegram')
     
     if request.method == 'GET':
-        config = db.get_user_config(user_id, platform)
-        return jsonify(config)
+        return jsonify(service.get_config(user_id, platform))
     
-    elif request.method == 'POST':
-        data = request.json
-        if not data:
-            return jsonify({"error": "No data provided"}), 400
-        
-        db.update_user_config(user_id, platform, data)
-        return jsonify({"success": True, "config": data})
+    return jsonify(service.update_config(user_id, platform, request.get_json(silent=True)))
 
 
 @app.route('/config/<int:user_id>/toggle/<setting>', methods=['POST'])
@@ -333,15 +517,7 @@ def toggle_setting(user_id: int, setting: str):
     """Toggle a boolean setting for a user."""
     platform = request.args.get('platform', 'telegram')
     
-    try:
-        new_value = db.toggle_setting(user_id, platform, setting)
-        return jsonify({
-            "success": True,
-            "setting": setting,
-            "value": new_value
-        })
-    except ValueError as e:
-        return jsonify({"error": str(e)}), 400
+    return jsonify(service.toggle_setting(user_id, platform, setting))
 
 
 def main():
@@ -349,12 +525,34 @@ def main():
     port = int(os.getenv("MCP_PORT", "5000"))
     host = os.getenv("MCP_HOST", "127.0.0.1")
     
-    print(f"🚀 Perplexo MCP Server starting on {host}:{port}")
+    sockets = bind_sockets(host, port, LISTEN_BACKLOG)
+    
+    print(f"🚀 Perplexo MCP Server starting on {', '.join(describe(sock) for sock in sockets)}")
     print(f"📊 Database: {os.getenv('DATABASE_PATH', 'data/perplexo.db')}")
     print(f"🤖 Scraper available: {scraper.is_available()}")
     
-    # Use waitress for production
-    serve(app, host=host, port=port, threads=4)
+    retention = parse_retention(RETENTION_DAYS)
+    if retention:
+        RetentionWorker(
+            db,
+            retention,
+            interval_seconds=RETENTION_INTERVAL,
+            batch_size=RETENTION_BATCH_SIZE,
+            archive_dir=RETENTION_ARCHIVE_DIR or None
+        ).start()
+        print(f"🧹 Retention: {retention}")
+    
+    if CacheWarmer.enabled():
+        CacheWarmer(service).start()
+        print(f"🔥 Cache warmer: top {WARMER_TOP_N}, {WARMER_BUDGET:g} calls/h")
+    
+    # Use waitress for production (TCP and Unix socket share the loop and threads)
+    servers = create_servers(app, sockets, threads=4, backlog=LISTEN_BACKLOG)
+    try:
+        servers[0].run()
+    finally:
+        if MCP_UNIX_SOCKET and os.path.exists(MCP_UNIX_SOCKET):
+            os.unlink(MCP_UNIX_SOCKET)
 
 
 if __name__ == '__main__':
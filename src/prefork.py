@@ -0,0 +1,337 @@
+"""
+Prefork launcher for the MCP server.
+Binds the listening socket once and runs several waitress worker processes on it,
+recycling workers that outgrow their memory budget and aggregating their metrics.
+"""
+
+import os
+import json
+import time
+import signal
+import socket
+import threading
+import multiprocessing
+from multiprocessing.connection import wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+from database import Database, RetentionWorker, parse_retention
+from utils.listeners import MCP_UNIX_SOCKET, bind_sockets, create_servers
+from utils.metrics import MetricsPublisher, merge_snapshots, summarize, to_snapshot
+
+
+# Worker processes and waitress threads per worker
+PREFORK_WORKERS = int(os.getenv("PREFORK_WORKERS", str(os.cpu_count() or 2)))
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", "4"))
+
+# A worker above this resident size (MB) is replaced; 0 disables recycling.
+# Keep it under PM2's max_memory_restart so workers are drained, not killed.
+WORKER_MAX_RSS_MB = int(os.getenv("WORKER_MAX_RSS_MB", "450"))
+
+# Seconds a recycled worker gets to finish in-flight requests
+WORKER_GRACEFUL_TIMEOUT = float(os.getenv("WORKER_GRACEFUL_TIMEOUT", "30"))
+WORKER_CHECK_INTERVAL = float(os.getenv("WORKER_CHECK_INTERVAL", "5"))
+
+# Aggregated /metrics (parent process) and how often workers publish snapshots
+METRICS_PORT = int(os.getenv("METRICS_PORT", "5001"))
+METRICS_INTERVAL = float(os.getenv("METRICS_INTERVAL", "5"))
+
+LISTEN_BACKLOG = int(os.getenv("LISTEN_BACKLOG", "2048"))
+
+# Retention config (days per table; empty disables the worker)
+RETENTION_DAYS = os.getenv("RETENTION_DAYS", "query_logs=30,latency_histograms=90")
+RETENTION_INTERVAL = int(os.getenv("RETENTION_INTERVAL", "3600"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "500"))
+RETENTION_ARCHIVE_DIR = os.getenv("RETENTION_ARCHIVE_DIR", "")
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def rss_mb(pid: int) -> float:
+    """Resident memory of a process in MB (0 where /proc is unavailable)."""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+# ==================== Worker ====================
+
+def run_worker(sockets: List[socket.socket], parent_pid: int):
+    """
+    Worker process: serve mcp_server.app on the shared sockets.
+    
+    SIGTERM drains the worker: it stops accepting, lets open connections and
+    in-flight requests finish (up to WORKER_GRACEFUL_TIMEOUT), publishes its final metrics and
+    exits. Caches default to the SQLite-backed tier so workers share them.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    os.environ.setdefault("CACHE_PERSIST", "true")
+    
+    import mcp_server
+    from warmer import CacheWarmer
+    
+    servers = create_servers(mcp_server.app, sockets, WORKER_THREADS, backlog=LISTEN_BACKLOG)
+    publisher = MetricsPublisher(
+        mcp_server.metrics,
+        lambda snapshot: mcp_server.db.save_worker_metrics(os.getpid(), snapshot),
+        METRICS_INTERVAL
+    )
+    publisher.start()
+    if CacheWarmer.enabled():
+        # Every worker runs one; the database lease lets a single one warm per pass
+        CacheWarmer(mcp_server.service).start()
+    draining = threading.Event()
+    
+    def finish():
+        deadline = time.monotonic() + WORKER_GRACEFUL_TIMEOUT
+        idle_checks = 0
+        while idle_checks < 2 and time.monotonic() < deadline:
+            tasks = servers[0].task_dispatcher
+            idle = (
+                not any(server.active_channels for server in servers)
+                and not tasks.queue and tasks.active_count == 0
+            )
+            idle_checks = idle_checks + 1 if idle else 0
+            time.sleep(0.25)
+        publisher.stop()
+        publisher.publish_now()
+        os._exit(0)
+    
+    def drain(*_):
+        if draining.is_set():
+            return
+        draining.set()
+        # The listening sockets stay open in the other workers, which take
+        # the new connections
+        for server in servers:
+            server.accepting = False
+        threading.Thread(target=finish, name="drain", daemon=True).start()
+    
+    def watch_parent():
+        while not draining.is_set():
+            if os.getppid() != parent_pid:
+                drain()
+            time.sleep(1)
+    
+    signal.signal(signal.SIGTERM, drain)
+    threading.Thread(target=watch_parent, name="parent-watch", daemon=True).start()
+    servers[0].run()
+
+
+# ==================== Parent ====================
+
+class PreforkServer:
+    """
+    Parent process: owns the sockets, keeps `workers` processes alive and
+    serves aggregated metrics.
+    
+    Args:
+        host: Listening address
+        port: Listening port shared by all workers
+        workers: Number of worker processes
+        db: Database the workers publish their metrics to
+    """
+    
+    def __init__(self, host: str, port: int, workers: int, db: Database):
+        self.host = host
+        self.port = port
+        self.worker_count = workers
+        self.db = db
+        self.sockets: List[socket.socket] = []
+        self.workers: Dict[int, multiprocessing.Process] = {}
+        self.started_at: Dict[int, float] = {}
+        self.recycling: Dict[int, float] = {}   # pid -> kill deadline
+        self.recycled = 0
+        self.crashed = 0
+        self.retired: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        # Spawned, not forked: the retention and metrics threads (and their
+        # SQLite connections and locks) run in this process while workers are
+        # started and restarted, and a fork could copy a lock one of them holds
+        self._context = multiprocessing.get_context('spawn')
+        self._boot_time = time.time()
+    
+    def bind(self):
+        self.sockets = bind_sockets(self.host, self.port, LISTEN_BACKLOG)
+        for sock in self.sockets:
+            sock.set_inheritable(True)
+    
+    def spawn(self) -> int:
+        process = self._context.Process(
+            target=run_worker, args=(self.sockets, os.getpid()), name="mcp-worker", daemon=False
+        )
+        process.start()
+        with self._lock:
+            self.workers[process.pid] = process
+            self.started_at[process.pid] = time.time()
+        return process.pid
+    
+    def recycle(self, pid: int, reason: str):
+        """Start a replacement, then drain the old worker."""
+        print(f"♻️ Worker {pid}: {reason}, reciclando")
+        self.spawn()
+        self.recycling[pid] = time.monotonic() + WORKER_GRACEFUL_TIMEOUT + 5
+        self.recycled += 1
+        os.kill(pid, signal.SIGTERM)
+    
+    def _retire(self, pid: int):
+        """Fold the final metrics of an exited worker into the retired totals."""
+        with self._lock:
+            process = self.workers.pop(pid)
+            self.started_at.pop(pid, None)
+        process.join()
+        snapshot = self.db.pop_worker_metrics(pid)
+        if snapshot:
+            with self._lock:
+                self.retired = to_snapshot(merge_snapshots([self.retired, snapshot]))
+        
+        if self.recycling.pop(pid, None) is None and not self._stopping.is_set():
+            self.crashed += 1
+            print(f"⚠️ Worker {pid} saiu (código {process.exitcode}), reiniciando")
+            time.sleep(min(self.crashed, 5))
+            self.spawn()
+    
+    def check_workers(self):
+        for pid, process in list(self.workers.items()):
+            if not process.is_alive():
+                self._retire(pid)
+        
+        now = time.monotonic()
+        for pid in list(self.workers):
+            deadline = self.recycling.get(pid)
+            if deadline is not None:
+                if now > deadline:
+                    os.kill(pid, signal.SIGKILL)
+                continue
+            
+            rss = rss_mb(pid)
+            if WORKER_MAX_RSS_MB and rss > WORKER_MAX_RSS_MB:
+                self.recycle(pid, f"{rss:.0f} MB > {WORKER_MAX_RSS_MB} MB")
+    
+    def metrics(self) -> Dict[str, Any]:
+        """Metrics of all live workers plus retired ones, and the worker table."""
+        snapshots = self.db.get_worker_metrics()
+        with self._lock:
+            live = {pid: self.started_at.get(pid, 0) for pid in self.workers}
+            merged = merge_snapshots([self.retired] + list(snapshots.values()))
+        
+        report = summarize(merged)
+        report.update({
+            "uptime_seconds": int(time.time() - self._boot_time),
+            "recycled": self.recycled,
+            "crashed": self.crashed,
+            "workers": [
+                {
+                    "pid": pid,
+                    "rss_mb": round(rss_mb(pid), 1),
+                    "uptime_seconds": int(time.time() - started_at),
+                    "draining": pid in self.recycling,
+                    "requests": sum(
+                        value for name, value in snapshots.get(pid, {}).get('counters', {}).items()
+                        if name.startswith('requests:')
+                    )
+                }
+                for pid, started_at in sorted(live.items())
+            ]
+        })
+        return report
+    
+    def serve_metrics(self, port: int):
+        parent = self
+        
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = json.dumps(parent.metrics()).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, *args):
+                pass
+        
+        server = ThreadingHTTPServer((self.host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    
+    def stop(self, *_):
+        self._stopping.set()
+    
+    def run(self):
+        # Snapshots left by a previous run would be counted twice
+        for pid in self.db.get_worker_metrics():
+            self.db.pop_worker_metrics(pid)
+        
+        self.bind()
+        for _ in range(self.worker_count):
+            self.spawn()
+        
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        
+        while not self._stopping.is_set():
+            sentinels: List[int] = [process.sentinel for process in self.workers.values()]
+            wait(sentinels, timeout=WORKER_CHECK_INTERVAL)
+            if not self._stopping.is_set():
+                self.check_workers()
+        
+        self.shutdown()
+    
+    def shutdown(self):
+        print("🛑 Encerrando workers...")
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        
+        deadline = time.monotonic() + WORKER_GRACEFUL_TIMEOUT + 5
+        for pid, process in list(self.workers.items()):
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                process.kill()
+            self._retire(pid)
+        for sock in self.sockets:
+            sock.close()
+        if MCP_UNIX_SOCKET and os.path.exists(MCP_UNIX_SOCKET):
+            os.unlink(MCP_UNIX_SOCKET)
+
+
+def main():
+    """Run the MCP server as a prefork pool."""
+    port = int(os.getenv("MCP_PORT", "5000"))
+    host = os.getenv("MCP_HOST", "127.0.0.1")
+    
+    # Create tables and switch to WAL once, before the workers open the database
+    db = Database(os.getenv("DATABASE_PATH", "data/perplexo.db"))
+    
+    print(f"🚀 Perplexo MCP Server (prefork) starting on {host}:{port}")
+    if MCP_UNIX_SOCKET:
+        print(f"🔌 Unix socket: {MCP_UNIX_SOCKET}")
+    print(f"👷 Workers: {PREFORK_WORKERS} x {WORKER_THREADS} threads, recycle at {WORKER_MAX_RSS_MB} MB")
+    print(f"📈 Metrics: http://{host}:{METRICS_PORT}/metrics")
+    
+    retention = parse_retention(RETENTION_DAYS)
+    if retention:
+        RetentionWorker(
+            db,
+            retention,
+            interval_seconds=RETENTION_INTERVAL,
+            batch_size=RETENTION_BATCH_SIZE,
+            archive_dir=RETENTION_ARCHIVE_DIR or None
+        ).start()
+        print(f"🧹 Retention: {retention}")
+    
+    server = PreforkServer(host, port, PREFORK_WORKERS, db)
+    server.serve_metrics(METRICS_PORT)
+    server.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+Platform renderers for Perplexo answers.
+Turn a search result into ready-to-send message chunks for each chat platform.
+"""
+
+import re
+from typing import Any, Callable, Dict, List, Tuple
+
+
+# Characters per message (both platforms accept a bit more; keep headroom)
+CHUNK_LIMIT = 4000
+
+# Room kept in every chunk for the markers that close/reopen entities
+MARKER_RESERVE = 16
+
+# Spans a chunk must not be cut inside: code blocks and [text](url) links
+_PROTECTED = re.compile(r'```[\s\S]*?```|\[[^\]\n]*\]\([^)\s]*\)')
+
+# Entity delimiters per platform; code delimiters disable the others inside them
+_DELIMITERS = {
+    'telegram': ('```', '`', '*', '_'),
+    'whatsapp': ('```', '`', '*', '_', '~'),
+}
+_CODE = ('```', '`')
+
+
+def _open_entities(text: str, delimiters: Tuple[str, ...]) -> List[str]:
+    """Delimiters still open at the end of `text`, in opening order."""
+    # Whole links and code blocks are skipped: `_` and `*` in a URL are not markup
+    spans = {m.start(): m.end() for m in _PROTECTED.finditer(text)}
+    stack: List[str] = []
+    i = 0
+    while i < len(text):
+        if i in spans and not (stack and stack[-1] in _CODE):
+            i = spans[i]
+            continue
+        if text[i] == '\\' and not (stack and stack[-1] in _CODE):
+            i += 2
+            continue
+        
+        for delimiter in delimiters:
+            if not text.startswith(delimiter, i):
+                continue
+            if stack and stack[-1] in _CODE and stack[-1] != delimiter:
+                break
+            if delimiter in stack:
+                # Closing: anything opened after it is closed implicitly
+                del stack[stack.index(delimiter):]
+            else:
+                stack.append(delimiter)
+            i += len(delimiter) - 1
+            break
+        i += 1
+    return stack
+
+
+def _cut_position(text: str, budget: int) -> int:
+    """Best place to end a chunk of at most `budget` characters."""
+    spans = [m.span() for m in _PROTECTED.finditer(text, 0, budget + 4096)]
+    
+    def inside_span(pos: int) -> bool:
+        return any(start < pos < end for start, end in spans)
+    
+    for separator, minimum in (('\n\n', budget // 2), ('\n', budget // 2), (' ', 1)):
+        pos = text.rfind(separator, 0, budget)
+        while pos >= minimum:
+            if not inside_span(pos):
+                return pos
+            pos = text.rfind(separator, 0, pos)
+    
+    # No separator: hard cut, moved before a span that would be split
+    for start, end in spans:
+        if start < budget < end and start > 0:
+            return start
+    return budget
+
+
+def split_chunks(text: str, platform: str = 'telegram', limit: int = CHUNK_LIMIT) -> List[str]:
+    """
+    Split `text` into chunks of at most `limit` characters.
+    
+    Chunks end at paragraph, line or word boundaries, never inside a link or
+    (when it fits) a code block. Formatting left open at a cut is closed at
+    the end of the chunk and reopened at the start of the next one, so every
+    chunk parses on its own.
+    """
+    delimiters = _DELIMITERS.get(platform, _DELIMITERS['telegram'])
+    if len(text) <= limit:
+        return [text]
+    
+    chunks: List[str] = []
+    prefix = ''
+    rest = text
+    while rest:
+        budget = limit - len(prefix) - MARKER_RESERVE
+        if len(rest) <= budget:
+            chunks.append(prefix + rest)
+            break
+        
+        pos = _cut_position(rest, budget)
+        body = prefix + rest[:pos].rstrip()
+        rest = rest[pos:].lstrip()
+        
+        still_open = _open_entities(body, delimiters)
+        closing = ''.join(
+            ('\n' + marker) if marker == '```' else marker for marker in reversed(still_open)
+        )
+        chunks.append(body + closing)
+        prefix = ''.join((marker + '\n') if marker == '```' else marker for marker in still_open)
+    
+    return chunks
+
+
+# ==================== Platform renderers ====================
+
+def _telegram_text(result: Dict[str, Any]) -> str:
+    answer = result.get('text', result.get('answer', ''))
+    
+    citations = result.get('citations') or []
+    if citations:
+        answer += "\n\n📚 **Fontes:**\n"
+        for i, cite in enumerate(citations[:5], 1):
+            answer += f"{i}. [{cite.get('title', 'Link')}]({cite.get('url', '')})\n"
+    
+    answer += f"\n_🤖 {result.get('model_used', '')} | 🔍 {result.get('focus_mode', '')}_"
+    return answer
+
+
+def _whatsapp_text(result: Dict[str, Any]) -> str:
+    answer = result.get('text', result.get('answer', ''))
+    
+    citations = result.get('citations') or []
+    if citations:
+        answer += "\n\n📚 *Fontes:*\n"
+        for i, cite in enumerate(citations[:5], 1):
+            answer += f"{i}. {cite.get('title', 'Link')}\n"
+            if cite.get('url'):
+                answer += f"   {cite['url']}\n"
+    
+    answer += f"\n_🤖 {result.get('model_used', '')} | 🔍 {result.get('focus_mode', '')}_"
+    return answer
+
+
+RENDERERS: Dict[str, Callable[[Dict[str, Any]], str]] = {
+    'telegram': _telegram_text,
+    'whatsapp': _whatsapp_text,
+}
+
+
+def render_answer(result: Dict[str, Any], platform: str) -> List[str]:
+    """Format a search result (answer, citations, badge) as message chunks."""
+    if platform not in RENDERERS:
+        raise ValueError(f"Invalid render platform: {platform}")
+    return split_chunks(RENDERERS[platform](result), platform)
+
+
+def render_document(summary: str, file_name: str, platform: str) -> List[str]:
+    """Format a document summary as message chunks."""
+    bold = '**' if platform == 'telegram' else '*'
+    return split_chunks(f"📄 {bold}Resumo de {file_name}:{bold}\n\n{summary}", platform)
+
+
+def render_vision(text: str, platform: str) -> List[str]:
+    """Format an image analysis as message chunks."""
+    return split_chunks(text or "Não foi possível analisar a imagem.", platform)
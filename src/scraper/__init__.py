@@ -1,4 +1,8 @@
 from .base import PerplexityScraperBase, PerplexityModel, FocusMode
 from .standalone import PerplexoScraper
+from .async_client import AsyncPerplexoScraper
 
-__all__ = ['PerplexityScraperBase', 'PerplexoScraper', 'PerplexityModel', 'FocusMode']
\ No newline at end of file
+__all__ = [
+    'PerplexityScraperBase', 'PerplexoScraper', 'AsyncPerplexoScraper',
+    'PerplexityModel', 'FocusMode'
+]
@@ -0,0 +1,186 @@
+"""
+Async Perplexity scraper.
+Same requests and response format as PerplexoScraper, on an httpx.AsyncClient,
+so one event loop can keep many upstream calls in flight.
+"""
+
+import os
+import time
+import uuid
+import asyncio
+from typing import Dict, Any, Optional
+
+import httpx
+
+from .base import PerplexityScraperBase
+from .standalone import (
+    ASK_TIMEOUT, ASK_URL, PERPLEXITY_URL, SOCKET_URL, UPLOAD_URL,
+    extract_sid, parse_image_response, parse_response, session_headers, simulated_response,
+    timeout_response
+)
+
+
+# Upstream connections kept by one process (requests beyond this wait for a free one)
+ASYNC_MAX_CONNECTIONS = int(os.getenv("ASYNC_MAX_CONNECTIONS", "200"))
+
+
+class AsyncPerplexoScraper(PerplexityScraperBase):
+    """
+    Async counterpart of PerplexoScraper.
+    
+    Image uploads are split from the question (upload_image() then
+    ask_with_image_url()) so callers can keep the upload cache themselves.
+    
+    Args:
+        session_token: Perplexity session cookie
+        api_key: Perplexity API key (unused by the web endpoints)
+        max_connections: Size of the upstream connection pool
+    """
+    
+    def __init__(self, session_token: Optional[str] = None, api_key: Optional[str] = None,
+                 max_connections: int = ASYNC_MAX_CONNECTIONS):
+        super().__init__(session_token, api_key)
+        self.client = httpx.AsyncClient(
+            headers=session_headers(session_token),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections
+            ),
+            timeout=httpx.Timeout(60.0, connect=10.0)
+        )
+        self._ws_sid: Optional[str] = None
+        self._sid_lock = asyncio.Lock()
+    
+    async def _get_ws_sid(self) -> str:
+        """Get WebSocket session ID (fetched once, shared by concurrent calls)."""
+        if self._ws_sid:
+            return self._ws_sid
+        
+        async with self._sid_lock:
+            if self._ws_sid:
+                return self._ws_sid
+            try:
+                response = await self.client.get(SOCKET_URL)
+                sid = extract_sid(response.text)
+                if not sid:
+                    raise Exception("Could not extract SID from response")
+                self._ws_sid = sid
+            except Exception as e:
+                print(f"Error getting WS SID: {e}")
+                # Generate a fallback SID
+                self._ws_sid = str(uuid.uuid4())
+            return self._ws_sid
+    
+    async def ask(self,
+                  query: str,
+                  model: str = "sonar",
+                  focus: str = "web",
+                  enable_reasoning: bool = False,
+                  timeout: float = ASK_TIMEOUT,
+                  **kwargs) -> Dict[str, Any]:
+        """Send a query to Perplexity (see PerplexoScraper.ask)."""
+        try:
+            payload = {
+                "query": query,
+                "model": model,
+                "focus": focus,
+                "reasoning": enable_reasoning,
+                "session_id": await self._get_ws_sid(),
+                "timestamp": int(time.time() * 1000)
+            }
+            
+            try:
+                response = await self.client.post(ASK_URL, json=payload, timeout=timeout)
+                if response.status_code == 200:
+                    return parse_response(response.json(), model, focus)
+            except httpx.TimeoutException:
+                return timeout_response(model, focus, timeout)
+            except httpx.HTTPError as e:
+                print(f"API request failed: {e}")
+            
+            return simulated_response(query, model, focus, enable_reasoning)
+        
+        except Exception as e:
+            return {
+                "text": f"❌ Erro ao processar: {str(e)}",
+                "citations": [],
+                "images": [],
+                "model_used": model,
+                "focus_mode": focus,
+                "error": str(e)
+            }
+    
+    async def upload_image(self, image: bytes, file_name: str = "image.jpg") -> Optional[str]:
+        """Upload image bytes; returns the uploaded URL, or None on failure."""
+        try:
+            response = await self.client.post(
+                UPLOAD_URL, files={'file': (file_name, image)}, timeout=30
+            )
+            if response.status_code != 200:
+                return None
+            return response.json().get("url") or None
+        except Exception as e:
+            print(f"Image upload failed: {e}")
+            return None
+    
+    async def ask_with_image(self,
+                             query: str,
+                             image: bytes,
+                             model: str = "sonar-pro",
+                             **kwargs) -> Dict[str, Any]:
+        """Upload `image` and ask about it (no upload cache; see upload_image())."""
+        image_url = await self.upload_image(image)
+        if not image_url:
+            return {
+                "text": "❌ Falha ao fazer upload da imagem",
+                "model_used": model,
+                "error": "Upload failed"
+            }
+        return await self.ask_with_image_url(query, image_url, model)
+    
+    async def ask_with_image_url(self,
+                                 query: str,
+                                 image_url: str,
+                                 model: str = "sonar-pro",
+                                 timeout: float = ASK_TIMEOUT) -> Dict[str, Any]:
+        """Ask about an image that was already uploaded."""
+        try:
+            payload = {
+                "query": query,
+                "model": model,
+                "focus": "web",
+                "image_url": image_url,
+                "session_id": await self._get_ws_sid(),
+                "timestamp": int(time.time() * 1000)
+            }
+            
+            response = await self.client.post(ASK_URL, json=payload, timeout=timeout)
+            if response.status_code == 200:
+                return parse_image_response(response.json(), model)
+            return {
+                "text": "❌ Erro ao analisar imagem",
+                "model_used": model,
+                "error": f"HTTP {response.status_code}"
+            }
+        
+        except httpx.TimeoutException:
+            return timeout_response(model, "vision", timeout)
+        except Exception as e:
+            return {
+                "text": f"❌ Erro: {str(e)}",
+                "model_used": model,
+                "error": str(e)
+            }
+    
+    async def is_available(self) -> bool:
+        """Check if the scraper is properly configured and available."""
+        if not self.session_token:
+            return False
+        try:
+            response = await self.client.get(f"{PERPLEXITY_URL}/", timeout=10, follow_redirects=True)
+            return response.status_code == 200
+        except Exception:
+            return False
+    
+    async def aclose(self):
+        await self.client.aclose()
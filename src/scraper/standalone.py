@@ -3,13 +3,134 @@ Standalone Perplexity scraper implementation.
 Uses web scraping to interact with Perplexity AI.
 """
 
+import os
 import re
 import json
 import time
 import uuid
+import hashlib
 from typing import Dict, Any, Optional, List
 import requests
 from .base import PerplexityScraperBase
+from utils.cache import TTLCache
+
+
+# How long an uploaded image URL is reused for the same image content
+UPLOAD_CACHE_TTL = float(os.getenv("UPLOAD_CACHE_TTL", "3600"))
+
+# Default upstream timeouts (seconds); the service passes each model's
+# adaptive timeout (utils/timeouts.py), capped by the request deadline
+ASK_TIMEOUT = 60.0
+UPLOAD_TIMEOUT = 30.0
+
+PERPLEXITY_URL = "https://www.perplexity.ai"
+ASK_URL = f"{PERPLEXITY_URL}/rest/ratelimit/search/ask"
+UPLOAD_URL = f"{PERPLEXITY_URL}/rest/ratelimit/upload"
+SOCKET_URL = f"{PERPLEXITY_URL}/socket.io/?EIO=4&transport=polling"
+
+BROWSER_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+    ),
+    "Accept": "*/*",
+    "Accept-Language": "en-US,en;q=0.9",
+    "Accept-Encoding": "gzip, deflate, br",
+    "Referer": "https://www.perplexity.ai/",
+    "Origin": "https://www.perplexity.ai",
+    "Sec-Ch-Ua": '"Not_A Brand";v="8", "Chromium";v="120"',
+    "Sec-Ch-Ua-Mobile": "?0",
+    "Sec-Ch-Ua-Platform": '"Windows"',
+    "Sec-Fetch-Dest": "empty",
+    "Sec-Fetch-Mode": "cors",
+    "Sec-Fetch-Site": "same-origin",
+}
+
+
+def session_headers(session_token: Optional[str]) -> Dict[str, str]:
+    """Browser-like headers, plus the session cookie when a token is set."""
+    headers = dict(BROWSER_HEADERS)
+    if session_token:
+        headers["Cookie"] = f"__Secure-next-auth.session-token={session_token}"
+    return headers
+
+
+def extract_sid(body: str) -> Optional[str]:
+    # Format: <length>{"sid":"...","upgrades":["websocket"],"pingInterval":...,"pingTimeout":...}
+    match = re.search(r'"sid":"([^"]+)"', body)
+    return match.group(1) if match else None
+
+
+def simulated_response(query: str, model: str, focus: str,
+                       enable_reasoning: bool) -> Dict[str, Any]:
+    """Answer returned when the upstream API can't be reached."""
+    return {
+        "text": (
+            f"⚠️ **Modo Simulação**\n\n"
+            f"Sua pergunta: *{query}*\n\n"
+            f"Para respostas reais do Perplexity, configure um session_token válido "
+            f"no arquivo .env (obtenha em perplexity.ai → DevTools → Application → Cookies).\n\n"
+            f"**Configurações usadas:**\n"
+            f"• Modelo: `{model}`\n"
+            f"• Focus: `{focus}`\n"
+            f"• Reasoning: `{'Sim' if enable_reasoning else 'Não'}`"
+        ),
+        "citations": [],
+        "images": [],
+        "model_used": model,
+        "focus_mode": focus,
+        "simulated": True
+    }
+
+
+def timeout_response(model: str, focus: str, timeout: float) -> Dict[str, Any]:
+    """Answer returned when Perplexity did not respond within `timeout` seconds."""
+    return {
+        "text": f"⏱️ O modelo `{model}` não respondeu em {timeout:.0f}s. Tente novamente.",
+        "citations": [],
+        "images": [],
+        "model_used": model,
+        "focus_mode": focus,
+        "error": f"Upstream timeout after {timeout:.1f}s"
+    }
+
+
+def parse_response(data: Dict[str, Any], model: str, focus: str) -> Dict[str, Any]:
+    """Parse the API response into a standardized format."""
+    # Extract text
+    text = data.get("text", "")
+    if not text and "answer" in data:
+        text = data["answer"]
+    
+    # Extract citations
+    citations = []
+    if "citations" in data:
+        citations = data["citations"]
+    elif "sources" in data:
+        citations = [
+            {"title": s.get("title", "Source"), "url": s.get("url", "")}
+            for s in data["sources"]
+        ]
+    
+    # Extract images
+    images = data.get("images", [])
+    
+    return {
+        "text": text,
+        "citations": citations,
+        "images": images,
+        "model_used": model,
+        "focus_mode": focus,
+        "simulated": False
+    }
+
+
+def parse_image_response(data: Dict[str, Any], model: str) -> Dict[str, Any]:
+    return {
+        "text": data.get("text", data.get("answer", "")),
+        "model_used": model,
+        "image_analyzed": True
+    }
 
 
 class PerplexoScraper(PerplexityScraperBase):
@@ -24,31 +145,12 @@ class PerplexoScraper(PerplexityScraperBase):
         self._setup_headers()
         self._ws_sid: Optional[str] = None
         self._last_answer: Optional[Dict[str, Any]] = None
+        # Image content hash -> uploaded URL (replaceable by a persistent cache)
+        self.upload_cache = TTLCache(maxsize=1024, ttl=UPLOAD_CACHE_TTL)
     
     def _setup_headers(self):
         """Setup HTTP headers for requests."""
-        self.session.headers.update({
-            "User-Agent": (
-                "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-                "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-            ),
-            "Accept": "*/*",
-            "Accept-Language": "en-US,en;q=0.9",
-            "Accept-Encoding": "gzip, deflate, br",
-            "Referer": "https://www.perplexity.ai/",
-            "Origin": "https://www.perplexity.ai",
-            "Sec-Ch-Ua": '"Not_A Brand";v="8", "Chromium";v="120"',
-            "Sec-Ch-Ua-Mobile": "?0",
-            "Sec-Ch-Ua-Platform": '"Windows"',
-            "Sec-Fetch-Dest": "empty",
-            "Sec-Fetch-Mode": "cors",
-            "Sec-Fetch-Site": "same-origin",
-        })
-        
-        if self.session_token:
-            self.session.headers.update({
-                "Cookie": f"__Secure-next-auth.session-token={self.session_token}"
-            })
+        self.session.headers.update(session_headers(self.session_token))
     
     def _get_ws_sid(self) -> str:
         """Get WebSocket session ID."""
@@ -56,15 +158,12 @@ class PerplexoScraper(PerplexityScraperBase):
             return self._ws_sid
         
         try:
-            response = self.session.get(
-                "https://www.perplexity.ai/socket.io/?EIO=4&transport=polling"
-            )
+            response = self.session.get(SOCKET_URL)
             
             # Parse the response to get SID
-            # Format: <length>{"sid":"...","upgrades":["websocket"],"pingInterval":...,"pingTimeout":...}
-            match = re.search(r'"sid":"([^"]+)"', response.text)
-            if match:
-                self._ws_sid = match.group(1)
+            sid = extract_sid(response.text)
+            if sid:
+                self._ws_sid = sid
                 return self._ws_sid
             else:
                 raise Exception("Could not extract SID from response")
@@ -80,6 +179,7 @@ class PerplexoScraper(PerplexityScraperBase):
             model: str = "sonar",
             focus: str = "web",
             enable_reasoning: bool = False,
+            timeout: float = ASK_TIMEOUT,
             **kwargs) -> Dict[str, Any]:
         """
         Send a query to Perplexity and get response.
@@ -89,6 +189,7 @@ class PerplexoScraper(PerplexityScraperBase):
             model: Model to use (sonar, sonar-pro, gpt-5.2, etc.)
             focus: Focus mode (web, academic, writing, etc.)
             enable_reasoning: Enable step-by-step reasoning
+            timeout: Seconds to wait for Perplexity (connect and per read)
             
         Returns:
             Dict with keys: 'text', 'citations', 'images', 'model_used', 'focus_mode'
@@ -113,37 +214,19 @@ class PerplexoScraper(PerplexityScraperBase):
             # Try to use the internal API endpoint
             # Note: This is a reverse-engineered approach and may break
             try:
-                response = self.session.post(
-                    "https://www.perplexity.ai/rest/ratelimit/search/ask",
-                    json=payload,
-                    timeout=60
-                )
+                response = self.session.post(ASK_URL, json=payload, timeout=timeout)
                 
                 if response.status_code == 200:
                     data = response.json()
                     return self._parse_response(data, model, focus)
-                    
+            
+            except requests.Timeout:
+                return timeout_response(model, focus, timeout)
             except requests.RequestException as e:
                 print(f"API request failed: {e}")
             
             # Fallback: Return a structured response indicating the limitation
-            return {
-                "text": (
-                    f"⚠️ **Modo Simulação**\n\n"
-                    f"Sua pergunta: *{query}*\n\n"
-                    f"Para respostas reais do Perplexity, configure um session_token válido "
-                    f"no arquivo .env (obtenha em perplexity.ai → DevTools → Application → Cookies).\n\n"
-                    f"**Configurações usadas:**\n"
-                    f"• Modelo: `{model}`\n"
-                    f"• Focus: `{focus}`\n"
-                    f"• Reasoning: `{'Sim' if enable_reasoning else 'Não'}`"
-                ),
-                "citations": [],
-                "images": [],
-                "model_used": model,
-                "focus_mode": focus,
-                "simulated": True
-            }
+            return simulated_response(query, model, focus, enable_reasoning)
             
         except Exception as e:
             return {
@@ -157,57 +240,42 @@ class PerplexoScraper(PerplexityScraperBase):
     
     def _parse_response(self, data: Dict[str, Any], model: str, focus: str) -> Dict[str, Any]:
         """Parse the API response into a standardized format."""
-        # Extract text
-        text = data.get("text", "")
-        if not text and "answer" in data:
-            text = data["answer"]
-        
-        # Extract citations
-        citations = []
-        if "citations" in data:
-            citations = data["citations"]
-        elif "sources" in data:
-            citations = [
-                {"title": s.get("title", "Source"), "url": s.get("url", "")}
-                for s in data["sources"]
-            ]
-        
-        # Extract images
-        images = data.get("images", [])
-        
-        return {
-            "text": text,
-            "citations": citations,
-            "images": images,
-            "model_used": model,
-            "focus_mode": focus,
-            "simulated": False
-        }
+        return parse_response(data, model, focus)
     
     def ask_with_image(self,
                        query: str,
                        image_path: str,
                        model: str = "sonar-pro",
+                       image_hash: Optional[str] = None,
+                       timeout: float = ASK_TIMEOUT,
                        **kwargs) -> Dict[str, Any]:
         """
         Send a query with an image to Perplexity.
         
+        The image is uploaded once per content hash; later calls with the
+        same image reuse the uploaded URL from upload_cache.
+        
         Args:
             query: The question about the image
             image_path: Path to the image file
             model: Model to use (usually sonar-pro for vision)
+            image_hash: Content hash of the image, if already known
+            timeout: Seconds to wait for the upload and for the answer
             
         Returns:
             Dict with keys: 'text', 'model_used'
         """
         try:
-            # Upload image first
             with open(image_path, 'rb') as f:
-                files = {'file': f}
+                image = f.read()
+            image_hash = image_hash or hashlib.blake2b(image, digest_size=16).hexdigest()
+            
+            image_url = self.upload_cache.get(image_hash)
+            if not image_url:
                 upload_response = self.session.post(
-                    "https://www.perplexity.ai/rest/ratelimit/upload",
-                    files=files,
-                    timeout=30
+                    UPLOAD_URL,
+                    files={'file': (os.path.basename(image_path), image)},
+                    timeout=min(UPLOAD_TIMEOUT, timeout)
                 )
                 
                 if upload_response.status_code != 200:
@@ -219,8 +287,31 @@ class PerplexoScraper(PerplexityScraperBase):
                 
                 upload_data = upload_response.json()
                 image_url = upload_data.get("url", "")
+                if image_url:
+                    self.upload_cache.set(image_hash, image_url)
             
-            # Now ask with the image URL
+            return self.ask_with_image_url(query, image_url, model, timeout=timeout)
+        
+        except FileNotFoundError:
+            return {
+                "text": "❌ Arquivo de imagem não encontrado",
+                "model_used": model,
+                "error": "File not found"
+            }
+        except Exception as e:
+            return {
+                "text": f"❌ Erro: {str(e)}",
+                "model_used": model,
+                "error": str(e)
+            }
+    
+    def ask_with_image_url(self,
+                           query: str,
+                           image_url: str,
+                           model: str = "sonar-pro",
+                           timeout: float = ASK_TIMEOUT) -> Dict[str, Any]:
+        """Ask about an image that was already uploaded."""
+        try:
             payload = {
                 "query": query,
                 "model": model,
@@ -230,32 +321,19 @@ class PerplexoScraper(PerplexityScraperBase):
                 "timestamp": int(time.time() * 1000)
             }
             
-            response = self.session.post(
-                "https://www.perplexity.ai/rest/ratelimit/search/ask",
-                json=payload,
-                timeout=60
-            )
+            response = self.session.post(ASK_URL, json=payload, timeout=timeout)
             
             if response.status_code == 200:
-                data = response.json()
-                return {
-                    "text": data.get("text", data.get("answer", "")),
-                    "model_used": model,
-                    "image_analyzed": True
-                }
+                return parse_image_response(response.json(), model)
             else:
                 return {
                     "text": "❌ Erro ao analisar imagem",
                     "model_used": model,
                     "error": f"HTTP {response.status_code}"
                 }
-                
-        except FileNotFoundError:
-            return {
-                "text": "❌ Arquivo de imagem não encontrado",
-                "model_used": model,
-                "error": "File not found"
-            }
+        
+        except requests.Timeout:
+            return timeout_response(model, "vision", timeout)
         except Exception as e:
             return {
                 "text": f"❌ Erro: {str(e)}",
@@ -271,7 +349,7 @@ class PerplexoScraper(PerplexityScraperBase):
             
             # Try to make a simple request
             response = self.session.get(
-                "https://www.perplexity.ai/",
+                f"{PERPLEXITY_URL}/",
                 timeout=10,
                 allow_redirects=True
             )
@@ -0,0 +1,1069 @@
+"""
+Perplexo service layer.
+Business logic shared by the MCP server routes and the embedded Telegram bot.
+"""
+
+import os
+import asyncio
+import logging
+import binascii
+import hashlib
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Any, BinaryIO, Iterator, List, Optional, Tuple
+
+from scraper import AsyncPerplexoScraper, PerplexoScraper
+from database import Database, PersistentCache
+from utils.cache import TTLCache
+from utils.deadline import Deadline, DeadlineExceeded
+from utils.metrics import MetricsRegistry
+from utils.similarity import SimilarityIndex, parse_thresholds
+from utils.timeouts import AdaptiveTimeouts
+from utils.images import image_target, prepare_image
+from utils.chunking import estimate_tokens, iter_chunks, iter_text_lines
+from renderers import RENDERERS, render_answer, render_document, render_vision
+
+logger = logging.getLogger(__name__)
+
+
+# Rate limiting config
+RATE_LIMIT_MESSAGES = int(os.getenv("RATE_LIMIT_MESSAGES", "20"))
+RATE_LIMIT_WINDOW = int(os.getenv("RATE_LIMIT_WINDOW", "3600"))
+
+# Also index answers (not only questions) for history search
+HISTORY_INDEX_ANSWERS = os.getenv("HISTORY_INDEX_ANSWERS", "false").lower() == "true"
+
+# Search answers reused for identical queries (0 disables), with their rendered chunks
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "600"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+
+# Focus modes whose cached answers may also serve paraphrased questions, with
+# the similarity (0..1) a paraphrase needs; modes left out only match exactly
+SIMILAR_QUERY_THRESHOLDS = parse_thresholds(
+    os.getenv("SIMILAR_QUERY_THRESHOLDS", "web=0.9,academic=0.85,writing=0.85")
+)
+
+# Vision caches: analysis results per (image, query, model) and client image ids
+VISION_CACHE_TTL = float(os.getenv("VISION_CACHE_TTL", "86400"))
+VISION_CACHE_SIZE = int(os.getenv("VISION_CACHE_SIZE", "2048"))
+
+# Document summaries: chunk budget, parallel upstream calls, upload cap and
+# how long chunk summaries are reused for re-uploads
+DOC_CHUNK_TOKENS = int(os.getenv("DOC_CHUNK_TOKENS", "1500"))
+DOC_MAX_PARALLEL = int(os.getenv("DOC_MAX_PARALLEL", "3"))
+DOC_MAX_BYTES = int(os.getenv("DOC_MAX_BYTES", "2000000"))
+DOC_CACHE_TTL = float(os.getenv("DOC_CACHE_TTL", "604800"))
+
+DOC_CHUNK_PROMPT = (
+    "Resuma o seguinte trecho de um documento maior, mantendo fatos, "
+    "nomes e números importantes:\n\n"
+)
+DOC_REDUCE_PROMPT = (
+    "Os textos abaixo são resumos parciais, em ordem, de um mesmo documento. "
+    "Combine-os em um único resumo coeso, sem repetições:\n\n"
+)
+DOC_MAX_REDUCE_ROUNDS = 3
+
+# Keep caches in SQLite too (survive restarts, shared with other processes)
+CACHE_PERSIST = os.getenv("CACHE_PERSIST", "false").lower() == "true"
+
+# Threads running scraper calls, so a request can stop waiting on one
+UPSTREAM_WORKERS = int(os.getenv("UPSTREAM_WORKERS", "32"))
+
+
+def normalize_query(query: str) -> str:
+    """Cache key form of a query: lowercase, single spaces, no trailing punctuation."""
+    return ' '.join(query.lower().split()).rstrip('?!. ')
+
+
+def answer_key(query: str, model: str, focus: str, enable_reasoning: bool = False) -> str:
+    """Answer cache key of a search."""
+    return f"{model}:{focus}:{int(enable_reasoning)}:{normalize_query(query)}"
+
+
+class ServiceError(Exception):
+    """Request failure carrying the HTTP status and JSON body to return."""
+    
+    def __init__(self, status: int, payload: Dict[str, Any]):
+        super().__init__(payload.get('error', f"HTTP {status}"))
+        self.status = status
+        self.payload = payload
+
+
+def decode_base64(value: str, error_text: str) -> bytes:
+    """Decode a base64 upload, raising a 400 ServiceError when it is malformed."""
+    try:
+        # a2b_base64 reads an ASCII str in place; b64decode would first copy it to bytes
+        return binascii.a2b_base64(value)
+    except ValueError as e:
+        raise ServiceError(400, {"error": f"Invalid base64: {e}", "text": error_text})
+
+
+def deadline_error(error: DeadlineExceeded) -> ServiceError:
+    # 499: the client closed the connection (nobody reads the body)
+    return ServiceError(504 if error.reason == "deadline" else 499, {
+        "error": "deadline_exceeded" if error.reason == "deadline" else "client_disconnected",
+        "stage": error.stage,
+        "text": "⏱️ Tempo esgotado. Tente novamente."
+    })
+
+
+def search_error(error: Exception) -> ServiceError:
+    return ServiceError(500, {
+        "error": str(error),
+        "text": "❌ Erro interno no servidor",
+        "citations": [],
+        "images": []
+    })
+
+
+def vision_error(error: Exception) -> ServiceError:
+    return ServiceError(500, {"error": str(error), "text": "❌ Erro ao processar imagem"})
+
+
+def transcribe_error(error: Exception) -> ServiceError:
+    return ServiceError(500, {"error": str(error), "text": "❌ Erro ao transcrever áudio"})
+
+
+def whisper_api_key() -> str:
+    """OPENAI_API_KEY, or a 503 ServiceError when transcription is not configured."""
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ServiceError(503, {
+            "error": "OpenAI API key not configured",
+            "text": "⚠️ Transcrição de áudio não disponível. Configure OPENAI_API_KEY."
+        })
+    return api_key
+
+
+def transcript_result(text: str, language: str) -> Dict[str, Any]:
+    return {
+        "text": text,
+        "language": language,
+        "timestamp": datetime.now().isoformat()
+    }
+
+
+class _UpstreamCall:
+    __slots__ = ('future', 'started', 'abandoned')
+    
+    def __init__(self, future: Future):
+        self.future = future
+        self.started = time.monotonic()
+        self.abandoned = False
+
+
+class PerplexoService:
+    """
+    Search, vision, transcription and user config operations.
+    
+    Methods take already-decoded input, return JSON-friendly dicts and raise
+    ServiceError with the response status and body on failure, so the HTTP
+    routes and the in-process bot client behave the same way.
+    
+    Args:
+        db: Database instance
+        scraper: Perplexity scraper
+        rate_limit_messages: Requests allowed per window and user
+        rate_limit_window: Rate limit window in seconds
+        index_answers: Store answers in the history search index
+        persist_cache: Back every cache with SQLite, shared by all processes on the
+            database: answers (with rendered chunks), vision results, image
+            ids, uploads and document chunk summaries
+        metrics: Registry counting requests abandoned by their clients (optional)
+    """
+    
+    def __init__(self, db: Database, scraper: PerplexoScraper,
+                 rate_limit_messages: int = RATE_LIMIT_MESSAGES,
+                 rate_limit_window: int = RATE_LIMIT_WINDOW,
+                 index_answers: bool = HISTORY_INDEX_ANSWERS,
+                 persist_cache: bool = CACHE_PERSIST,
+                 metrics: Optional[MetricsRegistry] = None):
+        self.db = db
+        self.scraper = scraper
+        self.rate_limit_messages = rate_limit_messages
+        self.rate_limit_window = rate_limit_window
+        self.index_answers = index_answers
+        self.persist_cache = persist_cache
+        self.metrics = metrics
+        
+        self.upstream = ThreadPoolExecutor(UPSTREAM_WORKERS, thread_name_prefix="upstream")
+        self.timeouts = AdaptiveTimeouts()
+        self._inflight: Dict[str, _UpstreamCall] = {}
+        self._inflight_lock = threading.Lock()
+        
+        self.answer_cache = self.make_cache('answers', ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL)
+        self.similar_answers = (
+            SimilarityIndex(maxsize=ANSWER_CACHE_SIZE)
+            if ANSWER_CACHE_TTL > 0 and SIMILAR_QUERY_THRESHOLDS else None
+        )
+        self.vision_cache = self.make_cache('vision', VISION_CACHE_SIZE, VISION_CACHE_TTL)
+        self.image_ids = self.make_cache('image_ids', VISION_CACHE_SIZE * 4, VISION_CACHE_TTL)
+        self.chunk_summaries = self.make_cache('doc_chunks', 4096, DOC_CACHE_TTL)
+        if persist_cache and hasattr(scraper, 'upload_cache'):
+            scraper.upload_cache = self.make_cache(
+                'uploads', scraper.upload_cache.maxsize, scraper.upload_cache.ttl
+            )
+    
+    def make_cache(self, namespace: str, maxsize: int, ttl: float):
+        """In-memory TTLCache, or a SQLite-backed one when persist_cache is set."""
+        if self.persist_cache:
+            return PersistentCache(self.db, namespace, maxsize=maxsize, ttl=ttl)
+        return TTLCache(maxsize=maxsize, ttl=ttl)
+    
+    @classmethod
+    def from_env(cls, **kwargs) -> 'PerplexoService':
+        """Build the service from DATABASE_PATH and the PERPLEXITY_* variables."""
+        return cls(
+            Database(os.getenv("DATABASE_PATH", "data/perplexo.db")),
+            PerplexoScraper(
+                session_token=os.getenv("PERPLEXITY_SESSION_TOKEN"),
+                api_key=os.getenv("PERPLEXITY_API_KEY")
+            ),
+            **kwargs
+        )
+    
+    def count(self, name: str, value: int = 1):
+        if self.metrics is not None:
+            self.metrics.inc(name, value)
+    
+    # ==================== Deadlines ====================
+    
+    def upstream_call(self, key: str, deadline: Deadline, func: Callable[..., Dict[str, Any]],
+                      keep: Callable[[Dict[str, Any]], None], latency_key: Tuple[str, str],
+                      **kwargs) -> Dict[str, Any]:
+        """
+        Run a scraper call on the upstream pool and wait for it only as long
+        as the client does.
+        
+        The call gets the adaptive timeout of its `latency_key` (endpoint,
+        model), capped by the remaining budget, and its duration feeds that
+        timeout back when it succeeds. Calls with the same
+        `key` (same cache key) share one in-flight call, so a resend attaches
+        to the request it repeats. When the client stops waiting the call is
+        left to finish in the background: its result goes to `keep` (the
+        cache) and its duration is counted as wasted upstream work.
+        """
+        with self._inflight_lock:
+            call = self._inflight.get(key)
+            shared = call is not None
+            if not shared:
+                timeout = deadline.timeout(self.timeouts.timeout(*latency_key))
+                future = self.upstream.submit(func, timeout=timeout, **kwargs)
+                call = self._inflight[key] = _UpstreamCall(future)
+        
+        # Outside the lock: a call that already finished runs the callback right here
+        if shared:
+            self.count("upstream:shared")
+        else:
+            call.future.add_done_callback(lambda done: self._finish(key, call, latency_key))
+        
+        try:
+            # Each caller filters and annotates its own copy of a shared answer
+            return dict(deadline.wait(call.future, "upstream"))
+        except DeadlineExceeded:
+            with self._inflight_lock:
+                first = not call.abandoned
+                call.abandoned = True
+            if first:
+                call.future.add_done_callback(lambda done: self._finish_abandoned(call, keep))
+            raise
+    
+    def _finish(self, key: str, call: '_UpstreamCall', latency_key: Tuple[str, str]):
+        """Done callback of every upstream call: drop it from the in-flight map, learn its latency."""
+        with self._inflight_lock:
+            if self._inflight.get(key) is call:
+                del self._inflight[key]
+        if call.future.exception() is None:
+            self.observe_latency(latency_key, call.future.result(), time.monotonic() - call.started)
+    
+    def observe_latency(self, latency_key: Tuple[str, str], result: Dict[str, Any], seconds: float):
+        """Feed a real (successful, not simulated) upstream answer to the adaptive timeouts."""
+        if 'error' not in result and not result.get('simulated'):
+            self.timeouts.observe(*latency_key, seconds)
+    
+    def _finish_abandoned(self, call: '_UpstreamCall', keep: Callable[[Dict[str, Any]], None]):
+        """Done callback of a call a client gave up on: count it, cache its answer."""
+        if self.metrics is not None:
+            self.metrics.observe(
+                "latency:abandoned_upstream", int((time.monotonic() - call.started) * 1000)
+            )
+        if call.future.exception() is not None:
+            return
+        
+        result = call.future.result()
+        if 'error' not in result and not result.get('simulated'):
+            try:
+                keep(dict(result))
+                self.count("upstream:salvaged")
+            except Exception:
+                pass
+    
+    def abandon(self, error: DeadlineExceeded) -> ServiceError:
+        """Count a request its client gave up on and build its error response."""
+        self.count(f"abandoned:{error.reason}:{error.stage}")
+        return deadline_error(error)
+    
+    def check_rate_limit(self, user_id: Optional[int], platform: str):
+        """Raise a 429 ServiceError when the user is over the limit."""
+        if not user_id:
+            return
+        
+        allowed, remaining, reset_time = self.db.check_rate_limit(
+            user_id, platform, self.rate_limit_messages, self.rate_limit_window
+        )
+        if not allowed:
+            raise ServiceError(429, {
+                "error": "Rate limit exceeded",
+                "reset_time": reset_time.isoformat(),
+                "limit": self.rate_limit_messages
+            })
+    
+    # ==================== Search ====================
+    
+    def search(self, data: Optional[Dict[str, Any]],
+               deadline: Optional[Deadline] = None,
+               charge_rate_limit: bool = True) -> Dict[str, Any]:
+        """
+        Run a search. `data` is the /search request body.
+        
+        Answers are cached for ANSWER_CACHE_TTL seconds per (model, focus,
+        reasoning, normalized query). With `data["render"]` set to a platform
+        the result also carries "chunks", ready-to-send messages that are
+        cached next to the answer. With a `deadline`, the request is dropped
+        (504, or 499 if the client disconnected) as soon as the client stops
+        waiting; see upstream_call(). `charge_rate_limit=False` is for callers
+        that already charged this request (voice_ask).
+        """
+        deadline = deadline or Deadline()
+        try:
+            # A client that already left costs neither rate limit nor upstream work
+            deadline.check("admission")
+            call = self.begin_search(data, charge_rate_limit)
+            result = call['result']
+            if result is None:
+                result = self.upstream_call(
+                    f"search:{call['cache_key']}", deadline, self.scraper.ask,
+                    lambda answer: self._keep_answer(call['cache_key'], answer, call['ask']),
+                    ('search', call['ask']['model']), **call['ask']
+                )
+            return self.finish_search(data, call, result)
+        except DeadlineExceeded as e:
+            raise self.abandon(e)
+        except ServiceError:
+            raise
+        except Exception as e:
+            raise search_error(e)
+    
+    def _keep_answer(self, cache_key: str, result: Dict[str, Any],
+                     ask: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Cache an answer (and index its question for paraphrases); returns the entry."""
+        if ANSWER_CACHE_TTL <= 0:
+            return None
+        
+        entry = {'result': result, 'rendered': {}}
+        self.answer_cache.set(cache_key, entry)
+        if self.similar_answers is not None and ask['focus'] in SIMILAR_QUERY_THRESHOLDS:
+            self.similar_answers.add(cache_key, self._similarity_namespace(ask), ask['query'])
+        return entry
+    
+    @staticmethod
+    def _similarity_namespace(ask: Dict[str, Any]) -> str:
+        return f"{ask['model']}:{ask['focus']}:{int(ask['enable_reasoning'])}"
+    
+    def _similar_answer(self, ask: Dict[str, Any]) -> Optional[Tuple[str, Dict[str, Any], float]]:
+        """
+        (cache key, cached entry, score) of a near-duplicate question, for
+        focus modes listed in SIMILAR_QUERY_THRESHOLDS. Every score is logged
+        so the thresholds can be tuned from real traffic.
+        """
+        threshold = SIMILAR_QUERY_THRESHOLDS.get(ask['focus'])
+        if self.similar_answers is None or threshold is None:
+            return None
+        
+        match = self.similar_answers.query(self._similarity_namespace(ask), ask['query'])
+        if match is None:
+            return None
+        
+        cache_key, score = match
+        logger.info(
+            f"Similar query [{ask['focus']}] score={score:.3f} threshold={threshold} "
+            f"{'hit' if score >= threshold else 'miss'}: {ask['query']!r} ~ {cache_key!r}"
+        )
+        if score < threshold:
+            return None
+        
+        entry = self.answer_cache.get(cache_key)
+        if entry is None:
+            # Expired or evicted from the cache since it was indexed
+            self.similar_answers.remove(cache_key)
+            return None
+        return cache_key, entry, score
+    
+    def answer_ttl_remaining(self, query: str, model: str, focus: str) -> Optional[float]:
+        """Seconds the cached answer to a search has left, or None if it is not cached."""
+        return self.answer_cache.ttl_remaining(answer_key(query, model, focus))
+    
+    def refresh_answer(self, query: str, model: str, focus: str) -> bool:
+        """
+        Ask a search again and replace its cached answer (see warmer.py).
+        
+        No rate limit, no query log: nobody asked. Shares the in-flight call
+        when a user is asking the same thing. Returns whether an answer was cached.
+        """
+        cache_key = answer_key(query, model, focus)
+        ask = {'query': query, 'model': model, 'focus': focus, 'enable_reasoning': False}
+        result = self.upstream_call(
+            f"search:{cache_key}", Deadline(), self.scraper.ask,
+            lambda answer: self._keep_answer(cache_key, answer, ask),
+            ('search', model), **ask
+        )
+        if 'error' in result or result.get('simulated'):
+            return False
+        self._keep_answer(cache_key, dict(result), ask)
+        return True
+    
+    def begin_search(self, data: Optional[Dict[str, Any]],
+                     charge_rate_limit: bool = True) -> Dict[str, Any]:
+        """
+        Validate a search and check the rate limit and the answer cache.
+        
+        Returns the call state for finish_search(); its "result" is the
+        cached answer, or None when the caller must run scraper.ask(**call["ask"]).
+        Without an exact match, focus modes in SIMILAR_QUERY_THRESHOLDS also
+        take the answer of a paraphrase (its result carries "match_score").
+        """
+        if not data or 'query' not in data:
+            raise ServiceError(400, {"error": "Missing required field: query"})
+        
+        render = data.get('render')
+        if render and render not in RENDERERS:
+            raise ServiceError(400, {"error": f"Invalid render platform: {render}"})
+        
+        try:
+            query = data['query']
+            model = data.get('model', 'sonar')
+            focus = data.get('focus', 'web')
+            enable_reasoning = bool(data.get('enable_reasoning', False))
+            
+            if charge_rate_limit:
+                self.check_rate_limit(data.get('user_id'), data.get('platform', 'telegram'))
+            
+            ask = {
+                'query': query,
+                'model': model,
+                'focus': focus,
+                'enable_reasoning': enable_reasoning
+            }
+            cache_key = answer_key(query, model, focus, enable_reasoning)
+            entry = self.answer_cache.get(cache_key) if ANSWER_CACHE_TTL > 0 else None
+            result = None if entry is None else dict(entry['result'], cached=True)
+            if ANSWER_CACHE_TTL > 0 and entry is None:
+                similar = self._similar_answer(ask)
+                if similar is not None:
+                    # The paraphrase's entry keeps its own key (and expiry)
+                    cache_key, entry, score = similar
+                    result = dict(entry['result'], cached=True, match_score=round(score, 3))
+                self.count("answers:similar" if similar is not None else "answers:miss")
+            elif ANSWER_CACHE_TTL > 0:
+                self.count("answers:hit")
+            
+            return {
+                'ask': ask,
+                'cache_key': cache_key,
+                'entry': entry,
+                'result': result,
+                'start_time': time.time()
+            }
+        
+        except ServiceError:
+            raise
+        except Exception as e:
+            raise search_error(e)
+    
+    def finish_search(self, data: Dict[str, Any], call: Dict[str, Any],
+                      result: Dict[str, Any]) -> Dict[str, Any]:
+        """Cache, log, filter and render the answer of a begin_search() call."""
+        response_time_ms = int((time.time() - call['start_time']) * 1000)
+        user_id = data.get('user_id')
+        platform = data.get('platform', 'telegram')
+        render = data.get('render')
+        ask = call['ask']
+        
+        entry = call['entry']
+        # Simulated answers quote the asker's question and stand in for a
+        # failed upstream call: never serve them to anyone else
+        if entry is None and 'error' not in result and not result.get('simulated'):
+            entry = self._keep_answer(call['cache_key'], dict(result), ask)
+        
+        if user_id:
+            self.db.log_query(
+                user_id=user_id,
+                platform=platform,
+                query=ask['query'],
+                model=ask['model'],
+                focus=ask['focus'],
+                response_time_ms=response_time_ms,
+                success='error' not in result,
+                answer=result.get('text') if self.index_answers else None
+            )
+        
+        # Filter response based on preferences
+        if not data.get('return_citations', True):
+            result['citations'] = []
+        
+        if not data.get('return_images', False):
+            result['images'] = []
+        
+        result['response_time_ms'] = response_time_ms
+        result['timestamp'] = datetime.now().isoformat()
+        
+        if render:
+            result['chunks'] = self._rendered_chunks(result, render, call['cache_key'], entry)
+        
+        if user_id and 'config_version' in data:
+            result['config_stale'] = (
+                self.db.get_config_version(user_id, platform) != data['config_version']
+            )
+        
+        return result
+    
+    def _rendered_chunks(self, result: Dict[str, Any], render: str, cache_key: str,
+                         entry: Optional[Dict[str, Any]]) -> List[str]:
+        """Render `result` for a platform, reusing chunks cached with the answer."""
+        render_key = f"{render}:{int(bool(result.get('citations')))}"
+        if entry is not None and render_key in entry['rendered']:
+            return entry['rendered'][render_key]
+        
+        chunks = render_answer(result, render)
+        if entry is not None:
+            entry['rendered'][render_key] = chunks
+            # Store the new variant without extending the answer's expiry
+            ttl = self.answer_cache.ttl_remaining(cache_key)
+            if ttl is not None and ttl > 0:
+                self.answer_cache.set(cache_key, entry, ttl=ttl)
+        return chunks
+    
+    def vision(self, data: Dict[str, Any], image: Optional[bytes],
+               deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """
+        Analyze an image. `data` is the /vision request body without the image.
+        
+        Results are cached per (image content, normalized query, model). With
+        `data["image_id"]` (a client-side id such as a Telegram file_unique_id)
+        the image may be omitted: a known id is answered from the caches, an
+        unknown one raises 409 "image_required" so the client sends the bytes.
+        `data["render"]` and `deadline` work as in search().
+        """
+        deadline = deadline or Deadline()
+        try:
+            deadline.check("admission")
+            call = self.begin_vision(data, image)
+            result = call['result']
+            if result is None:
+                result = self.upstream_call(
+                    f"vision:{call['cache_key']}", deadline, self._ask_vision,
+                    lambda analysis: self.vision_cache.set(call['cache_key'], analysis),
+                    ('vision', call['model']), call=call
+                )
+            return self.finish_vision(data, call, result)
+        
+        except DeadlineExceeded as e:
+            raise self.abandon(e)
+        except ServiceError:
+            raise
+        except Exception as e:
+            raise vision_error(e)
+    
+    def _ask_vision(self, call: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        """Upstream part of a vision call: ask about the uploaded image, or upload it first."""
+        if call['image_url']:
+            return self.scraper.ask_with_image_url(
+                call['query'], call['image_url'], call['model'], timeout=timeout
+            )
+        
+        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmp:
+            tmp.write(call['image'])
+            tmp_path = tmp.name
+        
+        try:
+            return self.scraper.ask_with_image(
+                query=call['query'],
+                image_path=tmp_path,
+                model=call['model'],
+                image_hash=call['image_hash'],
+                timeout=timeout
+            )
+        finally:
+            os.unlink(tmp_path)
+    
+    def begin_vision(self, data: Dict[str, Any], image: Optional[bytes]) -> Dict[str, Any]:
+        """
+        Validate and preprocess a vision request, check the caches and the rate limit.
+        
+        Returns the call state for finish_vision(): "result" is a cached
+        analysis or None; "image_url" is the already-uploaded image, if known.
+        """
+        if not data or 'query' not in data:
+            raise ServiceError(400, {"error": "Missing required fields: query, image_base64"})
+        
+        render = data.get('render')
+        if render and render not in RENDERERS:
+            raise ServiceError(400, {"error": f"Invalid render platform: {render}"})
+        
+        query = data['query']
+        model = data.get('model', 'sonar-pro')
+        image_id = data.get('image_id')
+        
+        if image is None:
+            image_hash = self.image_ids.get(image_id) if image_id else None
+            if image_hash is None:
+                raise ServiceError(409, {"error": "image_required"})
+        else:
+            # Clients that already downscaled (the Telegram bot) set "preprocessed"
+            if not data.get('preprocessed'):
+                image = prepare_image(image, image_target(model))
+            image_hash = hashlib.blake2b(image, digest_size=16).hexdigest()
+            if image_id:
+                self.image_ids.set(image_id, image_hash)
+        
+        cache_key = f"{image_hash}:{model}:{normalize_query(query)}"
+        result = self.vision_cache.get(cache_key)
+        image_url = None
+        if result is None:
+            image_url = self.scraper.upload_cache.get(image_hash)
+            if not image_url and image is None:
+                raise ServiceError(409, {"error": "image_required"})
+        
+        try:
+            self.check_rate_limit(data.get('user_id'), data.get('platform', 'telegram'))
+        except ServiceError:
+            raise
+        except Exception as e:
+            raise vision_error(e)
+        
+        return {
+            'query': query,
+            'model': model,
+            'image': image,
+            'image_hash': image_hash,
+            'image_url': image_url,
+            'cache_key': cache_key,
+            'result': None if result is None else dict(result, cached=True),
+            'start_time': time.time()
+        }
+    
+    def finish_vision(self, data: Dict[str, Any], call: Dict[str, Any],
+                      result: Dict[str, Any]) -> Dict[str, Any]:
+        """Cache, log and render the analysis of a begin_vision() call."""
+        response_time_ms = int((time.time() - call['start_time']) * 1000)
+        user_id = data.get('user_id')
+        
+        if 'error' not in result and not result.get('cached'):
+            self.vision_cache.set(call['cache_key'], dict(result))
+        
+        if user_id:
+            self.db.log_query(
+                user_id=user_id,
+                platform=data.get('platform', 'telegram'),
+                query=f"[IMAGE] {call['query']}",
+                model=call['model'],
+                focus="vision",
+                response_time_ms=response_time_ms,
+                success='error' not in result
+            )
+        
+        result['response_time_ms'] = response_time_ms
+        result['timestamp'] = datetime.now().isoformat()
+        
+        if data.get('render'):
+            result['chunks'] = render_vision(result.get('text', result.get('answer')), data['render'])
+        return result
+    
+    # ==================== Documents ====================
+    
+    def summarize_document(self, data: Dict[str, Any], stream: BinaryIO) -> Iterator[Dict[str, Any]]:
+        """
+        Map-reduce summary of a UTF-8 text document read from `stream`.
+        
+        Checks the rate limit right away (raising ServiceError) and returns an
+        iterator of progress events, ending with a "result" or "error" event:
+            
+            {"event": "start", "parts": 12}
+            {"event": "progress", "stage": "map", "done": 3, "total": 12}
+            {"event": "progress", "stage": "reduce", "round": 1, "groups": 2}
+            {"event": "result", "text": "...", "parts": 12, "cached_parts": 9}
+        
+        With `data["render"]` the result event also carries "chunks",
+        ready-to-send messages for that platform.
+        """
+        data = data or {}
+        render = data.get('render')
+        if render and render not in RENDERERS:
+            raise ServiceError(400, {"error": f"Invalid render platform: {render}"})
+        
+        self.check_rate_limit(data.get('user_id'), data.get('platform', 'telegram'))
+        return self._summarize_events(
+            stream,
+            render=render,
+            model=data.get('model', 'sonar'),
+            file_name=data.get('file_name') or 'documento.txt',
+            user_id=data.get('user_id'),
+            platform=data.get('platform', 'telegram')
+        )
+    
+    def _summarize_text(self, text: str, model: str, prompt: str) -> Tuple[str, bool]:
+        """Summarize one chunk (cached by content). Returns (summary, cached)."""
+        key = f"{hashlib.blake2b((prompt + text).encode('utf-8'), digest_size=16).hexdigest()}:{model}"
+        summary = self.chunk_summaries.get(key)
+        if summary is not None:
+            return summary, True
+        
+        started = time.monotonic()
+        result = self.scraper.ask(
+            query=prompt + text, model=model, focus='writing',
+            timeout=self.timeouts.timeout('document', model)
+        )
+        self.observe_latency(('document', model), result, time.monotonic() - started)
+        if 'error' in result:
+            raise RuntimeError(result['error'])
+        
+        summary = result.get('text', '')
+        self.chunk_summaries.set(key, summary)
+        return summary, False
+    
+    def _group_summaries(self, summaries: List[str]) -> List[List[str]]:
+        """Pack consecutive summaries into groups that fit one chunk budget."""
+        groups: List[List[str]] = [[]]
+        size = 0
+        for summary in summaries:
+            tokens = estimate_tokens(summary)
+            if groups[-1] and size + tokens > DOC_CHUNK_TOKENS:
+                groups.append([])
+                size = 0
+            groups[-1].append(summary)
+            size += tokens
+        return groups
+    
+    def _summarize_events(self, stream: BinaryIO, render: Optional[str], model: str,
+                          file_name: str, user_id: Optional[int], platform: str) -> Iterator[Dict[str, Any]]:
+        start_time = time.time()
+        try:
+            chunks = list(iter_chunks(iter_text_lines(stream, DOC_MAX_BYTES), DOC_CHUNK_TOKENS))
+        except ValueError as e:
+            yield {"event": "error", "error": str(e), "text": "⚠️ Arquivo muito grande para resumir."}
+            return
+        
+        if not chunks:
+            yield {"event": "error", "error": "Empty document", "text": "⚠️ O arquivo está vazio."}
+            return
+        
+        pool = None
+        try:
+            total = len(chunks)
+            yield {"event": "start", "parts": total}
+            
+            # Map: summarize chunks concurrently, at most DOC_MAX_PARALLEL at a time
+            pool = ThreadPoolExecutor(max_workers=min(DOC_MAX_PARALLEL, total))
+            summaries: List[str] = [''] * total
+            futures = {
+                pool.submit(self._summarize_text, chunk, model, DOC_CHUNK_PROMPT): index
+                for index, chunk in enumerate(chunks)
+            }
+            cached_chunks = 0
+            for done, future in enumerate(as_completed(futures), 1):
+                summaries[futures[future]], cached = future.result()
+                cached_chunks += cached
+                yield {"event": "progress", "stage": "map", "done": done, "total": total}
+            
+            # Reduce: merge partial summaries until one is left
+            for round_number in range(1, DOC_MAX_REDUCE_ROUNDS + 1):
+                if len(summaries) == 1:
+                    break
+                groups = self._group_summaries(summaries)
+                yield {"event": "progress", "stage": "reduce", "round": round_number, "groups": len(groups)}
+                summaries = [
+                    summary for summary, _ in pool.map(
+                        lambda group: self._summarize_text('\n\n'.join(group), model, DOC_REDUCE_PROMPT),
+                        groups
+                    )
+                ]
+            
+            result = {
+                "event": "result",
+                "text": '\n\n'.join(summaries),
+                "file_name": file_name,
+                "parts": total,
+                "cached_parts": cached_chunks,
+                "model_used": model,
+                "response_time_ms": int((time.time() - start_time) * 1000)
+            }
+            if render:
+                result['chunks'] = render_document(result['text'], file_name, render)
+            yield result
+            success = True
+        
+        except Exception as e:
+            success = False
+            yield {"event": "error", "error": str(e), "text": "❌ Erro ao resumir o documento"}
+        finally:
+            if pool:
+                pool.shutdown(wait=False, cancel_futures=True)
+        
+        if user_id:
+            self.db.log_query(
+                user_id=user_id,
+                platform=platform,
+                query=f"[DOCUMENT] {file_name}",
+                model=model,
+                focus="document",
+                response_time_ms=int((time.time() - start_time) * 1000),
+                success=success
+            )
+    
+    def transcribe(self, data: Dict[str, Any], audio: bytes) -> Dict[str, Any]:
+        """Transcribe audio with Whisper. `data` is the /transcribe body without the audio."""
+        language = (data or {}).get('language', 'pt')
+        api_key = whisper_api_key()
+        
+        try:
+            import openai
+            
+            with tempfile.NamedTemporaryFile(suffix='.ogg', delete=False) as tmp:
+                tmp.write(audio)
+                tmp_path = tmp.name
+            
+            try:
+                client = openai.OpenAI(api_key=api_key)
+                with open(tmp_path, 'rb') as audio_file:
+                    transcript = client.audio.transcriptions.create(
+                        model="whisper-1",
+                        file=audio_file,
+                        language=language
+                    )
+            finally:
+                os.unlink(tmp_path)
+            
+            return transcript_result(transcript.text, language)
+        
+        except Exception as e:
+            raise transcribe_error(e)
+    
+    def voice_ask(self, data: Dict[str, Any], audio: bytes) -> Iterator[Dict[str, Any]]:
+        """
+        Transcribe a voice message and answer it in one call.
+        
+        `data` holds the /search fields (except query) plus "language".
+        Checks the rate limit and Whisper configuration right away (raising
+        ServiceError) and returns an iterator of events:
+            
+            {"event": "transcript", "text": "...", "language": "pt"}
+            {"event": "answer", ...search result...}
+        
+        or an {"event": "error", "status": ..., ...} event at either step.
+        """
+        data = dict(data or {})
+        render = data.get('render')
+        if render and render not in RENDERERS:
+            raise ServiceError(400, {"error": f"Invalid render platform: {render}"})
+        if not audio:
+            raise ServiceError(400, {"error": "Missing audio"})
+        whisper_api_key()
+        
+        self.check_rate_limit(data.get('user_id'), data.get('platform', 'telegram'))
+        return self._voice_events(data, audio)
+    
+    def _voice_events(self, data: Dict[str, Any], audio: bytes) -> Iterator[Dict[str, Any]]:
+        try:
+            transcript = self.transcribe(data, audio)
+        except ServiceError as e:
+            yield {"event": "error", "status": e.status, **e.payload}
+            return
+        
+        text = transcript['text'].strip()
+        if not text:
+            yield {
+                "event": "error",
+                "status": 422,
+                "error": "Empty transcript",
+                "text": "❌ Não consegui entender o áudio. Tente novamente."
+            }
+            return
+        yield {"event": "transcript", "text": text, "language": transcript['language']}
+        
+        try:
+            # The rate limit was charged once, in voice_ask()
+            result = self.search(dict(data, query=text), charge_rate_limit=False)
+        except ServiceError as e:
+            yield {"event": "error", "status": e.status, **e.payload}
+            return
+        yield {"event": "answer", **result}
+    
+    # ==================== User Config ====================
+    
+    def get_config(self, user_id: int, platform: str = 'telegram') -> Dict[str, Any]:
+        return self.db.get_user_config(user_id, platform)
+    
+    def update_config(self, user_id: int, platform: str,
+                      data: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        if not data:
+            raise ServiceError(400, {"error": "No data provided"})
+        
+        self.db.update_user_config(user_id, platform, data)
+        return {
+            "success": True,
+            "config": self.db.get_user_config(user_id, platform)
+        }
+    
+    def toggle_setting(self, user_id: int, platform: str, setting: str) -> Dict[str, Any]:
+        try:
+            new_value = self.db.toggle_setting(user_id, platform, setting)
+        except ValueError as e:
+            raise ServiceError(400, {"error": str(e)})
+        
+        return {
+            "success": True,
+            "setting": setting,
+            "value": new_value,
+            "config": self.db.get_user_config(user_id, platform)
+        }
+    
+    # ==================== History ====================
+    
+    def search_history(self, text: str, user_id: Optional[int] = None,
+                       platform: str = 'telegram', days: Optional[int] = None,
+                       order: str = 'rank', limit: int = 10,
+                       offset: int = 0) -> Dict[str, Any]:
+        """Full-text search over query history (limit is capped at 50)."""
+        if not text:
+            raise ServiceError(400, {"error": "Missing required parameter: q"})
+        
+        limit = min(limit, 50)
+        try:
+            result = self.db.search_history(
+                text,
+                user_id=user_id,
+                platform=platform,
+                limit=limit,
+                offset=offset,
+                since=(datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S') if days else None,
+                order=order
+            )
+        except ValueError as e:
+            raise ServiceError(400, {"error": str(e)})
+        except RuntimeError as e:
+            raise ServiceError(503, {"error": str(e)})
+        
+        result.update({"query": text, "limit": limit, "offset": offset})
+        return result
+
+
+class AsyncPerplexoService:
+    """
+    Asyncio front of a PerplexoService for the ASGI server.
+    
+    Upstream calls go through an AsyncPerplexoScraper on the event loop, so
+    in-flight searches are not bounded by a thread pool. Validation, caches,
+    rate limiting and logging are the wrapped service's (same JSON contract);
+    that SQLite and CPU work runs in worker threads via asyncio.to_thread.
+    
+    Args:
+        service: PerplexoService sharing the database and caches
+        scraper: AsyncPerplexoScraper for upstream calls
+    """
+    
+    def __init__(self, service: PerplexoService, scraper: AsyncPerplexoScraper):
+        self.service = service
+        self.scraper = scraper
+        self.db = service.db
+    
+    @classmethod
+    def from_env(cls) -> 'AsyncPerplexoService':
+        service = PerplexoService.from_env()
+        return cls(service, AsyncPerplexoScraper(
+            session_token=service.scraper.session_token,
+            api_key=service.scraper.api_key
+        ))
+    
+    async def search(self, data: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        call = await asyncio.to_thread(self.service.begin_search, data)
+        try:
+            result = call['result']
+            if result is None:
+                model = call['ask']['model']
+                started = time.monotonic()
+                result = await self.scraper.ask(
+                    **call['ask'], timeout=self.service.timeouts.timeout('search', model)
+                )
+                self.service.observe_latency(('search', model), result, time.monotonic() - started)
+            return await asyncio.to_thread(self.service.finish_search, data, call, result)
+        except ServiceError:
+            raise
+        except Exception as e:
+            raise search_error(e)
+    
+    async def vision(self, data: Dict[str, Any], image: Optional[bytes]) -> Dict[str, Any]:
+        call = await asyncio.to_thread(self.service.begin_vision, data, image)
+        try:
+            result = call['result']
+            if result is None:
+                image_url = call['image_url']
+                if not image_url:
+                    image_url = await self.scraper.upload_image(call['image'])
+                    if image_url:
+                        await asyncio.to_thread(
+                            self.service.scraper.upload_cache.set, call['image_hash'], image_url
+                        )
+                
+                if image_url:
+                    started = time.monotonic()
+                    result = await self.scraper.ask_with_image_url(
+                        call['query'], image_url, call['model'],
+                        timeout=self.service.timeouts.timeout('vision', call['model'])
+                    )
+                    self.service.observe_latency(
+                        ('vision', call['model']), result, time.monotonic() - started
+                    )
+                else:
+                    result = {
+                        "text": "❌ Falha ao fazer upload da imagem",
+                        "model_used": call['model'],
+                        "error": "Upload failed"
+                    }
+            return await asyncio.to_thread(self.service.finish_vision, data, call, result)
+        
+        except ServiceError:
+            raise
+        except Exception as e:
+            raise vision_error(e)
+    
+    async def transcribe(self, data: Dict[str, Any], audio: bytes) -> Dict[str, Any]:
+        language = (data or {}).get('language', 'pt')
+        api_key = whisper_api_key()
+        
+        try:
+            import openai
+            
+            client = openai.AsyncOpenAI(api_key=api_key)
+            try:
+                transcript = await client.audio.transcriptions.create(
+                    model="whisper-1",
+                    file=("audio.ogg", audio),
+                    language=language
+                )
+            finally:
+                await client.close()
+            return transcript_result(transcript.text, language)
+        
+        except Exception as e:
+            raise transcribe_error(e)
+    
+    async def run(self, func, *args, **kwargs):
+        """Run a blocking PerplexoService/Database method off the event loop."""
+        return await asyncio.to_thread(func, *args, **kwargs)
+    
+    async def aclose(self):
+        await self.scraper.aclose()
@@ -4,10 +4,11 @@ Provides a visual UI with inline keyboards, toggles, and support for images/voic
 """
 
 import os
-import base64
+import time
+import asyncio
 import logging
 from io import BytesIO
-from typing import Optional
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 import httpx
 from telegram import (
@@ -18,6 +19,13 @@ from telegram.ext import (
     Application, CommandHandler, MessageHandler,
     CallbackQueryHandler, ContextTypes, filters
 )
+from telegram.helpers import escape_markdown
+
+from utils import TTLCache
+from utils.concurrency import PerChatUpdateProcessor
+from utils.images import image_target, pick_photo_size, prepare_image_async
+from utils.telegram_sender import OutboundScheduler, PRIORITY_FIRST
+from mcp_client import HttpMcpClient, EmbeddedMcpClient
 
 # Setup logging
 logging.basicConfig(
@@ -32,6 +40,75 @@ WEBHOOK_URL = os.getenv("WEBHOOK_URL")
 MCP_API = os.getenv("MCP_API_URL", "http://127.0.0.1:5000")
 ADMIN_USER_ID = int(os.getenv("ADMIN_USER_ID", "0"))
 
+# Embedded mode: call the scraper and database in this process instead of mcp_server.py
+BOT_EMBEDDED = os.getenv("BOT_EMBEDDED", "false").lower() == "true"
+
+# MCP HTTP client (one pool shared by every handler)
+MCP_HTTP2 = os.getenv("MCP_HTTP2", "false").lower() == "true"
+MCP_MAX_CONNECTIONS = int(os.getenv("MCP_MAX_CONNECTIONS", "50"))
+MCP_MAX_KEEPALIVE = int(os.getenv("MCP_MAX_KEEPALIVE", "20"))
+MCP_CONNECT_TIMEOUT = 5.0
+
+# Read timeouts per endpoint (seconds)
+ENDPOINT_TIMEOUTS = {
+    'config': 5.0,
+    'history': 10.0,
+    'transcribe': 60.0,
+    'vision': 90.0,
+    'document': 120.0
+}
+
+# Largest .txt accepted for summaries (the server enforces the same limit)
+DOC_MAX_BYTES = int(os.getenv("DOC_MAX_BYTES", "2000000"))
+
+# Minimum seconds between edits of the progress message
+PROGRESS_EDIT_INTERVAL = 2.0
+
+# /search read timeout per model (seconds)
+MODEL_TIMEOUTS = {
+    'sonar': 30.0,
+    'sonar-pro': 60.0,
+    'gpt-5.2': 60.0,
+    'reasoning-pro': 90.0,
+    'deep-research': 180.0
+}
+
+# Once the server has sent X-Timeout-Hint (its own upstream timeout, learned
+# from each model's latency), wait that long plus this margin instead
+TIMEOUT_HINT_MARGIN = 10.0
+
+# (endpoint, model) -> last X-Timeout-Hint received (seconds)
+timeout_hints: Dict[Tuple[str, str], float] = {}
+
+mcp_client: Optional[HttpMcpClient] = None
+
+# Outbound sends (answers and images) go through one flood-control-aware queue
+sender: Optional[OutboundScheduler] = None
+
+# Update processing: handlers running at once and messages queued per chat
+BOT_CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "32"))
+BOT_MAX_PENDING_PER_CHAT = int(os.getenv("BOT_MAX_PENDING_PER_CHAT", "3"))
+
+# User preferences cache (write-through, refreshed after BOT_CONFIG_CACHE_TTL seconds)
+BOT_CONFIG_CACHE_TTL = float(os.getenv("BOT_CONFIG_CACHE_TTL", "300"))
+config_cache = TTLCache(maxsize=10000, ttl=BOT_CONFIG_CACHE_TTL)
+
+DEFAULT_CONFIG = {
+    'model': 'sonar',
+    'focus': 'web',
+    'mode': 'busca',
+    'reasoning': False,
+    'return_citations': True,
+    'return_images': True
+}
+
+# Toggle buttons -> config keys
+TOGGLE_SETTINGS = {
+    'reasoning': 'reasoning',
+    'citations': 'return_citations',
+    'images': 'return_images'
+}
+
 # Model and Focus definitions
 MODELS = [
     ('sonar', '⚡ Sonar', 'Rápido (10x), 128K'),
@@ -54,20 +131,110 @@ FOCUSES = [
 
 # ==================== SETUP ====================
 
+def create_http_client() -> httpx.AsyncClient:
+    """Keep-alive client for mcp_server.py (TCP, or a Unix socket with MCP_API_URL=unix://...)."""
+    http2 = MCP_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("MCP_HTTP2=true mas o pacote 'h2' não está instalado; usando HTTP/1.1")
+            http2 = False
+    
+    limits = httpx.Limits(
+        max_connections=MCP_MAX_CONNECTIONS,
+        max_keepalive_connections=MCP_MAX_KEEPALIVE,
+        keepalive_expiry=60.0
+    )
+    
+    if MCP_API.startswith('unix://'):
+        # unix:///path/to/mcp.sock: same HTTP API over a Unix domain socket
+        return httpx.AsyncClient(
+            base_url='http://mcp-server',
+            transport=httpx.AsyncHTTPTransport(
+                uds=MCP_API[len('unix://'):], http2=http2, limits=limits
+            ),
+            timeout=endpoint_timeout('config')
+        )
+    
+    return httpx.AsyncClient(
+        base_url=MCP_API,
+        http2=http2,
+        limits=limits,
+        timeout=endpoint_timeout('config')
+    )
+
+
 async def post_init(application: Application):
-    """Register commands in Telegram menu."""
+    """Create the shared MCP client and sender, and register commands in Telegram menu."""
+    global mcp_client, sender
+    
+    if BOT_EMBEDDED:
+        from service import PerplexoService
+        
+        mcp_client = EmbeddedMcpClient(PerplexoService.from_env())
+        logger.info("✅ Modo embutido: scraper e banco de dados no processo do bot")
+    else:
+        mcp_client = HttpMcpClient(create_http_client(), os.getenv("ADMIN_API_TOKEN"))
+    
+    sender = OutboundScheduler(application.bot)
+    sender.start()
+    
     commands = [
         BotCommand("start", "🏠 Menu Principal"),
         BotCommand("modelos", "🤖 Escolher Modelo AI"),
         BotCommand("busca", "🔍 Modo de Busca (Focus)"),
         BotCommand("normal", "💬 Conversa Normal"),
         BotCommand("config", "⚙️ Configurações"),
+        BotCommand("historico", "🕘 Buscar no Histórico"),
         BotCommand("ajuda", "❓ Guia de Uso")
     ]
     await application.bot.set_my_commands(commands)
     logger.info("✅ Comandos registrados no menu do Telegram")
 
 
+async def post_shutdown(application: Application):
+    """Stop the sender and close the shared MCP client."""
+    if sender:
+        await sender.stop()
+    if mcp_client:
+        await mcp_client.aclose()
+
+
+def endpoint_timeout(endpoint: str) -> httpx.Timeout:
+    """Timeout for an MCP endpoint (see ENDPOINT_TIMEOUTS)."""
+    return httpx.Timeout(ENDPOINT_TIMEOUTS.get(endpoint, 30.0), connect=MCP_CONNECT_TIMEOUT)
+
+
+def model_seconds(endpoint: str, model: str) -> float:
+    """Read timeout for a model on /search or /vision: the server's hint, else the defaults."""
+    hint = timeout_hints.get((endpoint, model))
+    if hint is not None:
+        return hint + TIMEOUT_HINT_MARGIN
+    if endpoint == 'search':
+        return MODEL_TIMEOUTS.get(model, 60.0)
+    return ENDPOINT_TIMEOUTS.get(endpoint, 30.0)
+
+
+def search_timeout(model: str) -> httpx.Timeout:
+    """Timeout for /search, longer for slower models."""
+    return httpx.Timeout(model_seconds('search', model), connect=MCP_CONNECT_TIMEOUT)
+
+
+def vision_timeout(model: str) -> httpx.Timeout:
+    """Timeout for /vision with `model`."""
+    return httpx.Timeout(model_seconds('vision', model), connect=MCP_CONNECT_TIMEOUT)
+
+
+def remember_timeout_hint(endpoint: str, model: str, response: Any):
+    """Keep the X-Timeout-Hint of a response (embedded responses have none)."""
+    hint = getattr(response, 'headers', {}).get('X-Timeout-Hint')
+    try:
+        timeout_hints[(endpoint, model)] = float(hint)
+    except (TypeError, ValueError):
+        pass
+
+
 # ==================== COMMAND HANDLERS ====================
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -247,6 +414,91 @@ async def cmd_normal(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(text, parse_mode='Markdown')
 
 
+async def cmd_historico(update: Update, context: ContextTypes.DEFAULT_TYPE, offset: int = 0):
+    """Comando /historico - Busca nas perguntas anteriores"""
+    user_id = update.effective_user.id
+    
+    if context.args:
+        context.user_data['historico_q'] = ' '.join(context.args)
+        offset = 0
+    search_text = context.user_data.get('historico_q')
+    
+    if not search_text:
+        await update.effective_message.reply_text(
+            "🕘 **Buscar no Histórico**\n\n"
+            "Use: `/historico termo`\n"
+            "Exemplo: `/historico bitcoin`",
+            parse_mode='Markdown'
+        )
+        return
+    
+    try:
+        response = await mcp_client.search_history(
+            {
+                "q": search_text,
+                "user_id": user_id,
+                "platform": "telegram",
+                "limit": 5,
+                "offset": offset
+            },
+            timeout=endpoint_timeout('history')
+        )
+        response.raise_for_status()
+        data = response.json()
+    except Exception as e:
+        logger.error(f"Error searching history: {e}")
+        await update.effective_message.reply_text("❌ Erro ao buscar no histórico.")
+        return
+    
+    safe_text = escape_markdown(search_text)
+    if not data['results']:
+        text = f"🕘 Nada encontrado para _{safe_text}_"
+    else:
+        text = f"🕘 **Histórico:** _{safe_text}_\n\n"
+        for i, item in enumerate(data['results'], offset + 1):
+            question = item['query'] if len(item['query']) <= 120 else item['query'][:117] + "..."
+            text += f"{i}. {escape_markdown(question)}\n   _{item['created_at'][:16]} | 🤖 {item['model']}_\n\n"
+    
+    keyboard = []
+    if data.get('has_more'):
+        keyboard.append([InlineKeyboardButton(
+            "Mais »", callback_data=f'hist_more_{offset + 5}'
+        )])
+    
+    await update.effective_message.reply_text(
+        text,
+        reply_markup=InlineKeyboardMarkup(keyboard) if keyboard else None,
+        parse_mode='Markdown'
+    )
+
+
+async def cmd_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /status - Fila e latência dos handlers (somente admin)"""
+    if update.effective_user.id != ADMIN_USER_ID:
+        return
+    
+    stats = context.application.update_processor.stats(
+        reset=bool(context.args and context.args[0] == 'reset')
+    )
+    latency = stats['handler_latency_ms']
+    wait = stats['queue_wait_ms']
+    outbound = sender.stats()
+    
+    text = (
+        f"📈 **Status do Bot**\n\n"
+        f"**Concorrência:** {stats['running']}/{stats['concurrency']} em execução\n"
+        f"**Aguardando slot:** {stats['waiting_for_slot']}\n"
+        f"**Chats ocupados:** {stats['busy_chats']} "
+        f"({stats['queued_in_chats']} msgs, maior fila {stats['deepest_chat_queue']})\n"
+        f"**Processadas:** {stats['processed']} | **Recusadas:** {stats['rejected']}\n\n"
+        f"**Handler (ms):** p50 {latency['p50']} | p90 {latency['p90']} | p99 {latency['p99']}\n"
+        f"**Espera na fila (ms):** p50 {wait['p50']} | p90 {wait['p90']} | p99 {wait['p99']}\n\n"
+        f"**Envios:** {outbound['sent']} | **Na fila:** {outbound['queued']} | "
+        f"**Repetidos:** {outbound['retried']} | **Falhas:** {outbound['failed']}"
+    )
+    await update.message.reply_text(text, parse_mode='Markdown')
+
+
 async def cmd_ajuda(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Comando /ajuda - Guia de uso"""
     text = (
@@ -256,7 +508,8 @@ async def cmd_ajuda(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "• `/modelos` - Escolher modelo AI\n"
         "• `/busca` - Modo de busca (Focus)\n"
         "• `/normal` - Conversa casual\n"
-        "• `/config` - Configurações avançadas\n\n"
+        "• `/config` - Configurações avançadas\n"
+        "• `/historico termo` - Buscar perguntas anteriores\n\n"
         "**Recursos:**\n"
         "• Envie texto para perguntas\n"
         "• Envie imagens para análise visual\n"
@@ -317,6 +570,10 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif data == 'menu_ajuda':
         await cmd_ajuda(update, context)
     
+    # Paginação do histórico
+    elif data.startswith('hist_more_'):
+        await cmd_historico(update, context, offset=int(data.replace('hist_more_', '')))
+    
     # Seleção de modelo
     elif data.startswith('set_model_'):
         model = data.replace('set_model_', '')
@@ -343,17 +600,19 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif data.startswith('toggle_'):
         setting = data.replace('toggle_', '')
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{MCP_API}/config/{user_id}/toggle/{setting}",
-                    params={"platform": "telegram"}
-                )
-                result = response.json()
-                
-                if result.get('success'):
-                    status = "ativado" if result['value'] else "desativado"
-                    await query.answer(f"{setting.replace('_', ' ').title()} {status}!")
-                    await cmd_config(update, context)
+            response = await mcp_client.toggle_setting(
+                user_id, "telegram", TOGGLE_SETTINGS.get(setting, setting)
+            )
+            result = response.json()
+            
+            if result.get('success'):
+                if 'config' in result:
+                    config_cache.set(user_id, result['config'])
+                else:
+                    config_cache.delete(user_id)
+                status = "ativado" if result['value'] else "desativado"
+                await query.answer(f"{setting.replace('_', ' ').title()} {status}!")
+                await cmd_config(update, context)
         except Exception as e:
             logger.error(f"Error toggling setting: {e}")
             await query.answer("❌ Erro ao alterar configuração")
@@ -373,78 +632,18 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     )
     
     try:
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            payload = {
-                "query": user_query,
-                "model": config['model'],
-                "focus": config['focus'],
-                "enable_reasoning": config['reasoning'],
-                "return_citations": config['return_citations'],
-                "return_images": config['return_images'],
-                "user_id": user_id,
-                "platform": "telegram"
-            }
-            
-            response = await client.post(f"{MCP_API}/search", json=payload)
-            
-            if response.status_code == 429:
-                data = response.json()
-                await update.message.reply_text(
-                    f"⏱️ **Rate Limit Excedido**\n\n"
-                    f"Você atingiu o limite de {data.get('limit', 20)} requisições por hora.\n"
-                    f"Reset em: {data.get('reset_time', 'em breve')}",
-                    parse_mode='Markdown'
-                )
-                return
-            
-            response.raise_for_status()
-            data = response.json()
-        
-        answer = data['answer']
+        payload = search_payload(user_id, config)
+        payload['query'] = user_query
         
-        # Adiciona citações
-        if config['return_citations'] and data.get('citations'):
-            answer += "\n\n📚 **Fontes:**\n"
-            for i, cite in enumerate(data['citations'][:5], 1):
-                title = cite.get('title', 'Link')
-                url = cite.get('url', '')
-                answer += f"{i}. [{title}]({url})\n"
+        response = await mcp_client.search(payload, timeout=search_timeout(config['model']))
+        remember_timeout_hint('search', config['model'], response)
         
-        # Badge de metadados
-        answer += f"\n_🤖 {data.get('model_used', config['model'])} | 🔍 {data.get('focus_mode', config['focus'])}_"
-        
-        # Verifica se resposta é muito longa
-        if len(answer) > 4000:
-            # Telegram limit is 4096, send in parts
-            parts = [answer[i:i+4000] for i in range(0, len(answer), 4000)]
-            for i, part in enumerate(parts):
-                if i == 0:
-                    await update.message.reply_text(
-                        part,
-                        parse_mode='Markdown',
-                        disable_web_page_preview=True
-                    )
-                else:
-                    await context.bot.send_message(
-                        chat_id=update.effective_chat.id,
-                        text=part,
-                        parse_mode='Markdown',
-                        disable_web_page_preview=True
-                    )
-        else:
-            await update.message.reply_text(
-                answer,
-                parse_mode='Markdown',
-                disable_web_page_preview=True
-            )
+        if response.status_code == 429:
+            await reply_rate_limited(update, response.json())
+            return
         
-        # Envia imagens se retornadas
-        if config['return_images'] and data.get('images'):
-            for img_url in data['images'][:3]:
-                try:
-                    await update.message.reply_photo(photo=img_url)
-                except Exception as e:
-                    logger.warning(f"Erro ao enviar imagem: {e}")
+        response.raise_for_status()
+        await send_answer(update, user_id, config, response.json())
         
     except httpx.TimeoutException:
         await update.message.reply_text(
@@ -472,27 +671,39 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     
     try:
-        # Download da imagem
-        photo_file = await update.message.photo[-1].get_file()
-        photo_bytes = await photo_file.download_as_bytearray()
-        photo_b64 = base64.b64encode(photo_bytes).decode()
+        photo = pick_photo_size(update.message.photo, image_target(config['model']))
+        payload = {
+            "query": caption,
+            "model": config['model'],
+            "user_id": user_id,
+            "platform": "telegram",
+            "image_id": f"telegram:{photo.file_unique_id}",
+            "preprocessed": True,
+            "render": "telegram"
+        }
         
-        # Chama MCP API com imagem
-        async with httpx.AsyncClient(timeout=90.0) as client:
-            payload = {
-                "query": caption,
-                "model": config['model'],
-                "image_base64": photo_b64,
-                "user_id": user_id,
-                "platform": "telegram"
-            }
+        # Primeiro tenta sem a imagem: fotos já vistas (ex.: memes encaminhados)
+        # são respondidas pelo cache do servidor sem baixar nada
+        response = await mcp_client.vision(payload, None, timeout=vision_timeout(config['model']))
+        remember_timeout_hint('vision', config['model'], response)
+        
+        if response.status_code == 409:
+            # Baixa o menor tamanho que atende ao modelo e reduz/recomprime antes do upload
+            photo_file = await photo.get_file()
+            original = await photo_file.download_as_bytearray()
+            photo_bytes = await prepare_image_async(original, config['model'])
+            logger.debug(
+                f"Imagem {photo.width}x{photo.height}: {len(original)} -> {len(photo_bytes)} bytes"
+            )
             
-            response = await client.post(f"{MCP_API}/vision", json=payload)
-            response.raise_for_status()
-            data = response.json()
+            response = await mcp_client.vision(
+                payload, photo_bytes, timeout=vision_timeout(config['model'])
+            )
+            remember_timeout_hint('vision', config['model'], response)
+        response.raise_for_status()
+        data = response.json()
         
-        answer = data.get('text', data.get('answer', 'Não foi possível analisar a imagem.'))
-        await update.message.reply_text(answer, parse_mode='Markdown')
+        await send_parts(update, data['chunks'])
         
     except Exception as e:
         logger.error(f"Erro ao processar imagem: {e}")
@@ -519,57 +730,73 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    await context.bot.send_chat_action(
-        chat_id=update.effective_chat.id,
-        action="typing"
-    )
+    if document.file_size and document.file_size > DOC_MAX_BYTES:
+        await update.message.reply_text(
+            f"⚠️ Arquivo muito grande. Limite: {DOC_MAX_BYTES // 1000} KB."
+        )
+        return
+    
+    progress = await update.message.reply_text(f"📄 Lendo {file_name}...")
+    
+    async def show_progress(text: str):
+        try:
+            await progress.edit_text(text)
+        except Exception as e:
+            logger.debug(f"Erro ao atualizar progresso: {e}")
     
     try:
         # Download do arquivo
         file = await document.get_file()
         file_bytes = await file.download_as_bytearray()
-        text_content = file_bytes.decode('utf-8')
         
-        # Limita tamanho (10KB máx)
-        if len(text_content) > 10000:
-            text_content = text_content[:10000] + "\n[...truncado]"
-        
-        # Chama MCP API
-        query = f"Resuma o seguinte texto:\n\n{text_content}"
+        # Servidor divide o texto em partes, resume em paralelo e combina os resumos
+        params = {
+            "model": config['model'],
+            "file_name": file_name,
+            "user_id": user_id,
+            "platform": "telegram",
+            "render": "telegram"
+        }
         
-        async with httpx.AsyncClient(timeout=90.0) as client:
-            payload = {
-                "query": query,
-                "model": config['model'],
-                "focus": "writing",
-                "return_citations": False,
-                "user_id": user_id,
-                "platform": "telegram"
-            }
+        result = None
+        last_edit = 0.0
+        async for event in mcp_client.summarize_document(
+            params, file_bytes, timeout=endpoint_timeout('document')
+        ):
+            if event['event'] in ('result', 'error'):
+                result = event
+                break
             
-            response = await client.post(f"{MCP_API}/search", json=payload)
-            response.raise_for_status()
-            data = response.json()
-        
-        answer = f"📄 **Resumo de {file_name}:**\n\n{data['answer']}"
+            now = time.monotonic()
+            if event['event'] == 'progress' and now - last_edit >= PROGRESS_EDIT_INTERVAL:
+                last_edit = now
+                if event['stage'] == 'map':
+                    await show_progress(
+                        f"📄 Resumindo {file_name}: parte {event['done']}/{event['total']}..."
+                    )
+                else:
+                    await show_progress(f"🧩 Combinando {event['groups']} resumos parciais...")
         
-        # Truncar se necessário
-        if len(answer) > 4000:
-            answer = answer[:3997] + "..."
+        if not result or result['event'] == 'error':
+            await show_progress((result or {}).get('text') or "❌ Erro ao resumir o documento.")
+            return
         
-        await update.message.reply_text(answer, parse_mode='Markdown')
+        parts = result['chunks']
+        await progress.edit_text(parts[0], parse_mode='Markdown')
+        await asyncio.gather(*[
+            sender.send_message(update.effective_chat.id, part, parse_mode='Markdown')
+            for part in parts[1:]
+        ])
         
     except Exception as e:
         logger.error(f"Erro ao processar documento: {e}")
-        await update.message.reply_text(
-            "❌ Erro ao processar arquivo. Verifique se é UTF-8.",
-            parse_mode='Markdown'
-        )
+        await show_progress("❌ Erro ao processar arquivo. Verifique se é UTF-8.")
 
 
 async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Processa mensagens de voz"""
     user_id = update.effective_user.id
+    config = await get_user_config(user_id)
     
     await context.bot.send_chat_action(
         chat_id=update.effective_chat.id,
@@ -580,39 +807,34 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Download do áudio
         voice_file = await update.message.voice.get_file()
         voice_bytes = await voice_file.download_as_bytearray()
-        voice_b64 = base64.b64encode(voice_bytes).decode()
-        
-        # Transcreve usando MCP API (Whisper)
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            payload = {
-                "audio_base64": voice_b64,
-                "language": "pt",
-                "user_id": user_id,
-                "platform": "telegram"
-            }
-            
-            response = await client.post(f"{MCP_API}/transcribe", json=payload)
-            response.raise_for_status()
-            data = response.json()
-        
-        transcribed_text = data.get('text', '')
         
-        if not transcribed_text:
-            await update.message.reply_text(
-                "❌ Não consegui entender o áudio. Tente novamente.",
-                parse_mode='Markdown'
-            )
-            return
-        
-        # Envia transcrição
-        await update.message.reply_text(
-            f"🎤 **Transcrição:**\n_{transcribed_text}_\n\n_Processando..._",
-            parse_mode='Markdown'
+        # Servidor transcreve (Whisper) e já busca a resposta na mesma chamada:
+        # a transcrição chega primeiro, a resposta logo depois
+        params = search_payload(user_id, config)
+        params['language'] = 'pt'
+        timeout = httpx.Timeout(
+            ENDPOINT_TIMEOUTS['transcribe'] + model_seconds('search', config['model']),
+            connect=MCP_CONNECT_TIMEOUT
         )
         
-        # Processa como mensagem de texto
-        update.message.text = transcribed_text
-        await handle_text_message(update, context)
+        async for event in mcp_client.voice_ask(params, voice_bytes, timeout=timeout):
+            if event['event'] == 'transcript':
+                await update.message.reply_text(
+                    f"🎤 **Transcrição:**\n_{event['text']}_\n\n_Processando..._",
+                    parse_mode='Markdown'
+                )
+                await context.bot.send_chat_action(
+                    chat_id=update.effective_chat.id,
+                    action="typing"
+                )
+            elif event['event'] == 'answer':
+                await send_answer(update, user_id, config, event)
+            elif event.get('status') == 429:
+                await reply_rate_limited(update, event)
+            else:
+                await update.message.reply_text(
+                    event.get('text') or "❌ Erro ao processar mensagem de voz."
+                )
         
     except Exception as e:
         logger.error(f"Erro ao processar voz: {e}")
@@ -624,41 +846,105 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ==================== HELPER FUNCTIONS ====================
 
+def search_payload(user_id: int, config: dict) -> dict:
+    """Campos de busca (/search, /voice/ask) a partir da config do usuário."""
+    payload = {
+        "model": config['model'],
+        "focus": config['focus'],
+        "enable_reasoning": config['reasoning'],
+        "return_citations": config['return_citations'],
+        "return_images": config['return_images'],
+        "user_id": user_id,
+        "platform": "telegram",
+        "render": "telegram"
+    }
+    if 'updated_at' in config:
+        payload['config_version'] = config['updated_at']
+    return payload
+
+
+async def reply_rate_limited(update: Update, data: dict):
+    await update.message.reply_text(
+        f"⏱️ **Rate Limit Excedido**\n\n"
+        f"Você atingiu o limite de {data.get('limit', 20)} requisições por hora.\n"
+        f"Reset em: {data.get('reset_time', 'em breve')}",
+        parse_mode='Markdown'
+    )
+
+
+async def send_answer(update: Update, user_id: int, config: dict, data: dict):
+    """Envia uma resposta de busca já renderizada (partes + imagens)."""
+    if data.get('config_stale'):
+        config_cache.delete(user_id)
+    
+    # O servidor já formata a resposta (citações, badge) e divide em partes
+    # que cabem no limite do Telegram
+    images = data['images'][:3] if config['return_images'] and data.get('images') else []
+    await send_parts(update, data['chunks'], images)
+
+
+async def send_parts(update: Update, parts: List[str], images: Sequence[str] = ()):
+    """Envia partes já renderizadas pela fila de envio, com imagens opcionais."""
+    # A primeira parte passa à frente das partes seguintes e das imagens de
+    # outras respostas
+    chat_id = update.effective_chat.id
+    await sender.submit(
+        chat_id,
+        lambda: update.message.reply_text(
+            parts[0],
+            parse_mode='Markdown',
+            disable_web_page_preview=True
+        ),
+        priority=PRIORITY_FIRST
+    )
+    
+    pending = [
+        sender.send_message(
+            chat_id, part, parse_mode='Markdown', disable_web_page_preview=True
+        )
+        for part in parts[1:]
+    ]
+    
+    # Imagens (até 3) vão juntas em um álbum
+    if images:
+        pending.append(sender.send_photos(chat_id, list(images)))
+    
+    for error in await asyncio.gather(*pending, return_exceptions=True):
+        if isinstance(error, Exception):
+            logger.warning(f"Erro ao enviar resposta: {error}")
+
+
 async def get_user_config(user_id: int) -> dict:
-    """Get user configuration from MCP API."""
+    """Get user configuration (local cache first, then MCP API)."""
+    cached = config_cache.get(user_id)
+    if cached is not None:
+        return dict(cached)
+    
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{MCP_API}/config/{user_id}",
-                params={"platform": "telegram"}
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await mcp_client.get_config(user_id, "telegram")
+        response.raise_for_status()
+        config = response.json()
+        config_cache.set(user_id, config)
+        return dict(config)
     except Exception as e:
         logger.error(f"Error getting user config: {e}")
-        # Return defaults
-        return {
-            'model': 'sonar',
-            'focus': 'web',
-            'mode': 'busca',
-            'reasoning': False,
-            'return_citations': True,
-            'return_images': True
-        }
+        # Return defaults (not cached, so the next message retries the API)
+        return dict(DEFAULT_CONFIG)
 
 
 async def update_user_config(user_id: int, config: dict):
-    """Update user configuration via MCP API."""
+    """Update user configuration via MCP API (write-through to the cache)."""
+    # Send the full config so partial updates don't reset other settings
+    config = {**(await get_user_config(user_id)), **config}
+    config.pop('updated_at', None)
+    
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{MCP_API}/config/{user_id}",
-                params={"platform": "telegram"},
-                json=config
-            )
-            response.raise_for_status()
+        response = await mcp_client.update_config(user_id, "telegram", config)
+        response.raise_for_status()
+        config_cache.set(user_id, response.json().get('config', config))
     except Exception as e:
         logger.error(f"Error updating user config: {e}")
+        config_cache.delete(user_id)
 
 
 # ==================== MAIN ====================
@@ -669,7 +955,17 @@ def main():
         logger.error("TELEGRAM_TOKEN não configurado!")
         return
     
-    app = Application.builder().token(TELEGRAM_TOKEN).post_init(post_init).build()
+    app = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .concurrent_updates(PerChatUpdateProcessor(
+            max_concurrent_updates=BOT_CONCURRENT_UPDATES,
+            max_pending_per_chat=BOT_MAX_PENDING_PER_CHAT
+        ))
+        .build()
+    )
     
     # Comandos
     app.add_handler(CommandHandler("start", start))
@@ -677,7 +973,9 @@ def main():
     app.add_handler(CommandHandler("busca", cmd_busca))
     app.add_handler(CommandHandler("normal", cmd_normal))
     app.add_handler(CommandHandler("config", cmd_config))
+    app.add_handler(CommandHandler("historico", cmd_historico))
     app.add_handler(CommandHandler("ajuda", cmd_ajuda))
+    app.add_handler(CommandHandler("status", cmd_status))
     
     # Callbacks
     app.add_handler(CallbackQueryHandler(button_handler))
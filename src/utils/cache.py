@@ -0,0 +1,80 @@
+"""
+In-memory caches for Perplexo Bot.
+Thread-safe LRU with per-entry TTL, shared by the bots and the MCP server.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class TTLCache:
+    """
+    LRU cache whose entries also expire after a TTL.
+    
+    Args:
+        maxsize: Maximum number of entries (least recently used evicted first)
+        ttl: Default time-to-live in seconds
+    """
+    
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return a live entry (refreshing its LRU position) or `default`."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Store a value, evicting the least recently used entries if full."""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def ttl_remaining(self, key: Hashable) -> Optional[float]:
+        """Seconds until an entry expires, or None if absent. Not counted as a hit or miss."""
+        with self._lock:
+            item = self._data.get(key)
+        if item is None:
+            return None
+        remaining = item[1] - time.monotonic()
+        return remaining if remaining > 0 else None
+    
+    def delete(self, key: Hashable):
+        """Drop an entry if present."""
+        with self._lock:
+            self._data.pop(key, None)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+    
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            item = self._data.get(key)
+            return item is not None and item[1] > time.monotonic()
+    
+    def __len__(self) -> int:
+        return len(self._data)
@@ -0,0 +1,125 @@
+"""
+Text chunking for Perplexo Bot document summaries.
+Splits streamed text into token-budgeted chunks on paragraph boundaries.
+"""
+
+import re
+import codecs
+import hashlib
+from typing import BinaryIO, Iterable, Iterator, List
+
+
+# Rough token estimate for Portuguese/English prose
+CHARS_PER_TOKEN = 4
+
+# A chunk may close early (at a content-defined paragraph) once it reaches
+# this fraction of the budget; see iter_chunks()
+MIN_CHUNK_FRACTION = 0.5
+BOUNDARY_MODULUS = 4
+
+_SENTENCE_END = re.compile(r'(?<=[.!?…])\s+')
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def iter_text_lines(stream: BinaryIO, max_bytes: int, block_size: int = 65536) -> Iterator[str]:
+    """
+    Decode a UTF-8 byte stream into lines without reading it all at once.
+    Raises ValueError once more than `max_bytes` have been read.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    total = 0
+    pending = ''
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            break
+        total += len(block)
+        if total > max_bytes:
+            raise ValueError(f"Document larger than {max_bytes} bytes")
+        
+        pending += decoder.decode(block)
+        lines = pending.split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+def iter_paragraphs(lines: Iterable[str]) -> Iterator[str]:
+    """Group lines into paragraphs separated by blank lines."""
+    paragraph: List[str] = []
+    for line in lines:
+        if line.strip():
+            paragraph.append(line.rstrip())
+        elif paragraph:
+            yield '\n'.join(paragraph)
+            paragraph = []
+    if paragraph:
+        yield '\n'.join(paragraph)
+
+
+def _split_oversized(paragraph: str, max_tokens: int) -> List[str]:
+    """Split a paragraph over the budget by sentences, then by characters."""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    pieces: List[str] = []
+    current = ''
+    for sentence in _SENTENCE_END.split(paragraph):
+        while len(sentence) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ''
+            pieces.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        
+        if current and len(current) + len(sentence) + 1 > max_chars:
+            pieces.append(current)
+            current = ''
+        current = f"{current} {sentence}" if current else sentence
+    
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def _is_boundary(paragraph: str) -> bool:
+    digest = hashlib.blake2b(paragraph.encode('utf-8'), digest_size=2).digest()
+    return digest[0] % BOUNDARY_MODULUS == 0
+
+
+def iter_chunks(lines: Iterable[str], max_tokens: int = 1500) -> Iterator[str]:
+    """
+    Pack paragraphs into chunks of at most `max_tokens` (estimated).
+    
+    Past half the budget a chunk closes after any paragraph whose hash
+    marks it as a boundary, so chunk edges depend on content rather than
+    position: editing one paragraph changes its own chunk while the rest
+    of the document keeps the same chunks (and cached summaries).
+    """
+    min_tokens = int(max_tokens * MIN_CHUNK_FRACTION)
+    current: List[str] = []
+    size = 0
+    for paragraph in iter_paragraphs(lines):
+        pieces = [paragraph]
+        if estimate_tokens(paragraph) > max_tokens:
+            pieces = _split_oversized(paragraph, max_tokens)
+        
+        for piece in pieces:
+            tokens = estimate_tokens(piece)
+            if current and size + tokens > max_tokens:
+                yield '\n\n'.join(current)
+                current, size = [], 0
+            
+            current.append(piece)
+            size += tokens
+            if size >= min_tokens and _is_boundary(piece):
+                yield '\n\n'.join(current)
+                current, size = [], 0
+    
+    if current:
+        yield '\n\n'.join(current)
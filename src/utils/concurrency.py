@@ -0,0 +1,137 @@
+"""
+Concurrent Telegram update processing for Perplexo Bot.
+Different chats run in parallel while each chat's messages keep their order.
+"""
+
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from database.histogram import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Update processor with a global concurrency limit and per-chat ordering.
+    
+    Messages from the same chat are handled one at a time, in arrival order.
+    Each chat may have at most `max_pending_per_chat` messages queued or
+    running; extra messages are rejected with a short notice instead of
+    piling up behind a slow query. Button presses (callback queries) skip
+    the per-chat queue so menus stay responsive.
+    
+    Args:
+        max_concurrent_updates: Handlers running at the same time
+        max_pending_per_chat: Messages queued or running per chat
+        max_pending_updates: Updates accepted in total (queued + running)
+    """
+    
+    def __init__(self, max_concurrent_updates: int = 32,
+                 max_pending_per_chat: int = 3,
+                 max_pending_updates: int = 256):
+        super().__init__(max(max_pending_updates, max_concurrent_updates))
+        self.concurrency = max_concurrent_updates
+        self.max_pending_per_chat = max_pending_per_chat
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._chat_locks: Dict[int, asyncio.Lock] = {}
+        self._chat_pending: Dict[int, int] = {}
+        self._reset_stats()
+    
+    def _reset_stats(self):
+        self.processed = 0
+        self.rejected = 0
+        self.running = 0
+        self.waiting = 0
+        self.handler_latency = LatencyHistogram()
+        self.queue_wait = LatencyHistogram()
+    
+    async def initialize(self) -> None:
+        pass
+    
+    async def shutdown(self) -> None:
+        pass
+    
+    @staticmethod
+    def _chat_id(update: object) -> Optional[int]:
+        if isinstance(update, Update) and update.callback_query is None and update.effective_chat:
+            return update.effective_chat.id
+        return None
+    
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        queued_at = time.monotonic()
+        chat_id = self._chat_id(update)
+        if chat_id is None:
+            await self._run(coroutine, queued_at)
+            return
+        
+        pending = self._chat_pending.get(chat_id, 0)
+        if pending >= self.max_pending_per_chat:
+            self.rejected += 1
+            if hasattr(coroutine, 'close'):
+                coroutine.close()
+            await self._reject(update)
+            return
+        
+        self._chat_pending[chat_id] = pending + 1
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        try:
+            async with lock:
+                await self._run(coroutine, queued_at)
+        finally:
+            self._chat_pending[chat_id] -= 1
+            if not self._chat_pending[chat_id]:
+                del self._chat_pending[chat_id]
+                del self._chat_locks[chat_id]
+    
+    async def _run(self, coroutine: Awaitable[Any], queued_at: float):
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        
+        started_at = time.monotonic()
+        self.queue_wait.record(int((started_at - queued_at) * 1000))
+        self.running += 1
+        try:
+            await coroutine
+        finally:
+            self.running -= 1
+            self._slots.release()
+            self.processed += 1
+            self.handler_latency.record(int((time.monotonic() - started_at) * 1000))
+    
+    async def _reject(self, update: Update):
+        try:
+            await update.effective_message.reply_text(
+                "⏳ Ainda estou processando suas mensagens anteriores. "
+                "Aguarde a resposta e tente novamente."
+            )
+        except Exception as e:
+            logger.warning(f"Erro ao avisar fila cheia: {e}")
+    
+    def stats(self, reset: bool = False) -> Dict[str, Any]:
+        """Queue depth and latency figures for sizing the limits."""
+        result = {
+            'concurrency': self.concurrency,
+            'running': self.running,
+            'waiting_for_slot': self.waiting,
+            'busy_chats': len(self._chat_pending),
+            'queued_in_chats': sum(self._chat_pending.values()),
+            'deepest_chat_queue': max(self._chat_pending.values(), default=0),
+            'processed': self.processed,
+            'rejected': self.rejected,
+            'handler_latency_ms': self.handler_latency.summary(),
+            'queue_wait_ms': self.queue_wait.summary()
+        }
+        if reset:
+            running, waiting = self.running, self.waiting
+            self._reset_stats()
+            self.running, self.waiting = running, waiting
+        return result
@@ -0,0 +1,108 @@
+"""
+Request deadlines for Perplexo MCP Server.
+The time budget a client is still willing to wait, and whether it is still
+connected at all, checked between the stages of a request.
+"""
+
+import math
+import os
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Any, Callable, Optional
+
+
+# How often a waiting request re-checks its deadline and the client connection
+POLL_INTERVAL = 0.25
+
+# Smallest timeout handed to an upstream call (requests rejects 0)
+MIN_TIMEOUT = 0.1
+
+# Longest budget (seconds from now) a client deadline may ask for
+REQUEST_DEADLINE_MAX = float(os.getenv("REQUEST_DEADLINE_MAX", "600"))
+
+
+class DeadlineExceeded(Exception):
+    """
+    The client stopped waiting.
+    
+    Args:
+        stage: Where the request was when it was abandoned (admission, upstream)
+        reason: "deadline" (budget spent) or "disconnected" (connection closed)
+    """
+    
+    def __init__(self, stage: str, reason: str):
+        super().__init__(f"{reason} during {stage}")
+        self.stage = stage
+        self.reason = reason
+
+
+class Deadline:
+    """
+    Time budget of one request.
+    
+    Args:
+        expires_at: Unix time after which the client no longer waits (None = no deadline)
+        disconnected: Returns True once the client connection is gone
+            (waitress' environ["waitress.client_disconnected"])
+    """
+    
+    def __init__(self, expires_at: Optional[float] = None,
+                 disconnected: Optional[Callable[[], bool]] = None):
+        self.expires_at = expires_at
+        self.disconnected = disconnected
+    
+    @classmethod
+    def from_header(cls, value: Optional[str],
+                    disconnected: Optional[Callable[[], bool]] = None) -> 'Deadline':
+        """
+        Deadline from an X-Request-Deadline value (Unix time in seconds),
+        at most REQUEST_DEADLINE_MAX from now. Invalid, non-finite or
+        non-positive values mean none.
+        """
+        try:
+            expires_at = float(value) if value else None
+        except ValueError:
+            expires_at = None
+        if expires_at is not None and (not math.isfinite(expires_at) or expires_at <= 0):
+            expires_at = None
+        if expires_at is not None:
+            expires_at = min(expires_at, time.time() + REQUEST_DEADLINE_MAX)
+        return cls(expires_at, disconnected)
+    
+    def remaining(self) -> Optional[float]:
+        """Seconds left, or None without a deadline."""
+        if self.expires_at is None:
+            return None
+        return self.expires_at - time.time()
+    
+    def reason(self) -> Optional[str]:
+        """Why the client is no longer waiting, or None while it still is."""
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            return "deadline"
+        if self.disconnected is not None and self.disconnected():
+            return "disconnected"
+        return None
+    
+    def check(self, stage: str):
+        """Raise DeadlineExceeded if the client is gone or out of time."""
+        reason = self.reason()
+        if reason:
+            raise DeadlineExceeded(stage, reason)
+    
+    def timeout(self, default: float) -> float:
+        """`default` capped by the time left."""
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        return max(min(default, remaining), MIN_TIMEOUT)
+    
+    def wait(self, future: Future, stage: str) -> Any:
+        """Result of `future`, or DeadlineExceeded as soon as the client stops waiting."""
+        while True:
+            remaining = self.remaining()
+            poll = POLL_INTERVAL if remaining is None else max(min(POLL_INTERVAL, remaining), 0)
+            try:
+                return future.result(timeout=poll)
+            except FutureTimeout:
+                self.check(stage)
@@ -0,0 +1,122 @@
+"""
+Image preprocessing for Perplexo Bot.
+Downscales, strips metadata and re-encodes photos before they are uploaded for vision.
+"""
+
+import io
+import os
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Sequence
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; images are then sent unchanged
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+
+# Longest image side (pixels) each model gets; larger images are downscaled
+MODEL_IMAGE_TARGETS = {
+    'sonar': 1024,
+    'sonar-pro': 1568,
+    'gpt-5.2': 1568,
+    'reasoning-pro': 1568,
+    'deep-research': 2048
+}
+DEFAULT_IMAGE_TARGET = 1280
+
+# Upload budget (bytes) and JPEG quality range tried to meet it
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", "800000"))
+IMAGE_QUALITY = 85
+IMAGE_MIN_QUALITY = 55
+
+# Image.info keys holding metadata (GPS, camera, profile) that must not be uploaded
+_METADATA_KEYS = ('exif', 'icc_profile', 'xmp', 'XML:com.adobe.xmp')
+
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def image_target(model: str) -> int:
+    """Longest side, in pixels, an image for this model is scaled to."""
+    return MODEL_IMAGE_TARGETS.get(model, DEFAULT_IMAGE_TARGET)
+
+
+def pick_photo_size(photos: Sequence, target: int):
+    """
+    Pick the smallest Telegram PhotoSize whose longest side reaches `target`.
+    Falls back to the largest size when none is big enough.
+    """
+    ordered = sorted(photos, key=lambda p: p.width * p.height)
+    for photo in ordered:
+        if max(photo.width, photo.height) >= target:
+            return photo
+    return ordered[-1]
+
+
+def _encode_jpeg(image, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def prepare_image(data: bytes, max_side: int = DEFAULT_IMAGE_TARGET,
+                  max_bytes: int = IMAGE_MAX_BYTES) -> bytes:
+    """
+    Downscale to `max_side`, drop EXIF/ICC metadata and re-encode as JPEG
+    under `max_bytes` (lowering quality, then size, until it fits).
+    
+    Returns the original bytes when Pillow is missing, the image can't be
+    decoded, or re-encoding would not make an already small image without
+    metadata smaller. Images carrying EXIF/ICC/XMP are always re-encoded.
+    """
+    if Image is None:
+        return data
+    
+    try:
+        with Image.open(io.BytesIO(data)) as source:
+            # Let the JPEG decoder scale down by a power of two while decoding
+            source.draft('RGB', (max_side, max_side))
+            has_metadata = any(source.info.get(k) for k in _METADATA_KEYS)
+            image = ImageOps.exif_transpose(source)
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+    except Exception as e:
+        logger.warning(f"Image preprocessing skipped: {e}")
+        return data
+    
+    was_small = max(image.size) <= max_side
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+    
+    quality = IMAGE_QUALITY
+    encoded = _encode_jpeg(image, quality)
+    while len(encoded) > max_bytes:
+        if quality > IMAGE_MIN_QUALITY:
+            quality -= 10
+        else:
+            width, height = image.size
+            if max(width, height) < 256:
+                break
+            image = image.resize((int(width * 0.75), int(height * 0.75)), Image.LANCZOS)
+        encoded = _encode_jpeg(image, quality)
+    
+    if (was_small and not has_metadata and len(data) <= max_bytes
+            and len(encoded) >= len(data)):
+        return data
+    return encoded
+
+
+async def prepare_image_async(data: bytes, model: str) -> bytes:
+    """Run prepare_image() for `model` in the image worker pool, off the event loop."""
+    global _executor
+    
+    if Image is None:
+        return bytes(data)
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image")
+    return await asyncio.get_running_loop().run_in_executor(
+        _executor, prepare_image, bytes(data), image_target(model)
+    )
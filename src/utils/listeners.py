@@ -0,0 +1,84 @@
+"""
+Listening sockets for Perplexo MCP Server.
+Binds the TCP port and the optional Unix domain socket, and serves both from
+one waitress loop.
+"""
+
+import os
+import stat
+import socket
+from typing import Any, List, Optional
+
+
+# Unix domain socket served next to the TCP port (empty disables it).
+# Bots on the same host reach it with MCP_API_URL=unix:///path/to/mcp.sock
+MCP_UNIX_SOCKET = os.getenv("MCP_UNIX_SOCKET", "")
+MCP_UNIX_SOCKET_PERMS = int(os.getenv("MCP_UNIX_SOCKET_PERMS", "660"), 8)
+
+
+def bind_tcp_socket(host: str, port: int, backlog: int) -> socket.socket:
+    return socket.create_server((host, port), backlog=backlog)
+
+
+def bind_unix_socket(path: str, backlog: int,
+                     perms: int = MCP_UNIX_SOCKET_PERMS) -> socket.socket:
+    """Bind a listening Unix socket at `path`, replacing a stale socket file."""
+    try:
+        if stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+    except FileNotFoundError:
+        pass
+    
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    os.chmod(path, perms)
+    sock.listen(backlog)
+    return sock
+
+
+def bind_sockets(host: str, port: int, backlog: int,
+                 unix_socket: Optional[str] = MCP_UNIX_SOCKET) -> List[socket.socket]:
+    """TCP socket, plus the Unix socket when `unix_socket` is set."""
+    sockets = [bind_tcp_socket(host, port, backlog)]
+    if unix_socket:
+        sockets.append(bind_unix_socket(unix_socket, backlog))
+    return sockets
+
+
+def create_servers(app, sockets: List[socket.socket], threads: int, **adjustments) -> List[Any]:
+    """
+    One waitress server per socket, sharing a socket map and a thread pool.
+    
+    waitress refuses to mix TCP and Unix sockets in one create_server() call;
+    servers registered in the same map are all served by the first one's
+    run(), so both transports share the loop and the threads.
+    """
+    from waitress.server import create_server
+    from waitress.task import ThreadedTaskDispatcher
+    
+    # Reading ahead is what lets waitress notice a client that hung up while
+    # its request runs (environ["waitress.client_disconnected"])
+    adjustments.setdefault('channel_request_lookahead', 1)
+    
+    dispatcher = ThreadedTaskDispatcher()
+    dispatcher.set_thread_count(threads)
+    shared_map: dict = {}
+    
+    return [
+        create_server(
+            app, map=shared_map, _dispatcher=dispatcher,
+            sockets=[sock], threads=threads, **adjustments
+        )
+        for sock in sockets
+    ]
+
+
+def describe(sock: socket.socket) -> str:
+    address = sock.getsockname()
+    if sock.family == getattr(socket, 'AF_UNIX', None):
+        return f"unix://{address}"
+    return f"http://{address[0]}:{address[1]}"
@@ -0,0 +1,139 @@
+"""
+Request metrics for Perplexo MCP Server.
+Per-process counters and latency histograms whose snapshots can be merged
+across prefork workers.
+"""
+
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable
+
+from database.histogram import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+
+def _encode(histogram: LatencyHistogram) -> Dict[str, Any]:
+    return {
+        'counts': {str(index): count for index, count in histogram.counts.items()},
+        'total_ms': histogram.total_ms,
+        'max_ms': histogram.max_ms
+    }
+
+
+def _decode(data: Dict[str, Any]) -> LatencyHistogram:
+    return LatencyHistogram(
+        {int(index): count for index, count in data['counts'].items()},
+        data['total_ms'],
+        data['max_ms']
+    )
+
+
+class MetricsRegistry:
+    """
+    Thread-safe counters and latency histograms of one process.
+    
+    Names are flat strings such as "requests:/search:200"; snapshots are
+    cumulative since the process started and JSON-serializable.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {}
+        self.latency: Dict[str, LatencyHistogram] = {}
+        self.started_at = time.time()
+    
+    def inc(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+    
+    def observe(self, name: str, value_ms: int):
+        with self._lock:
+            histogram = self.latency.get(name)
+            if histogram is None:
+                histogram = self.latency[name] = LatencyHistogram()
+            histogram.record(value_ms)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'started_at': self.started_at,
+                'counters': dict(self.counters),
+                'latency': {
+                    name: _encode(histogram) for name, histogram in self.latency.items()
+                }
+            }
+
+
+def merge_snapshots(snapshots: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Sum counters and merge histograms of several snapshots.
+    Returns raw merged data: {"counters": {...}, "latency": {name: LatencyHistogram}}.
+    """
+    counters: Dict[str, int] = {}
+    latency: Dict[str, LatencyHistogram] = {}
+    for snapshot in snapshots:
+        for name, value in snapshot.get('counters', {}).items():
+            counters[name] = counters.get(name, 0) + value
+        for name, data in snapshot.get('latency', {}).items():
+            histogram = _decode(data)
+            if name in latency:
+                latency[name].merge(histogram)
+            else:
+                latency[name] = histogram
+    return {'counters': counters, 'latency': latency}
+
+
+def to_snapshot(merged: Dict[str, Any]) -> Dict[str, Any]:
+    """Turn merge_snapshots() output back into a snapshot (to merge again later)."""
+    return {
+        'counters': dict(merged['counters']),
+        'latency': {
+            name: _encode(histogram) for name, histogram in merged['latency'].items()
+        }
+    }
+
+
+def summarize(merged: Dict[str, Any]) -> Dict[str, Any]:
+    """JSON report of merged metrics: counters plus latency count/mean/max/percentiles."""
+    return {
+        'counters': dict(sorted(merged['counters'].items())),
+        'latency': {
+            name: histogram.summary((50, 95, 99))
+            for name, histogram in sorted(merged['latency'].items())
+        }
+    }
+
+
+class MetricsPublisher(threading.Thread):
+    """
+    Periodically hands the registry snapshot to `publish` (e.g. a SQLite write).
+    
+    Args:
+        registry: MetricsRegistry to snapshot
+        publish: Called with each snapshot
+        interval_seconds: Pause between snapshots
+    """
+    
+    def __init__(self, registry: MetricsRegistry,
+                 publish: Callable[[Dict[str, Any]], None],
+                 interval_seconds: float = 5.0):
+        super().__init__(name="metrics-publisher", daemon=True)
+        self.registry = registry
+        self.publish = publish
+        self.interval_seconds = interval_seconds
+        self._stop_event = threading.Event()
+    
+    def publish_now(self):
+        try:
+            self.publish(self.registry.snapshot())
+        except Exception as e:
+            logger.error(f"Metrics publish failed: {e}")
+    
+    def run(self):
+        while not self._stop_event.wait(self.interval_seconds):
+            self.publish_now()
+    
+    def stop(self):
+        self._stop_event.set()
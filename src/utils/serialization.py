@@ -0,0 +1,116 @@
+"""
+JSON serialization for Perplexo MCP Server.
+Encodes straight to UTF-8 bytes and parses from bytes, with orjson when it is
+installed and the stdlib json module otherwise.
+"""
+
+import os
+import json
+import uuid
+import logging
+import decimal
+import dataclasses
+from datetime import date, time
+from typing import Any, Union
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# auto (orjson if installed), orjson or stdlib
+JSON_BACKEND = os.getenv("JSON_BACKEND", "auto").lower()
+
+# Older orjson has no recursion limit when parsing (CVE-2024-27454): deeply
+# nested request bodies crash the process
+ORJSON_MIN_VERSION = (3, 9, 15)
+
+
+def _version(text: str) -> tuple:
+    parts = []
+    for part in text.split('.'):
+        digits = ''.join(c for c in part if c.isdigit())
+        if not digits:
+            break
+        parts.append(int(digits))
+    return tuple(parts)
+
+
+def _default(obj: Any) -> Any:
+    """Types neither backend encodes on its own (orjson already handles dates and UUIDs)."""
+    if isinstance(obj, (date, time)):
+        return obj.isoformat()
+    if isinstance(obj, (decimal.Decimal, uuid.UUID)):
+        return str(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _stdlib_dumps(obj: Any) -> bytes:
+    return json.dumps(
+        obj, ensure_ascii=False, separators=(',', ':'), default=_default
+    ).encode('utf-8')
+
+
+def _stdlib_loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    try:
+        return json.loads(data)
+    except RecursionError:
+        # Deeply nested input: reject it like any other invalid body
+        raise ValueError("JSON nested too deeply")
+
+
+def _orjson_dumps(obj: Any) -> bytes:
+    return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def _select_backend(name: str) -> str:
+    if name == 'stdlib':
+        return 'stdlib'
+    if orjson is None:
+        if name == 'orjson':
+            logger.warning("JSON_BACKEND=orjson mas o pacote 'orjson' não está instalado; usando json")
+        return 'stdlib'
+    if _version(getattr(orjson, '__version__', '0')) < ORJSON_MIN_VERSION:
+        logger.warning(
+            f"orjson {getattr(orjson, '__version__', '?')} é vulnerável (CVE-2024-27454); "
+            f"usando json (instale orjson>=3.9.15)"
+        )
+        return 'stdlib'
+    return 'orjson'
+
+
+BACKEND = _select_backend(JSON_BACKEND)
+
+if BACKEND == 'orjson':
+    _dumps = _orjson_dumps
+    _loads = orjson.loads
+else:
+    _dumps = _stdlib_dumps
+    _loads = _stdlib_loads
+
+
+def dumps(obj: Any) -> bytes:
+    """Encode `obj` as compact UTF-8 JSON bytes."""
+    return _dumps(obj)
+
+
+def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+    """
+    Parse JSON from bytes (or str) without decoding the whole body to str
+    first when orjson is in use. Raises ValueError on invalid JSON.
+    """
+    return _loads(data)
+
+
+def dumps_line(obj: Any) -> bytes:
+    """One NDJSON line."""
+    return _dumps(obj) + b'\n'
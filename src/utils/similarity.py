@@ -0,0 +1,215 @@
+"""
+Near-duplicate query matching for Perplexo MCP Server.
+Folds queries down to their content words and indexes MinHash signatures of
+their character n-grams with LSH, so a paraphrase finds the cached question.
+NumPy computes the signatures when installed; plain Python otherwise.
+"""
+
+import re
+import zlib
+import random
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Set, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Words that do not change what is being asked (accent-folded). Interrogatives
+# that do (quem, quando, onde, como, quanto, por que), negations and words
+# with an opposite (com/sem) are kept.
+STOPWORDS = frozenset("""
+    a o as os um uma uns umas ao aos
+    de do da dos das d em no na nos nas num numa
+    pelo pela pelos pelas para pra pro pras pros sobre entre ate
+    e ou mas qual quais me te se lhe nos vos
+    eu tu ele ela voce voces eles elas meu minha meus minhas seu sua seus suas
+    isso isto esse essa esses essas este esta estes estas aquele aquela aquilo
+    eh sao ser foi era estao estava tem ter ha
+    favor poderia pode consegue sabe saber quero gostaria diga diz fale explique
+    the an of to in on for is are was what which
+""".split())
+
+# Characters per shingle
+NGRAM = 3
+
+_MASK64 = (1 << 64) - 1
+_EMPTY = object()
+_WORD = re.compile(r'\w+')
+_NUMBER = re.compile(r'\d+')
+
+
+def fold_query(query: str) -> str:
+    """Lowercase, accent-free content words of a query, without punctuation or stopwords."""
+    text = unicodedata.normalize('NFKD', query.lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    words = _WORD.findall(text)
+    content = [word for word in words if word not in STOPWORDS]
+    return ' '.join(content or words)
+
+
+def shingles(folded: str, n: int = NGRAM) -> Set[int]:
+    """32-bit hashes of the character n-grams of a folded query."""
+    text = f" {folded} "
+    if len(text) <= n:
+        return {zlib.crc32(text.encode('utf-8'))}
+    return {zlib.crc32(text[i:i + n].encode('utf-8')) for i in range(len(text) - n + 1)}
+
+
+def parse_thresholds(spec: str) -> Dict[str, float]:
+    """Parse per-focus thresholds such as "web=0.9,academic=0.85" (0..1)."""
+    thresholds = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        focus, _, value = item.partition('=')
+        threshold = float(value)
+        if not 0 < threshold <= 1:
+            raise ValueError(f"Invalid similarity threshold for {focus.strip()}: {value}")
+        thresholds[focus.strip()] = threshold
+    return thresholds
+
+
+class SimilarityIndex:
+    """
+    MinHash/LSH index of queries, returning the closest indexed query.
+    
+    Signatures hold `num_perm` multiply-shift hashes of the query's character
+    n-grams; the fraction of equal hashes estimates their Jaccard similarity.
+    Signatures are split into `bands` bands, and only queries sharing a whole
+    band with the lookup are scored, so lookups stay cheap however large the
+    index. With the defaults (8 bands of 8) a query at similarity 0.85 is
+    found 92% of the time and one at 0.9 99% of the time; use more, shorter
+    bands for thresholds much below 0.8. Queries only match within their
+    namespace and with the same numbers ("2023" never matches "2024").
+    
+    Args:
+        maxsize: Indexed queries (oldest dropped first)
+        num_perm: Hashes per signature
+        bands: LSH bands (num_perm must be a multiple)
+        seed: Seed of the hash parameters
+    """
+    
+    def __init__(self, maxsize: int = 1024, num_perm: int = 64, bands: int = 8,
+                 seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.maxsize = maxsize
+        self.num_perm = num_perm
+        self.bands = bands
+        self._band_bytes = num_perm // bands * 4
+        
+        rng = random.Random(seed)
+        self._a = [rng.getrandbits(64) | 1 for _ in range(num_perm)]
+        self._b = [rng.getrandbits(64) for _ in range(num_perm)]
+        if np is not None:
+            self._a_np = np.array(self._a, dtype=np.uint64)[:, None]
+            self._b_np = np.array(self._b, dtype=np.uint64)[:, None]
+        
+        # key -> (scope, packed signature); band hash -> key, or list of keys
+        # when several share it (most buckets hold one query)
+        self._entries: "OrderedDict[Hashable, Tuple[Tuple, bytes]]" = OrderedDict()
+        self._buckets: Dict[int, Any] = {}
+        self._lock = threading.Lock()
+    
+    def signature(self, folded: str) -> bytes:
+        """MinHash signature of a folded query, packed as uint32s."""
+        hashes = shingles(folded)
+        if np is not None:
+            x = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+            # uint64 arithmetic wraps, which is the multiply-shift hash mod 2**64
+            minimums = ((self._a_np * x + self._b_np) >> np.uint64(32)).min(axis=1)
+            return minimums.astype(np.uint32).tobytes()
+        return array('I', [
+            min(((a * x + b) & _MASK64) >> 32 for x in hashes)
+            for a, b in zip(self._a, self._b)
+        ]).tobytes()
+    
+    def _band_hashes(self, scope: Tuple, signature: bytes) -> List[int]:
+        size = self._band_bytes
+        return [hash((scope, i, signature[i * size:(i + 1) * size])) for i in range(self.bands)]
+    
+    def _scores(self, signature: bytes, candidates: List[bytes]) -> List[float]:
+        """Fraction of equal hashes between `signature` and each candidate."""
+        if np is not None:
+            matrix = np.frombuffer(b''.join(candidates), dtype=np.uint32).reshape(len(candidates), -1)
+            equal = np.count_nonzero(matrix == np.frombuffer(signature, dtype=np.uint32), axis=1)
+            return (equal / self.num_perm).tolist()
+        
+        mine = array('I', signature)
+        return [
+            sum(x == y for x, y in zip(mine, array('I', other))) / self.num_perm
+            for other in candidates
+        ]
+    
+    @staticmethod
+    def _scope(namespace: str, folded: str) -> Tuple:
+        return (namespace, tuple(_NUMBER.findall(folded)))
+    
+    def add(self, key: Hashable, namespace: str, query: str):
+        """Index `query` under `key` (replacing what `key` held before)."""
+        folded = fold_query(query)
+        scope = self._scope(namespace, folded)
+        signature = self.signature(folded)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (scope, signature)
+            for band in self._band_hashes(scope, signature):
+                bucket = self._buckets.get(band, _EMPTY)
+                if bucket is _EMPTY:
+                    self._buckets[band] = key
+                elif isinstance(bucket, list):
+                    bucket.append(key)
+                else:
+                    self._buckets[band] = [bucket, key]
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+    
+    def remove(self, key: Hashable):
+        with self._lock:
+            self._remove(key)
+    
+    def _remove(self, key: Hashable):
+        item = self._entries.pop(key, None)
+        if item is None:
+            return
+        for band in self._band_hashes(*item):
+            bucket = self._buckets.get(band, _EMPTY)
+            if isinstance(bucket, list):
+                if key in bucket:
+                    bucket.remove(key)
+                if len(bucket) == 1:
+                    self._buckets[band] = bucket[0]
+            elif bucket is not _EMPTY and bucket == key:
+                del self._buckets[band]
+    
+    def query(self, namespace: str, query: str) -> Optional[Tuple[Hashable, float]]:
+        """Closest indexed (key, estimated Jaccard similarity), or None without candidates."""
+        folded = fold_query(query)
+        scope = self._scope(namespace, folded)
+        signature = self.signature(folded)
+        with self._lock:
+            candidates: Set[Hashable] = set()
+            for band in self._band_hashes(scope, signature):
+                bucket = self._buckets.get(band, _EMPTY)
+                if isinstance(bucket, list):
+                    candidates.update(bucket)
+                elif bucket is not _EMPTY:
+                    candidates.add(bucket)
+            
+            # Band hashes may collide across scopes; only score the query's own
+            keys = [key for key in candidates if self._entries[key][0] == scope]
+            if not keys:
+                return None
+            scores = self._scores(signature, [self._entries[key][1] for key in keys])
+        
+        best = max(range(len(keys)), key=scores.__getitem__)
+        return keys[best], scores[best]
+    
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,293 @@
+"""
+Outbound message scheduler for Perplexo Bot.
+Paces Telegram sends under the global and per-chat flood limits.
+"""
+
+import os
+import asyncio
+import logging
+import itertools
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from telegram import InputMediaPhoto
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+
+logger = logging.getLogger(__name__)
+
+
+# Telegram allows ~30 messages/s overall, ~1/s per private chat and 20/min per group
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_GROUP_RATE = float(os.getenv("TELEGRAM_GROUP_RATE", "0.33"))
+TELEGRAM_CHAT_BURST = 3
+SEND_WORKERS = int(os.getenv("SEND_WORKERS", "4"))
+
+# Lower value goes first: the first chunk of an answer beats follow-up chunks
+# and images of other answers
+PRIORITY_FIRST = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+MAX_ATTEMPTS = 3
+
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second, up to `capacity`."""
+    
+    def __init__(self, rate: float, capacity: float, now: float = 0.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = now
+    
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+    
+    def delay(self, cost: float, now: float) -> float:
+        """Seconds until `cost` tokens are available (0 = now)."""
+        self._refill(now)
+        cost = min(cost, self.capacity)
+        return 0.0 if self.tokens >= cost else (cost - self.tokens) / self.rate
+    
+    def consume(self, cost: float, now: float):
+        self._refill(now)
+        self.tokens -= min(cost, self.capacity)
+    
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ('chat_id', 'call', 'priority', 'seq', 'cost', 'attempts', 'future')
+    
+    def __init__(self, chat_id: int, call: Callable[[], Awaitable[Any]],
+                 priority: int, seq: int, cost: int, future: asyncio.Future):
+        self.chat_id = chat_id
+        self.call = call
+        self.priority = priority
+        self.seq = seq
+        self.cost = cost
+        self.attempts = 0
+        self.future = future
+
+
+class _ChatState:
+    __slots__ = ('queue', 'bucket', 'paused_until', 'in_flight')
+    
+    def __init__(self, bucket: TokenBucket):
+        self.queue: Deque[_Job] = deque()
+        self.bucket = bucket
+        self.paused_until = 0.0
+        self.in_flight = False
+
+
+class OutboundScheduler:
+    """
+    Send queue shared by all handlers.
+    
+    Each chat's sends go out one at a time and in submission order, paced by
+    a per-chat token bucket; all chats share a global bucket. Among chats
+    that may send, the job with the best (priority, submission order) goes
+    first. RetryAfter pauses the chat and retries the same job; timeouts
+    and network errors are retried up to MAX_ATTEMPTS times.
+    
+    Args:
+        bot: telegram.Bot used by the convenience senders
+        global_rate: Messages per second across all chats
+        chat_rate: Messages per second per private chat
+        group_rate: Messages per second per group chat
+        workers: Sends in flight at once (different chats)
+    """
+    
+    def __init__(self, bot, global_rate: float = TELEGRAM_GLOBAL_RATE,
+                 chat_rate: float = TELEGRAM_CHAT_RATE,
+                 group_rate: float = TELEGRAM_GROUP_RATE,
+                 workers: int = SEND_WORKERS):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.workers = workers
+        self._global = TokenBucket(global_rate, max(global_rate, 1.0))
+        self._chats: Dict[int, _ChatState] = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+    
+    # ==================== Lifecycle ====================
+    
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self._global.updated_at = loop.time()
+        self._tasks = [
+            loop.create_task(self._worker(), name=f"telegram-sender-{i}")
+            for i in range(self.workers)
+        ]
+    
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for state in self._chats.values():
+            for job in state.queue:
+                job.future.cancel()
+        self._chats.clear()
+    
+    # ==================== Submitting ====================
+    
+    def submit(self, chat_id: int, call: Callable[[], Awaitable[Any]],
+               priority: int = PRIORITY_NORMAL, cost: int = 1) -> asyncio.Future:
+        """
+        Queue `call` (a zero-argument coroutine factory, called again on retry).
+        Returns a future with the call's result; jobs for one chat run in
+        the order they were submitted.
+        """
+        loop = asyncio.get_running_loop()
+        state = self._chats.get(chat_id)
+        if state is None:
+            rate = self.group_rate if chat_id < 0 else self.chat_rate
+            state = self._chats[chat_id] = _ChatState(
+                TokenBucket(rate, TELEGRAM_CHAT_BURST, loop.time())
+            )
+        
+        future = loop.create_future()
+        state.queue.append(_Job(chat_id, call, priority, next(self._seq), cost, future))
+        self._wakeup.set()
+        return future
+    
+    def send_message(self, chat_id: int, text: str, priority: int = PRIORITY_NORMAL,
+                     **kwargs) -> asyncio.Future:
+        return self.submit(
+            chat_id, lambda: self.bot.send_message(chat_id=chat_id, text=text, **kwargs), priority
+        )
+    
+    def send_photos(self, chat_id: int, photos: List[str],
+                    priority: int = PRIORITY_LOW) -> asyncio.Future:
+        """Send one photo, or up to ten as a single album (send_media_group)."""
+        photos = list(photos)[:10]
+        if len(photos) == 1:
+            return self.submit(
+                chat_id, lambda: self.bot.send_photo(chat_id=chat_id, photo=photos[0]), priority
+            )
+        
+        async def send_album():
+            try:
+                return await self.bot.send_media_group(
+                    chat_id=chat_id, media=[InputMediaPhoto(photo) for photo in photos]
+                )
+            except BadRequest as e:
+                # One bad URL fails the whole album; send the others one by one
+                logger.warning(f"Álbum recusado ({e}), enviando imagens separadas")
+                sent = []
+                for photo in photos:
+                    try:
+                        sent.append(await self.bot.send_photo(chat_id=chat_id, photo=photo))
+                    except BadRequest as photo_error:
+                        logger.warning(f"Erro ao enviar imagem: {photo_error}")
+                return sent
+        
+        return self.submit(chat_id, send_album, priority, cost=len(photos))
+    
+    # ==================== Scheduling ====================
+    
+    async def _next_job(self) -> _Job:
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            best: Optional[_Job] = None
+            wait: Optional[float] = None
+            
+            for chat_id in list(self._chats):
+                state = self._chats[chat_id]
+                if state.in_flight:
+                    continue
+                if not state.queue:
+                    if state.paused_until <= now and state.bucket.full(now):
+                        del self._chats[chat_id]
+                    continue
+                
+                job = state.queue[0]
+                delay = max(state.paused_until - now, state.bucket.delay(job.cost, now))
+                if delay > 0:
+                    wait = delay if wait is None else min(wait, delay)
+                elif best is None or (job.priority, job.seq) < (best.priority, best.seq):
+                    best = job
+            
+            if best is not None:
+                delay = self._global.delay(best.cost, now)
+                if delay <= 0:
+                    state = self._chats[best.chat_id]
+                    state.queue.popleft()
+                    state.in_flight = True
+                    state.bucket.consume(best.cost, now)
+                    self._global.consume(best.cost, now)
+                    return best
+                wait = delay if wait is None else min(wait, delay)
+            
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+    
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._next_job()
+            state = self._chats[job.chat_id]
+            try:
+                if job.future.cancelled():
+                    continue
+                
+                job.attempts += 1
+                try:
+                    result = await job.call()
+                except RetryAfter as e:
+                    delay = e.retry_after
+                    delay = delay.total_seconds() if hasattr(delay, 'total_seconds') else float(delay)
+                    logger.warning(f"Flood control no chat {job.chat_id}: aguardando {delay}s")
+                    state.paused_until = loop.time() + delay
+                    self._global.tokens = min(self._global.tokens, 0)
+                    self._retry(state, job)
+                except BadRequest as e:
+                    self._fail(job, e)
+                except (TimedOut, NetworkError) as e:
+                    if job.attempts >= MAX_ATTEMPTS:
+                        self._fail(job, e)
+                    else:
+                        state.paused_until = loop.time() + job.attempts
+                        self._retry(state, job)
+                except Exception as e:
+                    self._fail(job, e)
+                else:
+                    self.sent += 1
+                    if not job.future.cancelled():
+                        job.future.set_result(result)
+            finally:
+                state.in_flight = False
+                self._wakeup.set()
+    
+    def _fail(self, job: _Job, error: Exception):
+        self.failed += 1
+        if not job.future.cancelled():
+            job.future.set_exception(error)
+    
+    def _retry(self, state: _ChatState, job: _Job):
+        # Back to the head of the chat's queue so later messages stay behind it
+        self.retried += 1
+        state.queue.appendleft(job)
+    
+    def stats(self) -> Dict[str, int]:
+        return {
+            'queued': sum(len(state.queue) for state in self._chats.values()),
+            'chats': len(self._chats),
+            'sent': self.sent,
+            'retried': self.retried,
+            'failed': self.failed
+        }
@@ -0,0 +1,120 @@
+"""
+Adaptive upstream timeouts for Perplexo MCP Server.
+Learns each model's recent latency per endpoint and derives its timeout from
+a high percentile, so fast models give up on hung calls within seconds and
+slow ones are not cut off.
+"""
+
+import os
+import time
+import threading
+from typing import Dict, Optional, Tuple
+
+from database.histogram import LatencyHistogram
+
+
+# Timeout = percentile of recent successful calls x factor, within floor..ceiling (s)
+ADAPTIVE_TIMEOUT_PERCENTILE = float(os.getenv("ADAPTIVE_TIMEOUT_PERCENTILE", "99"))
+ADAPTIVE_TIMEOUT_FACTOR = float(os.getenv("ADAPTIVE_TIMEOUT_FACTOR", "2.0"))
+ADAPTIVE_TIMEOUT_FLOOR = float(os.getenv("ADAPTIVE_TIMEOUT_FLOOR", "5"))
+ADAPTIVE_TIMEOUT_CEILING = float(os.getenv("ADAPTIVE_TIMEOUT_CEILING", "300"))
+
+# Calls needed before a model's own latency is trusted, and how long (s) an
+# observation counts (two windows are kept, so the last 1-2 windows are used)
+ADAPTIVE_TIMEOUT_MIN_SAMPLES = int(os.getenv("ADAPTIVE_TIMEOUT_MIN_SAMPLES", "20"))
+ADAPTIVE_TIMEOUT_WINDOW = float(os.getenv("ADAPTIVE_TIMEOUT_WINDOW", "3600"))
+
+# Timeouts (s) until a model has enough samples: per endpoint, and per model for /search
+DEFAULT_TIMEOUTS = {'search': 60.0, 'vision': 90.0, 'document': 60.0}
+DEFAULT_SEARCH_TIMEOUTS = {
+    'sonar': 30.0,
+    'sonar-pro': 60.0,
+    'gpt-5.2': 60.0,
+    'reasoning-pro': 90.0,
+    'deep-research': 180.0
+}
+
+# Most (endpoint, model) pairs learned; clients may send any model name
+MAX_MODELS = 256
+
+
+class AdaptiveTimeouts:
+    """
+    Per (endpoint, model) timeouts from the latency of recent upstream calls.
+    
+    Only successful calls are observed: a failed or timed-out call says
+    nothing about how long an answer takes, and counting timeouts would
+    feed each timeout back into the next, larger one.
+    
+    Args:
+        percentile: Latency percentile the timeout is based on
+        factor: Safety factor applied to that percentile
+        floor: Shortest timeout (s)
+        ceiling: Longest timeout (s)
+        min_samples: Observations needed before replacing the default
+        window_seconds: Age after which observations start to be dropped
+    """
+    
+    def __init__(self, percentile: float = ADAPTIVE_TIMEOUT_PERCENTILE,
+                 factor: float = ADAPTIVE_TIMEOUT_FACTOR,
+                 floor: float = ADAPTIVE_TIMEOUT_FLOOR,
+                 ceiling: float = ADAPTIVE_TIMEOUT_CEILING,
+                 min_samples: int = ADAPTIVE_TIMEOUT_MIN_SAMPLES,
+                 window_seconds: float = ADAPTIVE_TIMEOUT_WINDOW):
+        self.percentile = percentile
+        self.factor = factor
+        self.floor = floor
+        self.ceiling = ceiling
+        self.min_samples = min_samples
+        self.window_seconds = window_seconds
+        # (endpoint, model) -> [previous window, current window, current window start]
+        self._windows: Dict[Tuple[str, str], list] = {}
+        self._lock = threading.Lock()
+    
+    def _window(self, key: Tuple[str, str]) -> list:
+        now = time.monotonic()
+        window = self._windows.get(key)
+        if window is None:
+            window = self._windows[key] = [LatencyHistogram(), LatencyHistogram(), now]
+        elif now - window[2] >= self.window_seconds:
+            # A window idle for two periods has nothing recent left
+            previous = window[1] if now - window[2] < 2 * self.window_seconds else LatencyHistogram()
+            window[:] = [previous, LatencyHistogram(), now]
+        return window
+    
+    def observe(self, endpoint: str, model: str, seconds: float):
+        """Record the duration of a successful upstream call."""
+        with self._lock:
+            if (endpoint, model) not in self._windows and len(self._windows) >= MAX_MODELS:
+                return
+            self._window((endpoint, model))[1].record(int(seconds * 1000))
+    
+    def _learned(self, endpoint: str, model: str) -> Optional[float]:
+        with self._lock:
+            # Only models that were observed get windows (lookups use any model name)
+            if (endpoint, model) not in self._windows:
+                return None
+            previous, current, _ = self._window((endpoint, model))
+            histogram = LatencyHistogram().merge(previous).merge(current)
+        if histogram.count < self.min_samples:
+            return None
+        return histogram.percentile(self.percentile) / 1000
+    
+    def timeout(self, endpoint: str, model: str) -> float:
+        """Seconds to wait for an upstream call of `model` on `endpoint`."""
+        learned = self._learned(endpoint, model)
+        if learned is None:
+            if endpoint == 'search' and model in DEFAULT_SEARCH_TIMEOUTS:
+                return DEFAULT_SEARCH_TIMEOUTS[model]
+            return DEFAULT_TIMEOUTS.get(endpoint, 60.0)
+        return min(max(learned * self.factor, self.floor), self.ceiling)
+    
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Current timeout of every model seen (and every default /search model), per endpoint."""
+        with self._lock:
+            seen = list(self._windows)
+        keys = {('search', model) for model in DEFAULT_SEARCH_TIMEOUTS}
+        result: Dict[str, Dict[str, float]] = {}
+        for endpoint, model in sorted(keys.union(seen)):
+            result.setdefault(endpoint, {})[model] = round(self.timeout(endpoint, model), 1)
+        return result
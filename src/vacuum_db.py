@@ -0,0 +1,14 @@
+"""
+Offline incremental-vacuum conversion CLI.
+Runs the one-time full VACUUM that switches the database to auto_vacuum=INCREMENTAL;
+stop the servers first on large databases, since it holds an exclusive lock.
+
+Usage:
+    python3 src/vacuum_db.py --db data/perplexo.db
+"""
+
+from database.retention import main
+
+
+if __name__ == '__main__':
+    main()
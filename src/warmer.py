@@ -0,0 +1,127 @@
+"""
+Refresh-ahead cache warmer for Perplexo MCP Server.
+Re-asks the most frequent recent questions shortly before their cached
+answers expire, so peak traffic on the same questions is served from cache.
+"""
+
+import os
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict
+
+from service import ANSWER_CACHE_TTL, PerplexoService
+
+logger = logging.getLogger(__name__)
+
+
+# Questions kept warm: top N (query, model, focus) asked at least WARMER_MIN_HITS
+# times in the last WARMER_WINDOW_HOURS (0 disables the warmer)
+WARMER_TOP_N = int(os.getenv("WARMER_TOP_N", "20"))
+WARMER_MIN_HITS = int(os.getenv("WARMER_MIN_HITS", "3"))
+WARMER_WINDOW_HOURS = float(os.getenv("WARMER_WINDOW_HOURS", "24"))
+
+# Pause between passes, and how close to expiry (s) an answer is refreshed.
+# Keep WARMER_INTERVAL below WARMER_REFRESH_AHEAD so no answer expires in between.
+WARMER_INTERVAL = float(os.getenv("WARMER_INTERVAL", "60"))
+WARMER_REFRESH_AHEAD = float(os.getenv("WARMER_REFRESH_AHEAD", "120"))
+
+# Upstream calls per hour the warmer may spend, across all processes (0 disables)
+WARMER_BUDGET = float(os.getenv("WARMER_BUDGET", "60"))
+
+LEASE_NAME = "cache-warmer"
+
+
+class CacheWarmer(threading.Thread):
+    """
+    Periodically refreshes the answers of popular questions before they expire.
+    
+    Each pass reads the top questions from query_logs and re-asks those whose
+    cached answer is missing or has less than `refresh_ahead` seconds left.
+    Every pass adds budget_per_hour * interval / 3600 calls to the allowance
+    (carrying at most one pass worth over), so the warmer never spends more
+    than its budget however long the queue of stale answers is.
+    
+    With a shared (SQLite) cache, as under prefork.py, passes are serialized
+    through a database lease: one process warms per interval, for all of them.
+    
+    Args:
+        service: Service whose answer cache is warmed
+        top_n: Questions considered per pass
+        min_hits: Times a question must have been asked in the window
+        window_hours: Sliding window of query_logs mined for questions
+        interval_seconds: Pause between passes
+        refresh_ahead: Refresh answers with fewer seconds than this left
+        budget_per_hour: Upstream calls allowed per hour
+    """
+    
+    def __init__(self, service: PerplexoService, top_n: int = WARMER_TOP_N,
+                 min_hits: int = WARMER_MIN_HITS,
+                 window_hours: float = WARMER_WINDOW_HOURS,
+                 interval_seconds: float = WARMER_INTERVAL,
+                 refresh_ahead: float = WARMER_REFRESH_AHEAD,
+                 budget_per_hour: float = WARMER_BUDGET):
+        super().__init__(name="cache-warmer", daemon=True)
+        self.service = service
+        self.top_n = top_n
+        self.min_hits = min_hits
+        self.window_hours = window_hours
+        self.interval_seconds = interval_seconds
+        self.refresh_ahead = refresh_ahead
+        self.per_pass = budget_per_hour * interval_seconds / 3600
+        self.allowance = 0.0
+        self.holder = f"{os.getpid()}:{id(self)}"
+        self._stop_event = threading.Event()
+    
+    @staticmethod
+    def enabled() -> bool:
+        """Whether the environment asks for a warmer (and answers are cached at all)."""
+        return WARMER_TOP_N > 0 and WARMER_BUDGET > 0 and ANSWER_CACHE_TTL > 0
+    
+    def run_once(self) -> Dict[str, int]:
+        """Run one warming pass. Returns questions per outcome."""
+        if self.service.persist_cache and not self.service.db.claim_lease(
+            LEASE_NAME, self.holder, self.interval_seconds
+        ):
+            return {}
+        
+        self.allowance = min(self.allowance + self.per_pass, max(self.per_pass, 1.0))
+        since = datetime.utcnow() - timedelta(hours=self.window_hours)
+        outcomes = {'refreshed': 0, 'fresh': 0, 'over_budget': 0, 'failed': 0}
+        
+        for row in self.service.db.get_top_queries(since, self.top_n, self.min_hits):
+            if self._stop_event.is_set():
+                break
+            
+            remaining = self.service.answer_ttl_remaining(row['query'], row['model'], row['focus'])
+            if remaining is not None and remaining > self.refresh_ahead:
+                outcomes['fresh'] += 1
+                continue
+            if self.allowance < 1:
+                outcomes['over_budget'] += 1
+                continue
+            
+            self.allowance -= 1
+            try:
+                refreshed = self.service.refresh_answer(row['query'], row['model'], row['focus'])
+            except Exception as e:
+                logger.warning(f"Cache warmer failed for {row['model']}/{row['focus']}: {e}")
+                refreshed = False
+            outcomes['refreshed' if refreshed else 'failed'] += 1
+        
+        for outcome, count in outcomes.items():
+            if count:
+                self.service.count(f"warmer:{outcome}", count)
+        logger.info(f"Cache warmer pass: {outcomes}")
+        return outcomes
+    
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Cache warmer pass failed: {e}")
+            self._stop_event.wait(self.interval_seconds)
+    
+    def stop(self):
+        self._stop_event.set()
@@ -10,12 +10,18 @@ const {
   downloadMediaMessage
 } = require('@whiskeysockets/baileys');
 const axios = require('axios');
+const crypto = require('crypto');
 const pino = require('pino');
 const fs = require('fs');
 const path = require('path');
+const readline = require('readline');
 
 // Config
-const MCP_API = process.env.MCP_API_URL || 'http://127.0.0.1:5000';
+const MCP_API_URL = process.env.MCP_API_URL || 'http://127.0.0.1:5000';
+// unix:///path/to/mcp.sock: same HTTP API over a Unix domain socket
+const MCP_SOCKET = MCP_API_URL.startsWith('unix://') ? MCP_API_URL.slice('unix://'.length) : null;
+const MCP_API = MCP_SOCKET ? 'http://mcp-server' : MCP_API_URL;
+const mcpHttp = axios.create(MCP_SOCKET ? { socketPath: MCP_SOCKET } : {});
 const SESSION_NAME = process.env.WHATSAPP_SESSION_NAME || 'perplexo-session';
 const ADMIN_NUMBER = process.env.ADMIN_WHATSAPP_NUMBER || '';
 
@@ -31,6 +37,12 @@ const logger = pino({
 // User preferences cache (in production, use database)
 const userPreferences = new Map();
 
+// Last X-Timeout-Hint per path and model (the server's upstream timeout, in
+// seconds, learned from each model's latency); requests wait that long plus
+// TIMEOUT_HINT_MARGIN_MS instead of a fixed worst case
+const timeoutHints = new Map();
+const TIMEOUT_HINT_MARGIN_MS = 10000;
+
 // Models and Focuses
 const MODELS = [
   { id: 'sonar', name: '⚡ Sonar', desc: 'Rápido (10x), 128K' },
@@ -59,7 +71,7 @@ async function getUserConfig(userId) {
   }
   
   try {
-    const response = await axios.get(`${MCP_API}/config/${userId}`, {
+    const response = await mcpHttp.get(`${MCP_API}/config/${userId}`, {
       params: { platform: 'whatsapp' }
     });
     const config = response.data;
@@ -85,7 +97,7 @@ async function updateUserConfig(userId, config) {
   userPreferences.set(userId, config);
   
   try {
-    await axios.post(`${MCP_API}/config/${userId}`, config, {
+    await mcpHttp.post(`${MCP_API}/config/${userId}`, config, {
       params: { platform: 'whatsapp' }
     });
   } catch (error) {
@@ -202,6 +214,70 @@ function formatHelp() {
 📊 Deep Research - Pesquisa`;
 }
 
+/**
+ * Send a rendered search answer (chunks + images)
+ */
+async function sendAnswer(sock, sender, data, config) {
+  // Server formats the answer (citations, badge) and splits it into
+  // messages under the WhatsApp limit without breaking formatting
+  for (const chunk of data.chunks) {
+    await sock.sendMessage(sender, { text: chunk });
+  }
+  
+  // Send images if any
+  if (config.return_images && data.images && data.images.length > 0) {
+    for (const imgUrl of data.images.slice(0, 3)) {
+      try {
+        await sock.sendMessage(sender, { 
+          image: { url: imgUrl },
+          caption: '🖼️ Imagem relacionada'
+        });
+      } catch (e) {
+        logger.warn('Failed to send image:', e.message);
+      }
+    }
+  }
+}
+
+/**
+ * Idempotency-Key derived from the request itself, so a user resending the
+ * same message after a timeout attaches to the first request on the server
+ */
+function idempotencyKey(path, body) {
+  const digest = crypto.createHash('sha256')
+    .update(path + JSON.stringify(body))
+    .digest('hex')
+    .slice(0, 32);
+  return `whatsapp:${body.user_id}:${digest}`;
+}
+
+/**
+ * Timeout (ms) for a model on path: the server's last hint, else fallbackMs
+ */
+function timeoutFor(path, model, fallbackMs) {
+  const hint = timeoutHints.get(`${path}:${model}`);
+  return hint === undefined ? fallbackMs : hint * 1000 + TIMEOUT_HINT_MARGIN_MS;
+}
+
+/**
+ * POST to the MCP server with an Idempotency-Key and a deadline (options.timeout)
+ */
+async function postIdempotent(path, body, options) {
+  const response = await mcpHttp.post(`${MCP_API}${path}`, body, {
+    ...options,
+    headers: {
+      'Idempotency-Key': idempotencyKey(path, body),
+      // The server stops working on the request when the bot stops waiting
+      'X-Request-Deadline': ((Date.now() + options.timeout) / 1000).toFixed(3)
+    }
+  });
+  const hint = parseFloat(response.headers['x-timeout-hint']);
+  if (!Number.isNaN(hint)) {
+    timeoutHints.set(`${path}:${body.model}`, hint);
+  }
+  return response;
+}
+
 /**
  * Process text query
  */
@@ -209,7 +285,7 @@ async function processQuery(sock, sender, text, config, userId) {
   await sock.sendMessage(sender, { text: '🤔 Processando...' });
   
   try {
-    const response = await axios.post(`${MCP_API}/search`, {
+    const response = await postIdempotent('/search', {
       query: text,
       model: config.model,
       focus: config.focus,
@@ -217,46 +293,11 @@ async function processQuery(sock, sender, text, config, userId) {
       return_citations: config.return_citations,
       return_images: config.return_images,
       user_id: userId,
-      platform: 'whatsapp'
-    }, { timeout: 60000 });
-    
-    const data = response.data;
-    let answer = data.answer || data.text;
-    
-    // Add citations
-    if (config.return_citations && data.citations && data.citations.length > 0) {
-      answer += '\n\n📚 *Fontes:*\n';
-      data.citations.slice(0, 5).forEach((cite, i) => {
-        const title = cite.title || 'Link';
-        const url = cite.url || '';
-        answer += `${i + 1}. ${title}\n`;
-        if (url) answer += `   ${url}\n`;
-      });
-    }
-    
-    // Add metadata
-    answer += `\n_🤖 ${data.model_used || config.model} | 🔍 ${data.focus_mode || config.focus}_`;
-    
-    // Split long messages (WhatsApp limit ~4096)
-    const chunks = answer.match(/[\s\S]{1,4000}/g) || [answer];
-    
-    for (const chunk of chunks) {
-      await sock.sendMessage(sender, { text: chunk });
-    }
+      platform: 'whatsapp',
+      render: 'whatsapp'
+    }, { timeout: timeoutFor('/search', config.model, 60000) });
     
-    // Send images if any
-    if (config.return_images && data.images && data.images.length > 0) {
-      for (const imgUrl of data.images.slice(0, 3)) {
-        try {
-          await sock.sendMessage(sender, { 
-            image: { url: imgUrl },
-            caption: '🖼️ Imagem relacionada'
-          });
-        } catch (e) {
-          logger.warn('Failed to send image:', e.message);
-        }
-      }
-    }
+    await sendAnswer(sock, sender, response.data, config);
     
   } catch (error) {
     logger.error('Query error:', error.message);
@@ -283,13 +324,13 @@ async function processImage(sock, sender, imageBuffer, caption, config, userId)
   try {
     const imageB64 = imageBuffer.toString('base64');
     
-    const response = await axios.post(`${MCP_API}/vision`, {
+    const response = await postIdempotent('/vision', {
       query: caption || 'O que você vê nesta imagem?',
       image_base64: imageB64,
       model: config.model,
       user_id: userId,
       platform: 'whatsapp'
-    }, { timeout: 90000 });
+    }, { timeout: timeoutFor('/vision', config.model, 90000) });
     
     const data = response.data;
     const answer = data.text || data.answer || 'Não foi possível analisar a imagem.';
@@ -323,7 +364,7 @@ async function processDocument(sock, sender, documentBuffer, fileName, config, u
       ? textContent.substring(0, 10000) + '\n[...truncado]' 
       : textContent;
     
-    const response = await axios.post(`${MCP_API}/search`, {
+    const response = await postIdempotent('/search', {
       query: `Resuma o seguinte texto:\n\n${truncated}`,
       model: config.model,
       focus: 'writing',
@@ -356,31 +397,42 @@ async function processAudio(sock, sender, audioBuffer, config, userId) {
   await sock.sendMessage(sender, { text: '🎤 Transcrevendo áudio...' });
   
   try {
-    const audioB64 = audioBuffer.toString('base64');
-    
-    const response = await axios.post(`${MCP_API}/transcribe`, {
-      audio_base64: audioB64,
-      language: 'pt',
-      user_id: userId,
-      platform: 'whatsapp'
-    }, { timeout: 60000 });
-    
-    const data = response.data;
-    const transcribedText = data.text;
-    
-    if (!transcribedText) {
-      await sock.sendMessage(sender, { 
-        text: '❌ Não consegui entender o áudio.' 
-      });
-      return;
-    }
-    
-    await sock.sendMessage(sender, { 
-      text: `🎤 *Transcrição:*\n_${transcribedText}_\n\n_Processando..._` 
+    // One call: the server transcribes, then searches with the transcript.
+    // Events arrive as NDJSON lines (transcript first, then the answer)
+    const response = await mcpHttp.post(`${MCP_API}/voice/ask`, audioBuffer, {
+      params: {
+        language: 'pt',
+        model: config.model,
+        focus: config.focus,
+        enable_reasoning: config.reasoning,
+        return_citations: config.return_citations,
+        return_images: config.return_images,
+        user_id: userId,
+        platform: 'whatsapp',
+        render: 'whatsapp'
+      },
+      headers: { 'Content-Type': 'audio/ogg' },
+      responseType: 'stream',
+      timeout: 120000
     });
     
-    // Process transcribed text as query
-    await processQuery(sock, sender, transcribedText, config, userId);
+    const lines = readline.createInterface({ input: response.data, crlfDelay: Infinity });
+    for await (const line of lines) {
+      if (!line.trim()) continue;
+      const event = JSON.parse(line);
+      
+      if (event.event === 'transcript') {
+        await sock.sendMessage(sender, { 
+          text: `🎤 *Transcrição:*\n_${event.text}_\n\n_Processando..._` 
+        });
+      } else if (event.event === 'answer') {
+        await sendAnswer(sock, sender, event, config);
+      } else {
+        await sock.sendMessage(sender, { 
+          text: event.text || '❌ Não consegui entender o áudio.' 
+        });
+      }
+    }
     
   } catch (error) {
     logger.error('Audio processing error:', error.message);
@@ -0,0 +1,32 @@
+from datetime import datetime, timedelta, timezone
+
+from database import Database
+
+
+def test_top_queries_only_returns_searches(tmp_path):
+    db = Database(str(tmp_path / 'analytics.db'))
+    for user_id in range(3):
+        db.log_query(user_id, 'telegram', "[IMAGE] O que você vê nesta imagem?",
+                     'sonar-pro', 'vision', 1500)
+        db.log_query(user_id, 'telegram', "[DOCUMENT] notas.txt", 'sonar', 'document', 3000)
+        db.log_query(user_id, 'telegram', "cotação do dólar", 'sonar', 'web', 800)
+    
+    top = db.get_top_queries(datetime.utcnow() - timedelta(hours=1), limit=10)
+    
+    assert [(row['query'], row['focus'], row['hits']) for row in top] == [
+        ("cotação do dólar", 'web', 3)
+    ]
+
+
+def test_latency_window_accepts_timezone_aware_bounds(tmp_path):
+    db = Database(str(tmp_path / 'analytics.db'))
+    db.log_query(1, 'telegram', "cotação do dólar", 'sonar', 'web', 800)
+    now = datetime.now(timezone.utc)
+    brt = timezone(timedelta(hours=-3))
+    
+    [stats] = db.get_latency_percentiles(since=now - timedelta(hours=1),
+                                         until=(now + timedelta(hours=1)).astimezone(brt))
+    assert stats['count'] == 1
+    assert db.get_latency_percentiles(since=datetime.fromisoformat(
+        (now + timedelta(hours=2)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    )) == []
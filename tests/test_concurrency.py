@@ -0,0 +1,48 @@
+import asyncio
+from datetime import datetime
+
+from telegram import Chat, Message, Update
+
+from utils.concurrency import PerChatUpdateProcessor
+
+
+def message_update(update_id: int, chat_id: int) -> Update:
+    chat = Chat(chat_id, Chat.PRIVATE)
+    return Update(update_id, message=Message(update_id, datetime.now(), chat, text="oi"))
+
+
+def test_chat_messages_run_in_order_and_overflow_is_rejected():
+    async def scenario():
+        processor = PerChatUpdateProcessor(max_concurrent_updates=4, max_pending_per_chat=2)
+        rejected = []
+        
+        async def reject(update):
+            rejected.append(update.update_id)
+        
+        processor._reject = reject
+        release = asyncio.Event()
+        events = []
+        
+        async def handler(name):
+            events.append(f"start {name}")
+            await release.wait()
+            events.append(f"end {name}")
+        
+        tasks = [
+            asyncio.create_task(processor.do_process_update(message_update(i, 7), handler(i)))
+            for i in range(1, 4)
+        ]
+        other = asyncio.create_task(processor.do_process_update(message_update(4, 8), handler(4)))
+        await asyncio.sleep(0.05)
+        running = list(events)
+        release.set()
+        await asyncio.gather(*tasks, other)
+        return running, events, rejected, processor.stats()
+    
+    running, events, rejected, stats = asyncio.run(scenario())
+    
+    # Chat 7 runs one message at a time; chat 8 does not wait for it
+    assert running == ["start 1", "start 4"]
+    assert events.index("end 1") < events.index("start 2")
+    assert rejected == [3]
+    assert (stats['processed'], stats['rejected'], stats['busy_chats']) == (3, 1, 0)
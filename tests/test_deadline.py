@@ -0,0 +1,23 @@
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from utils.deadline import REQUEST_DEADLINE_MAX, Deadline, DeadlineExceeded
+
+
+@pytest.mark.parametrize('value', ['inf', '-inf', 'nan', '-5', '0', 'amanhã'])
+def test_unusable_header_values_mean_no_deadline(value):
+    assert Deadline.from_header(value).expires_at is None
+
+
+def test_header_deadline_is_capped():
+    deadline = Deadline.from_header(str(time.time() + 10 * REQUEST_DEADLINE_MAX))
+    assert deadline.remaining() <= REQUEST_DEADLINE_MAX
+
+
+def test_wait_gives_up_when_the_deadline_passes():
+    deadline = Deadline(time.time() + 0.1)
+    with pytest.raises(DeadlineExceeded) as error:
+        deadline.wait(Future(), "upstream")
+    assert (error.value.stage, error.value.reason) == ("upstream", "deadline")
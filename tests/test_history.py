@@ -0,0 +1,60 @@
+import sqlite3
+
+from database import Database
+
+
+def stores_text_copy(db) -> bool:
+    """Whether the FTS index has its own content table (a copy of every text)."""
+    with db._get_connection() as conn:
+        return conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'query_history_fts_content'"
+        ).fetchone() is not None
+
+
+def test_history_index_keeps_no_copy_of_the_texts(tmp_path):
+    db = Database(str(tmp_path / 'history.db'))
+    db.log_query(1, 'telegram', "Resuma o seguinte texto: " + "palavra " * 2000, 'sonar', 'writing',
+                 answer="Um resumo curto sobre fotossíntese")
+    
+    assert not stores_text_copy(db)
+    results = db.search_history("fotossintese", user_id=1, platform='telegram')['results']
+    assert len(results) == 1
+    assert results[0]['query'].startswith("Resuma o seguinte texto")
+    assert results[0]['answer_snippet'] == "Um resumo curto sobre *fotossíntese*"
+
+
+def test_purged_rows_leave_the_history_index(tmp_path):
+    db = Database(str(tmp_path / 'history.db'))
+    db.log_query(1, 'telegram', "preço do bitcoin", 'sonar', 'web', answer="cem mil")
+    db.log_query(1, 'telegram', "preço do ethereum", 'sonar', 'web')
+    with db._get_connection() as conn:
+        conn.execute("UPDATE query_logs SET created_at = '2000-01-01 00:00:00' WHERE id = 1")
+    
+    assert db.purge_expired('query_logs', 30) == 1
+    assert db.purge_orphan_query_texts() == 2
+    
+    assert db.search_history("preço", user_id=1, platform='telegram')['results'][0]['query'] == \
+        "preço do ethereum"
+    assert db.search_history("bitcoin")['results'] == []
+    with db._get_connection() as conn:
+        conn.execute("INSERT INTO query_history_fts (query_history_fts) VALUES ('integrity-check')")
+
+
+def test_plain_sqlite_connection_can_delete_logs(tmp_path):
+    path = str(tmp_path / 'history.db')
+    db = Database(path)
+    db.log_query(1, 'telegram', "capital da austrália", 'sonar', 'web', answer="Canberra")
+    db.log_query(1, 'telegram', "capital do canadá", 'sonar', 'web', answer="Ottawa")
+    
+    # No app-registered SQL functions on this connection
+    conn = sqlite3.connect(path)
+    conn.execute("DELETE FROM query_logs WHERE id = 1")
+    conn.commit()
+    conn.close()
+    
+    assert db.search_history("canberra")['results'] == []
+    db.rebuild_history_index()
+    [result] = db.search_history("capital", user_id=1, platform='telegram')['results']
+    assert result['query'] == "capital do canadá"
+    with db._get_connection() as conn:
+        conn.execute("INSERT INTO query_history_fts (query_history_fts) VALUES ('integrity-check')")
@@ -0,0 +1,30 @@
+from database import Database
+from database.idempotency import IDEMPOTENCY_TTL_MAX, IdempotencyStore, StoredResponse
+
+
+def test_stored_response_ttl_is_capped(tmp_path):
+    store = IdempotencyStore(Database(str(tmp_path / 'idem.db')), ttl=3600)
+    assert store.ttl == IDEMPOTENCY_TTL_MAX
+
+
+def test_late_original_leaves_a_new_claim_alone(tmp_path):
+    db = Database(str(tmp_path / 'idem.db'))
+    assert db.idempotency_claim('k', 'first', lease_seconds=-1) is None
+    # The lease expired and a different request took the key over
+    assert db.idempotency_claim('k', 'second', lease_seconds=60) is None
+    
+    db.idempotency_complete('k', 'first', 200, 'application/json', b'{}', 60)
+    db.idempotency_release('k', 'first')
+    
+    row = db.idempotency_claim('k', 'second', lease_seconds=60)
+    assert row['fingerprint'] == 'second'
+    assert row['state'] == 'pending'
+
+
+def test_failed_request_releases_its_key(tmp_path):
+    store = IdempotencyStore(Database(str(tmp_path / 'idem.db')))
+    store.execute('k', 'fp', lambda: StoredResponse(500, 'application/json', b'{}', False))
+    
+    ok = store.execute('k', 'fp', lambda: StoredResponse(200, 'application/json', b'{"ok":1}', False))
+    assert not ok.replayed
+    assert store.execute('k', 'fp', lambda: None).replayed
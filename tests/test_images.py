@@ -0,0 +1,33 @@
+import io
+
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+
+from utils.images import prepare_image  # noqa: E402
+
+
+def small_jpeg(**save_options) -> bytes:
+    buffer = io.BytesIO()
+    image = Image.merge('RGB', [Image.effect_noise((64, 48), 64)] * 3)
+    image.save(buffer, format='JPEG', quality=20, **save_options)
+    return buffer.getvalue()
+
+
+def test_small_image_without_metadata_is_sent_unchanged():
+    data = small_jpeg()
+    assert prepare_image(data, max_side=1024) == data
+
+
+def test_small_image_with_exif_is_stripped():
+    exif = Image.Exif()
+    exif[0x010F] = "PhoneMaker"  # Make
+    exif[0x8825] = {2: (23.0, 33.0, 0.0)}  # GPSInfo latitude
+    data = small_jpeg(exif=exif.tobytes(), icc_profile=b'\0' * 128)
+    
+    prepared = prepare_image(data, max_side=1024)
+    
+    with Image.open(io.BytesIO(prepared)) as image:
+        assert not image.info.get('exif')
+        assert not image.info.get('icc_profile')
+        assert image.size == (64, 48)
@@ -0,0 +1,28 @@
+import pytest
+
+from database import Database
+
+
+def test_inline_queries_are_migrated_once(tmp_path, monkeypatch):
+    path = str(tmp_path / 'texts.db')
+    db = Database(path)
+    with db._get_connection() as conn:
+        conn.execute("PRAGMA user_version = 0")
+        conn.execute(
+            "INSERT INTO query_logs (user_id, platform, query, model, focus) "
+            "VALUES (1, 'telegram', 'cotação do dólar', 'sonar', 'web')"
+        )
+    
+    db = Database(path)
+    with db._get_connection() as conn:
+        row = conn.execute(
+            "SELECT l.query, query_text(t.compressed, t.body) AS text FROM query_logs l "
+            "JOIN query_texts t ON t.hash = l.query_hash"
+        ).fetchone()
+    assert (row['query'], row['text']) == (None, 'cotação do dólar')
+    
+    def scan(*args, **kwargs):
+        pytest.fail("query_logs scanned again")
+    
+    monkeypatch.setattr(Database, 'migrate_query_texts', scan)
+    Database(path)
@@ -0,0 +1,18 @@
+from renderers import split_chunks
+
+
+def test_underscore_in_link_url_is_not_markup():
+    text = 'Veja [docs](https://example.com/my_page).\n\n' + 'palavra ' * 600
+    
+    chunks = split_chunks(text, 'telegram', 1000)
+    
+    assert len(chunks) > 1
+    assert chunks[0].count('_') == 1
+    assert all('_' not in chunk for chunk in chunks[1:])
+
+
+def test_open_bold_is_closed_and_reopened_across_chunks():
+    chunks = split_chunks('*negrito ' + 'palavra ' * 300 + 'fim*', 'telegram', 1000)
+    
+    assert len(chunks) > 1
+    assert all(chunk.startswith('*') and chunk.endswith('*') for chunk in chunks)
@@ -0,0 +1,61 @@
+import gzip
+import json
+import sqlite3
+
+from database import Database
+from database.retention import GzipArchiver, RetentionWorker
+
+
+def test_archived_query_log_keeps_question_text(tmp_path):
+    db = Database(str(tmp_path / 'retention.db'))
+    db.log_query(1, 'telegram', "Qual a capital da Austrália?", 'sonar', 'web', 1200)
+    with db._get_connection() as conn:
+        conn.execute("UPDATE query_logs SET created_at = '2000-01-01 00:00:00'")
+    
+    archived = []
+    deleted = db.purge_expired('query_logs', 30, archive=lambda table, rows: archived.extend(rows))
+    
+    assert deleted == 1
+    assert archived[0]['query'] == "Qual a capital da Austrália?"
+    assert db.purge_orphan_query_texts() == 1
+
+
+def test_gzip_archive_contains_question_text(tmp_path):
+    db = Database(str(tmp_path / 'retention.db'))
+    db.log_query(1, 'telegram', "preço do bitcoin", 'sonar', 'web', 900)
+    with db._get_connection() as conn:
+        conn.execute("UPDATE query_logs SET created_at = '2000-01-01 00:00:00'")
+    
+    db.purge_expired('query_logs', 30, archive=GzipArchiver(str(tmp_path / 'archive')))
+    
+    [path] = (tmp_path / 'archive').iterdir()
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        rows = [json.loads(line) for line in f]
+    assert rows[0]['query'] == "preço do bitcoin"
+
+
+
+def legacy_database(path):
+    """A database created before auto_vacuum=INCREMENTAL was the default."""
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE filler (data BLOB)")
+    conn.execute("INSERT INTO filler VALUES (zeroblob(2 * 1024 * 1024))")
+    conn.commit()
+    conn.close()
+    return Database(path)
+
+
+def test_worker_skips_in_place_conversion_of_large_database(tmp_path, caplog):
+    db = legacy_database(str(tmp_path / 'large.db'))
+    worker = RetentionWorker(db, {'query_logs': 30}, vacuum_convert_max_mb=1)
+    
+    worker.run_once()
+    
+    assert not db.incremental_vacuum_enabled()
+    assert 'vacuum_db.py' in caplog.text
+
+
+def test_worker_converts_small_database(tmp_path):
+    db = legacy_database(str(tmp_path / 'small.db'))
+    RetentionWorker(db, {'query_logs': 30}, vacuum_convert_max_mb=16).run_once()
+    assert db.incremental_vacuum_enabled()
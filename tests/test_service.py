@@ -0,0 +1,149 @@
+import threading
+import time
+
+import pytest
+
+from database import Database
+from service import PerplexoService, ServiceError
+from utils.deadline import Deadline
+
+
+class FakeScraper:
+    """Scraper answering from a queue of canned results."""
+    
+    def __init__(self):
+        self.results = []
+        self.queries = []
+        self.upload_cache = {}
+    
+    def ask(self, query, model='sonar', focus='web', enable_reasoning=False, **kwargs):
+        self.queries.append(query)
+        if self.results:
+            return dict(self.results.pop(0))
+        return {"text": f"Resposta: {query}", "citations": [], "images": [],
+                "model_used": model, "focus_mode": focus, "simulated": False}
+    
+    def ask_with_image(self, query, image_path, model='sonar-pro', **kwargs):
+        return self.ask(query, model, 'vision')
+
+
+@pytest.fixture
+def service(tmp_path):
+    service = PerplexoService(Database(str(tmp_path / 'service.db')), FakeScraper(),
+                              persist_cache=False)
+    yield service
+    service.upstream.shutdown(wait=False)
+
+
+def test_simulated_answer_is_not_cached(service):
+    service.scraper.results.append({
+        "text": "Sua pergunta: *segredo do usuário 1*", "citations": [], "images": [],
+        "simulated": True
+    })
+    
+    first = service.search({"query": "segredo do usuário 1", "user_id": 1})
+    second = service.search({"query": "segredo do usuário 1", "user_id": 2})
+    
+    assert first['simulated'] is True
+    assert not second.get('cached')
+    assert len(service.scraper.queries) == 2
+
+
+def test_rendering_a_new_variant_keeps_the_answer_expiry(service):
+    service.search({"query": "capital da austrália", "user_id": 1, "render": "telegram"})
+    [key] = list(service.answer_cache._data)
+    service.answer_cache.set(key, service.answer_cache.get(key), ttl=5)
+    
+    service.search({"query": "capital da austrália", "user_id": 1, "render": "whatsapp"})
+    
+    assert service.answer_cache.ttl_remaining(key) <= 5
+    assert set(service.answer_cache.get(key)['rendered']) == {'telegram:0', 'whatsapp:0'}
+
+
+def test_voice_message_costs_one_rate_limit_unit(service, monkeypatch):
+    monkeypatch.setenv('OPENAI_API_KEY', 'test')
+    monkeypatch.setattr(service, 'transcribe',
+                        lambda data, audio: {"text": "previsão do tempo", "language": "pt"})
+    service.rate_limit_messages = 1
+    
+    events = list(service.voice_ask({"user_id": 7, "platform": "telegram"}, b'ogg'))
+    
+    assert [event['event'] for event in events] == ['transcript', 'answer']
+
+
+def test_callers_sharing_an_upstream_call_get_their_own_answer(service, monkeypatch):
+    entered, release, shared = threading.Event(), threading.Event(), threading.Event()
+    counted = service.count
+    
+    def count(name, value=1):
+        if name == "upstream:shared":
+            shared.set()
+        counted(name, value)
+    
+    def ask(query, **kwargs):
+        entered.set()
+        release.wait(5)
+        return {"text": "Resposta", "citations": ["https://example.com"],
+                "images": ["https://example.com/a.jpg"], "simulated": False}
+    
+    monkeypatch.setattr(service, 'count', count)
+    monkeypatch.setattr(service.scraper, 'ask', ask)
+    results = {}
+    
+    def search(name, **options):
+        results[name] = service.search(dict(query="eclipse solar", **options))
+    
+    first = threading.Thread(target=search, args=('first',),
+                             kwargs={'render': 'telegram', 'return_citations': False})
+    first.start()
+    assert entered.wait(5)
+    second = threading.Thread(target=search, args=('second',), kwargs={'return_images': True})
+    second.start()
+    assert shared.wait(5)
+    release.set()
+    first.join(5)
+    second.join(5)
+    
+    assert results['first']['images'] == [] and results['first']['citations'] == []
+    assert results['second']['images'] == ["https://example.com/a.jpg"]
+    assert results['second']['citations'] == ["https://example.com"]
+    assert 'chunks' not in results['second']
+    [key] = list(service.answer_cache._data)
+    cached = service.answer_cache.get(key)['result']
+    assert cached['images'] == ["https://example.com/a.jpg"]
+    assert 'chunks' not in cached and 'response_time_ms' not in cached
+
+
+def test_vision_answer_is_rendered_in_chunks(service):
+    service.scraper.results.append({"text": "Um gato. " * 1000, "citations": [], "images": []})
+    
+    result = service.vision({"query": "o que é isto?", "render": "telegram", "preprocessed": True},
+                            b'imagem')
+    
+    assert len(result['chunks']) > 1
+    assert all(len(chunk) <= 4096 for chunk in result['chunks'])
+
+
+def test_expired_deadline_is_rejected_before_any_work(service):
+    with pytest.raises(ServiceError) as error:
+        service.search({"query": "cotação do dólar", "user_id": 1}, deadline=Deadline(time.time() - 1))
+    
+    assert error.value.status == 504
+    assert error.value.payload['stage'] == 'admission'
+    assert service.scraper.queries == []
+
+
+def test_slow_upstream_answers_504_and_is_cached_for_the_retry(service, monkeypatch):
+    ask = service.scraper.ask
+    
+    def slow_ask(query, **kwargs):
+        time.sleep(0.3)
+        return ask(query, **kwargs)
+    
+    monkeypatch.setattr(service.scraper, 'ask', slow_ask)
+    with pytest.raises(ServiceError) as error:
+        service.search({"query": "eclipse solar"}, deadline=Deadline(time.time() + 0.05))
+    assert (error.value.status, error.value.payload['stage']) == (504, 'upstream')
+    
+    time.sleep(0.5)
+    assert service.search({"query": "eclipse solar"})['cached'] is True
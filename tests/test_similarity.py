@@ -0,0 +1,32 @@
+import pytest
+
+from utils.similarity import SimilarityIndex, fold_query
+
+
+@pytest.mark.parametrize('first, second', [
+    ("receita de bolo com glúten", "receita de bolo sem glúten"),
+    ("por que o céu é azul", "o céu é azul"),
+    ("quem descobriu o brasil", "quando descobriram o brasil"),
+])
+def test_opposite_meanings_fold_differently(first, second):
+    assert fold_query(first) != fold_query(second)
+
+
+@pytest.mark.parametrize('first, second', [
+    ("receita de bolo com glúten", "receita de bolo sem glúten"),
+    ("preço do bitcoin em 2023", "preço do bitcoin em 2024"),
+])
+def test_opposite_meanings_do_not_match(first, second):
+    index = SimilarityIndex(maxsize=16)
+    index.add('first', 'sonar:web:0', first)
+    
+    match = index.query('sonar:web:0', second)
+    
+    assert match is None or match[1] < 0.85
+
+
+def test_paraphrase_matches():
+    index = SimilarityIndex(maxsize=16)
+    index.add('bitcoin', 'sonar:web:0', "qual o preço do bitcoin hoje?")
+    
+    assert index.query('sonar:web:0', "Preço do Bitcoin hoje!!") == ('bitcoin', 1.0)
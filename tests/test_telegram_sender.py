@@ -0,0 +1,63 @@
+import asyncio
+
+from telegram.error import RetryAfter
+
+from utils.telegram_sender import PRIORITY_FIRST, PRIORITY_LOW, OutboundScheduler
+
+
+def scheduler() -> OutboundScheduler:
+    return OutboundScheduler(None, global_rate=1000, chat_rate=1000, group_rate=1000, workers=1)
+
+
+def test_chats_follow_priority_and_each_chat_keeps_its_order():
+    async def scenario():
+        sender = scheduler()
+        sent = []
+        
+        def send(name):
+            async def call():
+                sent.append(name)
+            return call
+        
+        futures = [
+            sender.submit(1, send('a1')),
+            sender.submit(1, send('a2'), priority=PRIORITY_FIRST),
+            sender.submit(2, send('b1'), priority=PRIORITY_FIRST),
+            sender.submit(3, send('c1'), priority=PRIORITY_LOW),
+        ]
+        sender.start()
+        await asyncio.gather(*futures)
+        await sender.stop()
+        return sent
+    
+    assert asyncio.run(scenario()) == ['b1', 'a1', 'a2', 'c1']
+
+
+def test_retry_after_pauses_only_that_chat_and_retries_in_place():
+    async def scenario():
+        sender = scheduler()
+        attempts = []
+        
+        async def flooded():
+            attempts.append('x')
+            if attempts.count('x') == 1:
+                raise RetryAfter(0.05)
+            return 'x'
+        
+        def send(name):
+            async def call():
+                attempts.append(name)
+                return name
+            return call
+        
+        futures = [sender.submit(1, flooded), sender.submit(1, send('y')), sender.submit(2, send('z'))]
+        sender.start()
+        results = await asyncio.gather(*futures)
+        await sender.stop()
+        return attempts, results, sender.stats()
+    
+    attempts, results, stats = asyncio.run(scenario())
+    
+    assert attempts == ['x', 'z', 'x', 'y']
+    assert results == ['x', 'y', 'z']
+    assert (stats['sent'], stats['retried'], stats['failed']) == (3, 1, 0)
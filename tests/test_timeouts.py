@@ -0,0 +1,32 @@
+import pytest
+
+from utils.timeouts import DEFAULT_SEARCH_TIMEOUTS, AdaptiveTimeouts
+
+
+def test_default_until_enough_samples():
+    timeouts = AdaptiveTimeouts(min_samples=20)
+    for _ in range(19):
+        timeouts.observe('search', 'sonar', 2.0)
+    assert timeouts.timeout('search', 'sonar') == DEFAULT_SEARCH_TIMEOUTS['sonar']
+
+
+def test_timeout_follows_the_p99_latency():
+    timeouts = AdaptiveTimeouts(percentile=99, factor=2.0, floor=1, ceiling=300, min_samples=20)
+    for _ in range(99):
+        timeouts.observe('search', 'sonar-pro', 3.0)
+    timeouts.observe('search', 'sonar-pro', 12.0)
+    
+    # 99 of 100 calls took 3 s: the p99 is the 3 s bucket, doubled
+    assert timeouts.timeout('search', 'sonar-pro') == pytest.approx(6.0, rel=0.1)
+    # Other endpoints and models keep their own defaults
+    assert timeouts.timeout('vision', 'sonar-pro') == 90.0
+
+
+def test_learned_timeout_stays_within_floor_and_ceiling():
+    timeouts = AdaptiveTimeouts(floor=5, ceiling=120, min_samples=5)
+    for _ in range(5):
+        timeouts.observe('search', 'sonar', 0.2)
+        timeouts.observe('search', 'deep-research', 100.0)
+    
+    assert timeouts.timeout('search', 'sonar') == 5
+    assert timeouts.timeout('search', 'deep-research') == 120